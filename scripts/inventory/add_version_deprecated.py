@@ -5,10 +5,11 @@ The block between the route decorator and the method is delimited exactly (count
 respecting strings and comments) - a window over a fixed number of lines misses a multi-line
 `@ApiOperation({ ... deprecated: true })`. The parsing is shared through tsparse.py.
 """
-import re, glob, os, json
+import re, os
 
-from tsparse import (HTTP, controller_arg, controller_scopes, decorator_block, full_path,
-                     read_text, scope_at)
+import incremental, workdir
+from srcindex import controller_scopes, shared
+from tsparse import IntervalIndex, full_path, rel_path, scope_at
 
 SP = os.environ.get("INVENTORY_WORK")
 if not SP:
@@ -23,8 +24,6 @@ DEFAULT_VERSION = '1'
 # if the configured value ever changes, this line has to follow it.
 NAMED = {'GetConfig().kycVersion': '2'}
 
-CTRL_START = re.compile(r'@Controller\s*\(')
-
 
 def scope_version(arg):
     if not arg or not arg.startswith('{'): return DEFAULT_VERSION
@@ -35,37 +34,36 @@ def scope_version(arg):
 
 
 flags = {}
-for f in sorted(glob.glob(os.path.join(SRC, '**', '*.controller.ts'), recursive=True)):
-    if '__tests__' in f: continue
-    s = read_text(f)
-    scopes = controller_scopes(s)
+INDEX = shared(SRC)
+PLAN = incremental.load_plan()
+for f in INDEX.paths():
+    if not f.endswith('.controller.ts') or '__tests__' in f: continue
+    # Incremental: rows of untouched controllers keep the flags of the run they came from.
+    if PLAN and not PLAN.touches(rel_path(SRC, f)): continue
+    e = INDEX.get(f)
+    scopes = controller_scopes(e)
     if not scopes: continue
     # The version rides on the same scope boundaries as the path, but needs the raw argument
     # text, which controller_scopes() does not keep.
-    versions = [(m.start(), scope_version(controller_arg(s, m.end() - 1)))
-                for m in CTRL_START.finditer(s)]
-    for m in HTTP.finditer(s):
-        base, _cls = scope_at(scopes, m.start())
-        ver = DEFAULT_VERSION
-        for pos, v in versions:
-            if pos < m.start(): ver = v
-            else: break
-        block, _ = decorator_block(s, m.end())
+    versions = IntervalIndex((pos, scope_version(arg)) for pos, arg, _ in e['controllers'])
+    for rpos, verb, path, block, _ in e['routes']:
+        base, _cls = scope_at(scopes, rpos)
+        ver = versions.at(rpos, DEFAULT_VERSION)
         vm = re.search(r'@Version\(\s*([^)]*)\s*\)', block)
         if vm:
             a = vm.group(1).strip()
             ver = 'neutral' if 'NEUTRAL' in a else a.strip('[]\'" ')
         dep = bool(re.search(r'deprecated\s*:\s*true', block))
-        flags.setdefault((m.group(1).upper(), full_path(base, m.group(2) or '')), []).append((ver, dep))
+        flags.setdefault((verb.upper(), full_path(base, path or '')), []).append((ver, dep))
 
-with open(SP + '/table.json') as fh:
-    rows = json.load(fh)
+rows = workdir.load('table.json')
 
 # A route present in table.json but absent from `flags` would silently receive the default
 # version and `deprecated = False`. Both scans read the same controllers with the same parser,
 # so a miss means they disagree - which is a defect, not a row to fill in with a guess.
 used, missing = {}, []
 for r in rows:
+    if PLAN and not PLAN.touches(r['file']): continue
     key = (r['verb'], r['path'])
     n = used.get(key, 0); used[key] = n + 1
     lst = flags.get(key, [])
@@ -80,8 +78,7 @@ if missing:
     raise SystemExit(f"{len(missing)} of {len(rows)} routes have no decorator match - the route "
                      "scan and the version scan disagree, fix them before continuing")
 
-with open(SP + '/table.json', 'w') as fh:
-    json.dump(rows, fh, indent=1)
+workdir.save('table.json', rows)
 
 from collections import Counter
 print('versions:', dict(Counter(r['version'] for r in rows)))
@@ -13,14 +13,24 @@ What is transferred is therefore only what comparing TWO runs of the SAME chain
 The column count of existing rows stays as published: it comes from the rule set of this PR,
 and the measurement has not changed for them.
 
+Where the two runs come from: `gen/old/` and `gen/new/` under `$INVENTORY_WORK` if they are
+there, as before. Otherwise from the artifact cache (`artifacts.py`), by the git tree of
+`src/`. The old run needs no measurement - only where each site was - so when the cache has
+none for the publication commit, this makes it: `src/` of <pub_ref>, read straight from the
+git objects of `$INVENTORY_REPO`, scanned by `sites.py`, and kept for every later drift run. The new run is
+the one `inventory.py run` last made of `$API_SRC`, which it keeps there itself.
+
 This rewrites the table only. The counts in the surrounding prose ("N load sites across M
 files", the median figures under *Measurements*) are NOT updated - the statistics printed at
 the end and written to <out>.stats.json are what you carry over by hand.
 """
-import json, os, re, statistics, subprocess, sys
+import json, os, re, statistics, subprocess, sys, tempfile
 from collections import defaultdict
 
+import artifacts
 import classify
+import tsparse
+import workdir
 
 S = os.environ.get("INVENTORY_WORK")
 if not S:
@@ -33,6 +43,10 @@ if not SRC:
     raise SystemExit("API_SRC is not set - see scripts/inventory/README.md")
 
 KEY = lambda s: (s['file'], s['cls'], s['method'], s['call'], s['entity'])
+# What is read of each run: the matching key and the line for the old one, and for the new one
+# what a new row renders and what the write rule reads. A columnar run loads just these.
+OLD_COLUMNS = ('file', 'line', 'cls', 'method', 'call', 'entity')
+NEW_COLUMNS = OLD_COLUMNS + ('col', 'kind', 'select', 'cols', 'joins')
 CELL = lambda r, i: r.split('|')[i].strip().strip('`')
 
 
@@ -51,18 +65,66 @@ def render(s):
     return f"| {c} | {j} | {mech} | `{ent}` | `{s['file'].removeprefix('src/')}:{s['line']}` | `{s['cls']}.{s['method']}` |"
 
 
-def load_run(which):
-    path = f"{S}/gen/{which}/sites-measured.json"
-    if not os.path.exists(path):
-        raise SystemExit(f"{path} is missing - run the inventory chain for the '{which}' state "
-                         "first, see scripts/inventory/README.md")
-    with open(path) as fh:
-        sites = json.load(fh)
+def given(which, *names):
+    """The first of names in `gen/<which>/`, if a run was put there by hand."""
+    for name in names:
+        path = workdir.locate(f"{S}/gen/{which}", name)
+        if path:
+            return path
+    return None
+
+
+def read_run(which, path, columns):
+    sites = workdir.read(path, columns)
     if not sites:
         raise SystemExit(f"{path} is empty - the '{which}' run produced no load sites")
     return sites
 
 
+def scan_commit(ref, columns):
+    """The sites of `src/` at ref in the publication repository, from the artifact cache, or
+    scanned now and kept there."""
+    tree = artifacts.tree_of(REPO, ref)
+    cache = artifacts.ArtifactCache()
+    slot = cache.fetch(tree)
+    path = slot and workdir.locate(slot, 'sites.json')
+    if path:
+        print(f"  old run: {ref} (tree {tree[:12]}) from the artifact cache")
+        return read_run('old', path, columns)
+    print(f"  old run: {ref} (tree {tree[:12]}) not cached - scanning it from git")
+    with tempfile.TemporaryDirectory() as work:
+        # Read from the object database (`source.py`): the commit is never checked out.
+        env = dict(os.environ, API_SRC=os.path.join(REPO, 'src'), INVENTORY_REF=ref, INVENTORY_WORK=work)
+        env.pop('INVENTORY_PLAN', None)
+        r = subprocess.run([sys.executable, os.path.join(artifacts.HERE, 'sites.py')],
+                           capture_output=True, text=True, env=env)
+        if r.returncode != 0:
+            raise SystemExit(f"sites.py failed on {ref}: {r.stderr.strip()[-400:]}")
+        cache.store(tree, work, [workdir.filename('sites.json'), 'entities.json'])
+        return read_run('old', workdir.locate(work, 'sites.json'), columns)
+
+
+def current_run(columns):
+    """The measured sites of the last `inventory.py run` over `$API_SRC` as it is now."""
+    tree = artifacts.worktree_tree(SRC)
+    slot = tree and artifacts.ArtifactCache().fetch(tree)
+    path = slot and workdir.locate(slot, 'sites-measured.json')
+    if not path:
+        raise SystemExit(f"no run of {SRC} as it is now - run `scripts/inventory/run.sh` first, or "
+                         f"put one under {S}/gen/new/, see scripts/inventory/README.md")
+    print(f"  new run: {SRC} (tree {tree[:12]}) from the artifact cache")
+    return read_run('new', path, columns)
+
+
+def load_run(which, columns, ref=None):
+    if which == 'old':
+        # Everything the old run is read for is known before the measurement.
+        path = given('old', 'sites-measured.json', 'sites.json')
+        return read_run('old', path, columns) if path else scan_commit(ref, columns)
+    path = given('new', 'sites-measured.json')
+    return read_run('new', path, columns) if path else current_run(columns)
+
+
 def main(pub_ref, pub_path, out_path):
     show = subprocess.run(["git", "-C", REPO, "show", f"{pub_ref}:{pub_path}"],
                           capture_output=True, text=True)
@@ -71,12 +133,12 @@ def main(pub_ref, pub_path, out_path):
                          f"{show.stderr.strip() or 'unknown error'}")
     pub = show.stdout
 
-    old = load_run('old')
+    old = load_run('old', OLD_COLUMNS, pub_ref)
     # The write/lock rule must be the same one the renderer applies, and it is derived from the
     # source rather than stored in sites-measured.json - annotating here is what makes the
     # filter below actually match. Without it, `.update()` chains, advisory locks and raw
     # INSERTs would be inserted into the document as load sites.
-    new = classify.annotate(SRC, load_run('new'))
+    new = classify.annotate(SRC, load_run('new', NEW_COLUMNS))
 
     by_line = {(s['file'], s['line']): s for s in old}
     old_pool = defaultdict(list)
@@ -134,6 +196,7 @@ def main(pub_ref, pub_path, out_path):
     print(f"  kept={len(kept)}  removed={dropped}  line reference updated={moved}  new={len(added)}")
     print(f"  result: {json.dumps(stats, default=str)}")
     print("  the prose counts in the document are NOT updated - carry the figures above over by hand")
+    print(f"  {tsparse.FILES.report()}")
 
     out = pub.split('\n')
     first = out.index(header)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Run artifacts by the git tree of the `src/` they were made from.
+
+`apply_drift.py` compares two runs - one of the commit a document was published from, one of
+the current tree - and each used to be a full chain run by hand into `gen/old/` and `gen/new/`.
+The publication commit does not change, so its run comes out the same every time. Here the
+tables of a run are kept under the hash git gives the `src/` tree they were made from, so that
+run is made once and fetched on every later drift application, and the run of the current
+tree that `inventory.py run` just made is found the same way.
+
+    $INVENTORY_CACHE/artifacts/<tree>/<code>/    the tables of one run
+
+`<tree>` is `git rev-parse <ref>:src` for a commit, and for a working tree the hash the same
+tree would get if it were committed. That one is worked out without writing anything: the
+repository's index gives the blob of every file that matches it, `git hash-object` (no `-w`)
+hashes the ones modified or untracked, and the tree objects are hashed here, not stored - the
+checkout, its index and `.git/objects` are left as they were. `<code>` is a hash of the
+scripts of the chain (`CHAIN`): a run made by other rules is another run. Files ignored by git
+are not part of a working tree's hash.
+"""
+import hashlib, os, shutil, stat, subprocess
+
+from srcindex import cache_dir
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# What is kept of a run: every table a later comparison may read. The documents are not.
+RUN_FILES = ('sites.json', 'entities.json', 'sites-measured.json', 'meta-tables.json', 'table.json',
+             'endpoint-eff.json')
+# Trees kept. The publication commit's is fetched on every drift run and so always among them.
+ARTIFACTS_KEEP = 8
+
+
+# What a run is made by: the steps of `inventory.STEPS` and the modules they import. The tests,
+# the benchmark, `watch.py` and the command line are not, and editing them keeps every run.
+CHAIN = ('sites.py', 'measure.js', 'make_table.py', 'fix_handlers.py', 'add_version_deprecated.py',
+         'endpoint_eff.py', 'index_coverage.py', 'eager_impact.py', 'cron_load.py', 'store.py',
+         'build_docs.py', 'tsparse.py', 'classify.py', 'srcindex.py', 'source.py', 'callgraph.py',
+         'crontab.py', 'incremental.py', 'workdir.py', 'colstore.py', 'pool.py')
+
+
+def code_digest(directory=HERE):
+    """Hash of the scripts of the chain. The whole chain rather than each step's own imports:
+    a shared module changes what every step that uses it produces."""
+    h = hashlib.sha1()
+    for n in sorted(CHAIN):
+        with open(os.path.join(directory, n), 'rb') as fh:
+            h.update(n.encode() + b'\0' + hashlib.sha1(fh.read()).digest())
+    return h.hexdigest()
+
+
+def _git(cwd, *args, env=None):
+    r = subprocess.run(['git', '-C', cwd, *args], capture_output=True, text=True,
+                       env=None if env is None else dict(os.environ, **env))
+    if r.returncode != 0:
+        raise SystemExit(f"git {' '.join(args)} failed in {cwd}: {r.stderr.strip() or 'unknown error'}")
+    return r.stdout.strip()
+
+
+def tree_of(repo, ref, path='src'):
+    """The tree hash of path at ref in repo."""
+    r = subprocess.run(['git', '-C', repo, 'rev-parse', '--verify', '--quiet', f'{ref}^{{commit}}:{path}'],
+                       capture_output=True, text=True)
+    if r.returncode != 0:
+        raise SystemExit(f"{ref}:{path} does not name a tree in {repo} - is the ref right?")
+    return r.stdout.strip()
+
+
+def worktree_tree(src):
+    """The tree hash src would have if it were committed now - what `git add --all` and
+    `git write-tree` would give - or None outside a git checkout."""
+    r = subprocess.run(['git', '-C', src, 'rev-parse', '--show-toplevel'], capture_output=True, text=True)
+    if r.returncode != 0:
+        return None
+    top = r.stdout.strip()
+    prefix = os.path.relpath(os.path.realpath(src), os.path.realpath(top))
+    spec = ['--', '.' if prefix == '.' else prefix]
+    z = lambda out: [p for p in out.split('\0') if p]
+    # Blob and mode of every file as the index has it; stage 0 only - an unmerged path is
+    # modified and hashed below.
+    entries = {}
+    for line in z(_git(top, 'ls-files', '--stage', '-z', *spec)):
+        meta, path = line.split('\t', 1)
+        mode, blob, stage_no = meta.split()
+        if stage_no == '0':
+            entries[path] = (mode, blob)
+    changed = set(z(_git(top, 'diff-files', '--name-only', '-z', *spec)))
+    changed |= set(z(_git(top, 'ls-files', '--others', '--exclude-standard', '-z', *spec)))
+    present = sorted(p for p in changed if os.path.lexists(os.path.join(top, p)))
+    for p in changed - set(present):
+        entries.pop(p, None)
+    if present:
+        r = subprocess.run(['git', '-C', top, 'hash-object', '--stdin-paths'],
+                           input='\n'.join(present) + '\n', capture_output=True, text=True)
+        if r.returncode != 0:
+            raise SystemExit(f"git hash-object failed in {top}: {r.stderr.strip() or 'unknown error'}")
+        for p, blob in zip(present, r.stdout.split()):
+            if p in entries and entries[p][0] == '160000':
+                continue        # a submodule: its commit is what the index records
+            st = os.lstat(os.path.join(top, p))
+            mode = '120000' if stat.S_ISLNK(st.st_mode) else '100755' if st.st_mode & 0o111 else '100644'
+            entries[p] = (mode, blob)
+    algo = _git(top, 'rev-parse', '--show-object-format')
+    inside = '' if prefix == '.' else prefix + '/'
+    return _tree({p[len(inside):]: e for p, e in entries.items() if p.startswith(inside)}, algo)
+
+
+def _tree(entries, algo):
+    """Hash of the tree object holding entries ({path: (mode, blob)}), subtrees included."""
+    files, dirs = {}, {}
+    for path, entry in entries.items():
+        head, sep, rest = path.partition('/')
+        if sep:
+            dirs.setdefault(head, {})[rest] = entry
+        else:
+            files[head] = entry
+    items = [(name, mode, blob) for name, (mode, blob) in files.items()]
+    items += [(name, '40000', _tree(sub, algo)) for name, sub in dirs.items()]
+    # Git orders a tree's entries by name, a subtree's as if it ended in '/'.
+    items.sort(key=lambda i: i[0].encode() + (b'/' if i[1] == '40000' else b''))
+    body = b''.join(f'{mode} {name}'.encode() + b'\0' + bytes.fromhex(blob) for name, mode, blob in items)
+    return hashlib.new(algo, b'tree %d\0' % len(body) + body).hexdigest()
+
+
+class ArtifactCache:
+    """The tables of earlier runs under `$INVENTORY_CACHE/artifacts/`, by tree and chain code."""
+
+    def __init__(self, root=None, code=None):
+        self.root = os.path.join(root or cache_dir(), 'artifacts')
+        self.code = code or code_digest()
+
+    def slot(self, tree):
+        return os.path.join(self.root, tree, self.code)
+
+    def fetch(self, tree):
+        """The directory holding the run of tree, or None if there is none."""
+        slot = self.slot(tree)
+        if not os.path.isdir(slot):
+            return None
+        os.utime(os.path.dirname(slot))
+        return slot
+
+    def store(self, tree, work, names):
+        """Keep the files names (those of them present in work) as the run of tree.
+
+        Adds to what is kept already: the files a drift run makes for the publication commit
+        and those a full run makes of the same tree end up in one place.
+        """
+        slot = self.slot(tree)
+        tmp = f'{slot}.{os.getpid()}.tmp'
+        # Copied under a private name and renamed into place: a cache that cannot be written
+        # costs the next run time, never this one its result.
+        try:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if os.path.isdir(slot):
+                shutil.copytree(slot, tmp)
+            else:
+                os.makedirs(tmp)
+            for n in names:
+                if os.path.exists(os.path.join(work, n)):
+                    shutil.copyfile(os.path.join(work, n), os.path.join(tmp, n))
+            shutil.rmtree(slot, ignore_errors=True)
+            os.replace(tmp, slot)
+            os.utime(os.path.dirname(slot))
+            self._prune()
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return None
+        return slot
+
+    def _prune(self):
+        trees = sorted((os.path.join(self.root, n) for n in os.listdir(self.root)),
+                       key=os.path.getmtime, reverse=True)
+        for old in trees[ARTIFACTS_KEEP:]:
+            shutil.rmtree(old, ignore_errors=True)
+        # Runs made by an earlier version of the chain are never fetched again.
+        for tree in trees[:ARTIFACTS_KEEP]:
+            for n in os.listdir(tree):
+                if n != self.code and not n.endswith('.tmp'):
+                    shutil.rmtree(os.path.join(tree, n), ignore_errors=True)
+
@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+"""Scaling benchmark of the chain over generated NestJS trees.
+
+`selftest.py` checks that the chain is right on a fixture of four files; it says nothing about
+what a change to `tsparse.py` or `classify.py` costs on 2,200 files, or on ten times as many.
+This writes synthetic trees shaped like `src/` - controllers, services calling each other in
+cycles, repositories, entities with eager relations, long query-builder chains, DTOs,
+strategies and specs - at 1x, 5x and 20x its size, and times every step of the chain over each:
+
+    python3 bench.py run [--scales 1,5,20] [--jobs N] [--save-baseline] [--tolerance 25]
+    python3 bench.py generate <dir> [--scale N]          write a tree, for a look or a profile
+
+Every scale is run twice, each time in a process of its own: `cold`, with an empty source
+index, and `warm`, with the index the cold run left. The steps are timed by `stageprof.py`
+without its pattern counters, and `endpoint_eff` reports its phases - the call-graph
+propagation among them. No `dist/`, no database and no network are needed: `measure.js` is
+replaced by a stand-in that gives every site a column count, as in the self-test, and
+`build_docs.py` is left out, since it checks its hand-maintained tables against the real tree.
+
+The result goes to `$INVENTORY_CACHE/bench/last.json`. `--save-baseline` keeps it as the
+baseline, and every later run compares against that: a step more than `--tolerance` percent
+(and 50 ms) slower than its baseline fails the run. Timings are only comparable on one
+machine, so save the baseline on the branch a change starts from, then run the change.
+"""
+import argparse, json, os, shutil, subprocess, sys, tempfile, time, zlib
+
+from srcindex import cache_dir
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Bumped whenever the generated tree changes: a baseline of another tree compares nothing.
+CORPUS_VERSION = 1
+# Domains per 1x: about as many files as src/ has (2,197 when this was written).
+DOMAINS = 136
+NOUNS = ('Payment', 'Ledger', 'Account', 'Order', 'Asset', 'Wallet', 'Route', 'Quote', 'Fee',
+         'Invoice', 'Transfer', 'Deposit', 'Payout', 'Refund', 'Limit', 'Report', 'Custody',
+         'Settlement', 'Exchange', 'Mandate')
+AREAS = ('core', 'generic', 'supporting', 'integration')
+PASSES = ('cold', 'warm')
+# Below this a difference is noise, whatever the percentage.
+NOISE_S = 0.05
+
+
+# -- the generated tree ----------------------------------------------------------------
+
+class Domain:
+    """One generated domain, d of n: an entity and everything around it."""
+
+    def __init__(self, d, n):
+        self.d, self.n = d, n
+        self.name = f'{NOUNS[d % len(NOUNS)]}{d // len(NOUNS)}'
+        self.kebab = f'{NOUNS[d % len(NOUNS)].lower()}-{d // len(NOUNS)}'
+        self.var = self.name[0].lower() + self.name[1:]
+        self.dir = f'src/subdomains/{AREAS[d % len(AREAS)]}/{self.kebab}'
+        self.columns = 8 + d * 7 % 40
+        # The service calls two others: the next domain's in its group of eight - the calls go
+        # round the group, a cycle as the real service graph has them - and one in the next group.
+        group = d - d % 8
+        self.next = group + (d + 1 - group) % min(8, n - group)
+        self.far = (d + 8) % n
+        self.eager = d % 3 == 0
+        self.controller = d % 6 != 5
+        self.version = '2' if d % 5 == 0 else None
+        self.chain = 5 + d * 11 % 25
+
+    def other(self, d):
+        return Domain(d, self.n)
+
+    def files(self):
+        yield f'{self.dir}/{self.kebab}.entity.ts', self.entity()
+        yield f'{self.dir}/{self.kebab}.repository.ts', self.repository()
+        yield f'{self.dir}/services/{self.kebab}.service.ts', self.service()
+        for job in ('notification', 'job'):
+            yield f'{self.dir}/services/{self.kebab}-{job}.service.ts', self.helper(job)
+        if self.controller:
+            yield f'{self.dir}/{self.kebab}.controller.ts', self.controller_file()
+        yield f'{self.dir}/{self.kebab}.module.ts', self.module()
+        for dto in ('create', 'update', 'query'):
+            yield f'{self.dir}/dto/{dto}-{self.kebab}.dto.ts', self.dto(dto)
+        for strategy in ('primary', 'fallback'):
+            yield f'{self.dir}/strategies/{strategy}-{self.kebab}.strategy.ts', self.strategy(strategy)
+        for spec in ('service', 'notification', 'job', 'controller'):
+            yield f'{self.dir}/__tests__/{self.kebab}-{spec}.spec.ts', self.spec(spec)
+        if self.d % 3 == 0:
+            yield f'{self.dir}/{self.kebab}-status.enum.ts', self.enum()
+
+    def entity(self):
+        nxt, owner = self.other(self.next), self.other(self.far)
+        cols = ''.join(
+            f"  @Column({{ length: 256, nullable: true }})\n  field{i}?: string;\n\n" if i % 3 else
+            f"  @Column({{ type: 'float', default: 0 }})\n  amount{i}: number;\n\n"
+            for i in range(self.columns))
+        eager = ', eager: true' if self.eager else ''
+        return f"""import {{ IEntity }} from 'src/shared/models/entity';
+import {{ Column, Entity, Index, ManyToOne, OneToMany }} from 'typeorm';
+import {{ {nxt.name} }} from '../../{AREAS[nxt.d % len(AREAS)]}/{nxt.kebab}/{nxt.kebab}.entity';
+import {{ {owner.name} }} from '../../{AREAS[owner.d % len(AREAS)]}/{owner.kebab}/{owner.kebab}.entity';
+
+@Entity()
+@Index((e: {self.name}) => [e.next, e.field1], {{ unique: false }})
+export class {self.name} extends IEntity {{
+{cols}  @ManyToOne(() => {nxt.name}, {{ nullable: true{eager} }})
+  next?: {nxt.name};
+
+  @Index()
+  @ManyToOne(() => {owner.name}, {{ nullable: true }})
+  owner?: {owner.name};
+
+  @OneToMany(() => {owner.name}, (o) => o.owner)
+  owned: {owner.name}[];
+
+  // --- ENTITY METHODS --- //
+
+  get label(): string {{
+    return `${{this.field1 ?? ''}}/${{this.id}}`.replace(/\\s+/g, ' ');
+  }}
+}}
+"""
+
+    def repository(self):
+        return f"""import {{ Injectable }} from '@nestjs/common';
+import {{ BaseRepository }} from 'src/shared/repositories/base.repository';
+import {{ EntityManager }} from 'typeorm';
+import {{ {self.name} }} from './{self.kebab}.entity';
+
+@Injectable()
+export class {self.name}Repository extends BaseRepository<{self.name}> {{
+  constructor(manager: EntityManager) {{
+    super({self.name}, manager);
+  }}
+
+  async findLatest(limit: number): Promise<{self.name}[]> {{
+    return this.createQueryBuilder('e').orderBy('e.id', 'DESC').take(limit).getMany();
+  }}
+}}
+"""
+
+    def service(self):
+        nxt, far = self.other(self.next), self.other(self.far)
+        wheres = ''.join(f"      .andWhere('e.field{i % self.columns or 1} = :p{i}', {{ p{i}: filter.p{i} }})\n"
+                         for i in range(self.chain))
+        return f"""import {{ Injectable, NotFoundException }} from '@nestjs/common';
+import {{ In, IsNull, LessThan, MoreThan, Not }} from 'typeorm';
+import {{ {nxt.name}Service }} from '../../../{AREAS[nxt.d % len(AREAS)]}/{nxt.kebab}/services/{nxt.kebab}.service';
+import {{ {far.name}Service }} from '../../../{AREAS[far.d % len(AREAS)]}/{far.kebab}/services/{far.kebab}.service';
+import {{ Create{self.name}Dto }} from '../dto/create-{self.kebab}.dto';
+import {{ Update{self.name}Dto }} from '../dto/update-{self.kebab}.dto';
+import {{ {self.name} }} from '../{self.kebab}.entity';
+import {{ {self.name}Repository }} from '../{self.kebab}.repository';
+
+@Injectable()
+export class {self.name}Service {{
+  constructor(
+    private readonly repo: {self.name}Repository,
+    private readonly {nxt.var}Service: {nxt.name}Service,
+    private readonly {far.var}Service: {far.name}Service,
+  ) {{}}
+
+  async getById(id: number): Promise<{self.name}> {{
+    const entity = await this.repo.findOne({{ where: {{ id }}, relations: {{ next: true, owner: true }} }});
+    if (!entity) throw new NotFoundException('{self.name} not found');
+    return entity;
+  }}
+
+  async getAll(): Promise<{self.name}[]> {{
+    return this.repo.find();
+  }}
+
+  async getByIds(ids: number[]): Promise<{self.name}[]> {{
+    if (!ids.length) return [];
+    return this.repo.find({{
+      where: {{ id: In(ids) }},
+      relations: {{ next: {{ next: true }}, owner: true }},
+    }});
+  }}
+
+  async getByField(value: string): Promise<{self.name} | null> {{
+    return this.repo.findOneBy({{ field1: value, next: IsNull() }});
+  }}
+
+  async search(filter: Record<string, string>): Promise<{self.name}[]> {{
+    return this.repo
+      .createQueryBuilder('e')
+      .leftJoinAndSelect('e.next', 'next')
+      .leftJoinAndSelect('e.owner', 'owner')
+{wheres}      .orderBy('e.id', 'DESC')
+      .getMany();
+  }}
+
+  async getProjected(): Promise<Partial<{self.name}>[]> {{
+    return this.repo
+      .createQueryBuilder('e')
+      .select(['e.id', 'e.field1', 'e.field2'])
+      .where('e.created < :date', {{ date: new Date() }})
+      .getMany();
+  }}
+
+  async count(): Promise<number> {{
+    return this.repo.createQueryBuilder('e').where('e.field1 IS NOT NULL').getCount();
+  }}
+
+  async totals(): Promise<{{ total: number }}[]> {{
+    return this.repo.query(`SELECT SUM(amount0) AS total FROM {self.kebab.replace('-', '_')} WHERE id > $1`, [0]);
+  }}
+
+  async getStale(before: Date): Promise<{self.name}[]> {{
+    return this.repo.find({{ where: {{ updated: LessThan(before) }}, take: 100 }});
+  }}
+
+  async create(dto: Create{self.name}Dto): Promise<{self.name}> {{
+    const entity = this.repo.create(dto);
+    if (dto.nextId) entity.next = await this.{nxt.var}Service.getById(dto.nextId);
+    return this.repo.save(entity);
+  }}
+
+  async update(id: number, dto: Update{self.name}Dto): Promise<{self.name}> {{
+    const entity = await this.getById(id);
+    return this.repo.save({{ ...entity, ...dto }});
+  }}
+
+  async close(id: number): Promise<void> {{
+    await this.repo.createQueryBuilder().update().set({{ field1: 'closed' }}).where('id = :id', {{ id }}).execute();
+  }}
+
+  async related(id: number): Promise<unknown[]> {{
+    const [own, summary, far] = await Promise.all([
+      this.getById(id),
+      this.{nxt.var}Service.summary(id),
+      this.{far.var}Service.search({{ p0: `${{id}}` }}),
+    ]);
+    return [own, summary, ...far].filter((e) => e && !/^skip/.test(String(e)));
+  }}
+
+{self.reports()}
+  async summary(id: number): Promise<string> {{
+    const items = await this.{nxt.var}Service.related(id);
+    return items.map((i) => `${{(i as {{ id: number }}).id}}: ${{JSON.stringify({{ n: 1 }})}}`).join('; ');
+  }}
+}}
+"""
+
+    def reports(self):
+        """A few more reads per service, so the files are as long as the real ones."""
+        out = []
+        for k in range(6 + self.d % 8):
+            rel = "{ next: { owner: true }, owner: true }" if k % 2 else "{ next: true }"
+            out.append(f"""  /**
+   * Entries for report {k}: those changed since the cut-off, newest first, at most {50 * (k + 1)}.
+   * The relations are loaded here rather than by the caller, which only renders them.
+   */
+  async getForReport{k}(since: Date, status?: string): Promise<{self.name}[]> {{
+    const entries = await this.repo.find({{
+      where: {{ updated: MoreThan(since), field1: status ?? Not(IsNull()) }},
+      relations: {rel},
+      order: {{ id: 'DESC' }},
+      take: {50 * (k + 1)},
+    }});
+    return entries.filter((e) => e.amount0 >= {k} && !['{k}', `x${{e.id}}`].includes(e.field2 ?? ''));
+  }}
+
+  async getReport{k}Totals(from: Date, to: Date): Promise<{{ day: string; total: number }}[]> {{
+    return this.repo
+      .createQueryBuilder('e')
+      .select(`DATE(e.created)`, 'day')
+      .addSelect('SUM(e.amount0)', 'total')
+      .leftJoin('e.owner', 'owner')
+      .where('e.created BETWEEN :from AND :to', {{ from, to }})
+      .andWhere('owner.id IS NOT NULL')
+      .groupBy('DATE(e.created)')
+      .getRawMany();
+  }}
+""")
+        return '\n'.join(out)
+
+    def helper(self, job):
+        cls = f"{self.name}{job.capitalize()}Service"
+        return f"""import {{ Injectable }} from '@nestjs/common';
+import {{ InjectRepository }} from '@nestjs/typeorm';
+import {{ Repository }} from 'typeorm';
+import {{ {self.name} }} from '../{self.kebab}.entity';
+import {{ {self.name}Service }} from './{self.kebab}.service';
+
+@Injectable()
+export class {cls} {{
+  private readonly seen = new Map<number, Date>();
+
+  constructor(
+    @InjectRepository({self.name}) private readonly {self.var}Repo: Repository<{self.name}>,
+    private readonly {self.var}Service: {self.name}Service,
+  ) {{}}
+
+  async process(): Promise<void> {{
+    const pending = await this.{self.var}Repo.find({{ where: {{ field1: 'pending' }}, relations: {{ next: true }} }});
+    for (const entity of pending) {{
+      if (this.seen.has(entity.id)) continue;
+      this.seen.set(entity.id, new Date());
+      await this.{self.var}Service.update(entity.id, {{ field1: 'processed' }});
+    }}
+  }}
+
+  async report(): Promise<string> {{
+    const total = await this.{self.var}Service.count();
+    const rows = await this.{self.var}Repo.createQueryBuilder('e').select('e.id', 'id').addSelect('e.field1', 'f').getRawMany();
+    return `{job} ${{total}} / ${{rows.length}} ${{rows.map((r) => r.id).join(',')}}`;
+  }}
+}}
+"""
+
+    def controller_file(self):
+        scope = (f"{{ path: '{self.kebab}', version: ['{self.version}'] }}" if self.version else f"'{self.kebab}'")
+        return f"""import {{ Body, Controller, Get, Param, Post, Put, Query, UseGuards }} from '@nestjs/common';
+import {{ AuthGuard }} from '@nestjs/passport';
+import {{ ApiBearerAuth, ApiExcludeEndpoint, ApiOperation, ApiTags }} from '@nestjs/swagger';
+import {{ RoleGuard }} from 'src/shared/auth/role.guard';
+import {{ UserRole }} from 'src/shared/auth/user-role.enum';
+import {{ Create{self.name}Dto }} from './dto/create-{self.kebab}.dto';
+import {{ Update{self.name}Dto }} from './dto/update-{self.kebab}.dto';
+import {{ {self.name} }} from './{self.kebab}.entity';
+import {{ {self.name}Service }} from './services/{self.kebab}.service';
+
+@ApiTags('{self.name}')
+@Controller({scope})
+export class {self.name}Controller {{
+  constructor(private readonly {self.var}Service: {self.name}Service) {{}}
+
+  @Get()
+  @ApiBearerAuth()
+  @UseGuards(AuthGuard(), RoleGuard(UserRole.ADMIN))
+  async getAll(): Promise<{self.name}[]> {{
+    return this.{self.var}Service.getAll();
+  }}
+
+  @Get('search')
+  @ApiBearerAuth()
+  @UseGuards(AuthGuard(), RoleGuard(UserRole.ADMIN))
+  async search(@Query() filter: Record<string, string>): Promise<{self.name}[]> {{
+    return this.{self.var}Service.search(filter);
+  }}
+
+  @Get('projected')
+  async getProjected(): Promise<Partial<{self.name}>[]> {{
+    return this.{self.var}Service.getProjected();
+  }}
+
+  @Get('count')
+  @ApiOperation({{ description: 'number of (open) entries', deprecated: {str(self.d % 4 == 0).lower()} }})
+  async count(): Promise<number> {{
+    return this.{self.var}Service.count();
+  }}
+
+  @Get(':id')
+  async getById(@Param('id') id: string): Promise<{self.name}> {{
+    return this.{self.var}Service.getById(+id);
+  }}
+
+  @Get(':id/related')
+  async related(@Param('id') id: string): Promise<unknown[]> {{
+    return this.{self.var}Service.related(+id);
+  }}
+
+  @Post()
+  @ApiBearerAuth()
+  @ApiExcludeEndpoint()
+  @UseGuards(AuthGuard(), RoleGuard(UserRole.ADMIN))
+  async create(@Body() dto: Create{self.name}Dto): Promise<{self.name}> {{
+    return this.{self.var}Service.create(dto);
+  }}
+
+  @Put(':id')
+  @ApiBearerAuth()
+  @ApiExcludeEndpoint()
+  @UseGuards(AuthGuard(), RoleGuard(UserRole.ADMIN))
+  async update(@Param('id') id: string, @Body() dto: Update{self.name}Dto): Promise<{self.name}> {{
+    return this.{self.var}Service.update(+id, dto);
+  }}
+}}
+"""
+
+    def module(self):
+        controllers = f'{self.name}Controller' if self.controller else ''
+        return f"""import {{ Module }} from '@nestjs/common';
+import {{ TypeOrmModule }} from '@nestjs/typeorm';
+import {{ {self.name} }} from './{self.kebab}.entity';
+import {{ {self.name}Repository }} from './{self.kebab}.repository';
+import {{ {self.name}Service }} from './services/{self.kebab}.service';
+
+@Module({{
+  imports: [TypeOrmModule.forFeature([{self.name}])],
+  controllers: [{controllers}],
+  providers: [{self.name}Repository, {self.name}Service],
+  exports: [{self.name}Service],
+}})
+export class {self.name}Module {{}}
+"""
+
+    def dto(self, kind):
+        fields = ''.join(f"  @IsOptional()\n  @IsString()\n  @ApiPropertyOptional({{ description: 'field {i}' }})\n"
+                         f"  field{i}?: string;\n\n" for i in range(1, 2 + self.columns // 4))
+        return f"""import {{ ApiPropertyOptional }} from '@nestjs/swagger';
+import {{ IsInt, IsOptional, IsString }} from 'class-validator';
+
+export class {kind.capitalize()}{self.name}Dto {{
+{fields}  @IsOptional()
+  @IsInt()
+  nextId?: number;
+}}
+"""
+
+    def strategy(self, kind):
+        cls = f"{kind.capitalize()}{self.name}Strategy"
+        return f"""import {{ Injectable }} from '@nestjs/common';
+import {{ {self.name} }} from '../{self.kebab}.entity';
+import {{ {self.name}Service }} from '../services/{self.kebab}.service';
+
+@Injectable()
+export class {cls} {{
+  private readonly retries = {{ max: 3, delayMs: 1_000 }};
+
+  constructor(private readonly {self.var}Service: {self.name}Service) {{}}
+
+  async execute(ids: number[]): Promise<{self.name}[]> {{
+    const found = await this.{self.var}Service.getByIds(ids);
+    return found.filter((e) => e.field1 !== '{kind}' && !/\\/{{2,}}/.test(e.field2 ?? ''));
+  }}
+
+  describe(): string {{
+    return `{kind}: ${{this.retries.max}} tries, ${{this.retries.delayMs}} ms apart`; // not a /* comment */
+  }}
+}}
+"""
+
+    def spec(self, kind):
+        return f"""import {{ createMock }} from '@golevelup/ts-jest';
+import {{ Test, TestingModule }} from '@nestjs/testing';
+import {{ {self.name}Controller }} from '../{self.kebab}.controller';
+import {{ {self.name}Service }} from '../services/{self.kebab}.service';
+
+describe('{self.name} {kind}', () => {{
+  let controller: {self.name}Controller;
+  let service: {self.name}Service;
+
+  beforeEach(async () => {{
+    service = createMock<{self.name}Service>();
+    const module: TestingModule = await Test.createTestingModule({{
+      controllers: [{self.name}Controller],
+      providers: [{{ provide: {self.name}Service, useValue: service }}],
+    }}).compile();
+    controller = module.get<{self.name}Controller>({self.name}Controller);
+  }});
+
+  it('should be defined', () => {{
+    expect(controller).toBeDefined();
+  }});
+
+  it('returns every entry', async () => {{
+    jest.spyOn(service, 'getAll').mockResolvedValue([]);
+    await expect(controller.getAll()).resolves.toEqual([]);
+  }});
+
+{self.cases(kind)}
+  it('searches with the filter it is given', async () => {{
+    jest.spyOn(service, 'search').mockResolvedValue([]);
+    await controller.search({{ p0: 'x' }});
+    expect(service.search).toHaveBeenCalledWith({{ p0: 'x' }});
+  }});
+}});
+"""
+
+    def cases(self, kind):
+        return ''.join(f"""  it('{kind} case {k}: looks up entry {k}', async () => {{
+    const entry = {{ id: {k}, field1: 'case-{k}', field2: `${{'{kind}'}}-{k}` }} as unknown as {self.name};
+    jest.spyOn(service, 'getById').mockResolvedValue(entry);
+    await expect(controller.getById('{k}')).resolves.toBe(entry);
+    expect(service.getById).toHaveBeenCalledWith({k});
+  }});
+
+""" for k in range(24 + self.d % 12))
+
+    def enum(self):
+        states = ('Created', 'Pending', 'Processing', 'Completed', 'Failed', 'Cancelled')
+        return f"export enum {self.name}Status {{\n" + ''.join(f"  {s.upper()} = '{s}',\n" for s in states) + "}\n"
+
+
+def generate(root, scale, domains=DOMAINS):
+    """Write the tree of scale x domains under root/src; returns (files, bytes)."""
+    n = domains * scale
+    files = size = 0
+    for d in range(n):
+        for rel, text in Domain(d, n).files():
+            path = os.path.join(root, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as fh:
+                fh.write(text)
+            files += 1
+            size += len(text)
+    return files, size
+
+
+# -- one timed chain -----------------------------------------------------------------------
+
+def chain(src, work):
+    """Run the chain over src into work once, timed; leaves work/profile.json."""
+    import inventory, stageprof, workdir
+    os.makedirs(work, exist_ok=True)
+
+    def measure():
+        # Any width will do: the measurement is not what is benchmarked.
+        sites = workdir.load('sites.json')
+        workdir.save('sites-measured.json', [
+            dict(s, cols=zlib.crc32(f"{s['file']}{s['line']}{s['col']}".encode()) % 300 + 1, joins=0)
+            for s in sites])
+        with open(workdir.path('meta-tables.json'), 'w') as fh:
+            json.dump({}, fh)
+    steps = [inventory.Step('measure', measure, s.inputs, s.outputs) if s.name == 'measure' else s
+             for s in inventory.STEPS if s.name != 'build_docs']
+    stageprof.start(patterns=False)
+    try:
+        inventory.execute(steps, src, work)
+    finally:
+        stageprof.stop()
+    stageprof.write(os.path.join(work, 'profile.json'))
+
+
+def timed_run(src, work, cache, jobs):
+    """{step: {wall_s, cpu_s, ...}} of one chain run in a fresh process."""
+    env = dict(os.environ, INVENTORY_CACHE=cache, INVENTORY_JOBS=str(jobs))
+    env.pop('INVENTORY_PLAN', None)
+    env.pop('INVENTORY_REF', None)
+    r = subprocess.run([sys.executable, os.path.join(HERE, 'bench.py'), 'chain', src, work],
+                       capture_output=True, text=True, env=env)
+    if r.returncode != 0:
+        raise SystemExit(f"the chain failed on {src}:\n{(r.stderr or r.stdout).strip()[-2000:]}")
+    with open(os.path.join(work, 'profile.json')) as fh:
+        return {s['step']: s for s in json.load(fh)['steps']}
+
+
+def measure_scale(scale, jobs, tmp):
+    root = os.path.join(tmp, f'{scale}x')
+    t0 = time.time()
+    files, size = generate(root, scale)
+    print(f"{scale}x: {files} files, {size / 1e6:.1f} MB generated in {time.time() - t0:.1f}s")
+    out = {'files': files, 'bytes': size}
+    cache = os.path.join(root, 'cache')
+    for name in PASSES:
+        steps = timed_run(os.path.join(root, 'src'), os.path.join(root, name), cache, jobs)
+        out[name] = {step: {k: r[k] for k in ('wall_s', 'cpu_s', 'cpu_children_s', 'peak_rss_kb', 'phases')
+                            if k in r} for step, r in steps.items()}
+        print(f"  {name:5s} {sum(r['wall_s'] for r in steps.values()):7.2f}s")
+    shutil.rmtree(root, ignore_errors=True)
+    return out
+
+
+def report(result, baseline, tolerance):
+    """Print the timings against the baseline; returns the regressions."""
+    scales = sorted(result['scales'], key=int)
+    base_scales = (baseline or {}).get('scales', {})
+    regressions = []
+    for name in PASSES:
+        print(f"\n{name}: seconds per step (ms per 1,000 files), against the baseline")
+        steps = list(result['scales'][scales[0]][name])
+        print(f"  {'step':<24}" + ''.join(f"{s + 'x':>26}" for s in scales))
+        for step in steps:
+            cells = []
+            for s in scales:
+                r = result['scales'][s]
+                now = r[name][step]['wall_s']
+                cell = f"{now:.2f}s ({1000 * now / (r['files'] / 1000):.0f})"
+                was = base_scales.get(s, {}).get(name, {}).get(step, {}).get('wall_s')
+                if was is not None:
+                    change = (now - was) / was if was else 0.0
+                    cell += f" {change:+.0%}"
+                    if now - was > NOISE_S and change > tolerance / 100:
+                        regressions.append(f"{step} {name} at {s}x: {was:.2f}s -> {now:.2f}s ({change:+.0%})")
+                cells.append(cell)
+            print(f"  {step:<24}" + ''.join(f"{c:>26}" for c in cells))
+        phases = result['scales'][scales[-1]][name].get('endpoint_eff', {}).get('phases')
+        if phases:
+            print(f"  endpoint_eff at {scales[-1]}x: " + ', '.join(f"{k} {v:.2f}s" for k, v in phases.items()))
+    if len(scales) > 1:
+        first, last = scales[0], scales[-1]
+        factor = result['scales'][last]['files'] / result['scales'][first]['files']
+        print(f"\ngrowth from {first}x to {last}x against the {factor:.0f}-fold tree (1.0 = linear), cold:")
+        for step in result['scales'][first]['cold']:
+            a = result['scales'][first]['cold'][step]['wall_s']
+            b = result['scales'][last]['cold'][step]['wall_s']
+            if a >= NOISE_S:
+                print(f"  {step:<24} {b / a / factor:5.2f}")
+    return regressions
+
+
+def run(args):
+    scales = [s.strip() for s in args.scales.split(',') if s.strip()]
+    if not scales or not all(s.isdigit() and int(s) > 0 for s in scales):
+        raise SystemExit(f"--scales needs positive whole numbers, not {args.scales!r}")
+    store = os.path.join(cache_dir(), 'bench')
+    baseline_path = args.baseline or os.path.join(store, 'baseline.json')
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as fh:
+            baseline = json.load(fh)
+        if baseline.get('corpus') != CORPUS_VERSION or baseline.get('jobs') != args.jobs:
+            print(f"{baseline_path} was made of another corpus or --jobs - not compared")
+            baseline = None
+    tmp = tempfile.mkdtemp(prefix='inventory-bench-')
+    try:
+        result = {'corpus': CORPUS_VERSION, 'jobs': args.jobs, 'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                  'scales': {s: measure_scale(int(s), args.jobs, tmp) for s in scales}}
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    regressions = report(result, baseline, args.tolerance)
+    os.makedirs(store, exist_ok=True)
+    with open(os.path.join(store, 'last.json'), 'w') as fh:
+        json.dump(result, fh, indent=1)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, 'w') as fh:
+            json.dump(result, fh, indent=1)
+        print(f"\nsaved as the baseline: {baseline_path}")
+    elif baseline is None:
+        print(f"\nno baseline to compare with - save one with --save-baseline")
+    if regressions:
+        raise SystemExit(f"{len(regressions)} step(s) slower than the baseline by more than "
+                         f"{args.tolerance:g}%:\n  " + '\n  '.join(regressions))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='bench.py')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('run', help='time the chain over generated trees, against the baseline')
+    p.add_argument('--scales', default='1,5,20', help='tree sizes, in multiples of src/ (default: 1,5,20)')
+    p.add_argument('--jobs', type=int, default=1, help='worker processes per step, as `run.sh --jobs`')
+    p.add_argument('--tolerance', type=float, default=25,
+                   help='percent a step may be slower than its baseline (default: 25)')
+    p.add_argument('--baseline', help='the baseline file (default: $INVENTORY_CACHE/bench/baseline.json)')
+    p.add_argument('--save-baseline', action='store_true', help='keep this run as the baseline')
+    g = sub.add_parser('generate', help='write a generated tree to a directory')
+    g.add_argument('dir')
+    g.add_argument('--scale', type=int, default=1)
+    c = sub.add_parser('chain', help='one timed chain run; what `run` starts per measurement')
+    c.add_argument('src')
+    c.add_argument('work')
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'generate':
+        files, size = generate(args.dir, args.scale)
+        print(f"{files} files, {size / 1e6:.1f} MB under {os.path.join(args.dir, 'src')}")
+    elif args.command == 'chain':
+        chain(args.src, args.work)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 """Rebuilds docs/endpoints.md and docs/load-sites.md."""
-import json, os
+import os
 from collections import Counter
 
 import classify
+import tsparse
+import workdir
 
 SP = os.environ.get("INVENTORY_WORK")
 if not SP:
@@ -11,21 +13,18 @@ if not SP:
 SRC = os.environ.get("API_SRC")
 if not SRC:
     raise SystemExit("API_SRC is not set - run this through scripts/inventory/run.sh")
-with open(SP + '/endpoint-eff.json') as fh:
-    eps = json.load(fh)
-with open(SP + '/sites-measured.json') as fh:
-    sites = json.load(fh)
+# The fields of a site this renders, and what `classify.annotate` reads to tell writes apart.
+SITE_COLUMNS = ('file', 'line', 'col', 'cls', 'method', 'kind', 'entity', 'select', 'cols', 'joins',
+                'relations')
+eps = workdir.load('endpoint-eff.json')
+jobs = workdir.load('cron-jobs.json')
+sites = workdir.load('sites-measured.json', SITE_COLUMNS)
 if not eps or not sites:
     raise SystemExit("endpoint-eff.json or sites-measured.json is empty - an earlier stage "
                      "produced nothing, so there is nothing to render")
 
 
-def access(e):
-    if e['path'] in classify.CALLER_SELECT: return 'caller-defined'
-    k = set(e['kinds'])
-    if 'over' in k: return 'whole rows'
-    if not k: return 'none'
-    return 'projected'
+access = classify.access
 
 
 def median(xs):
@@ -273,6 +272,44 @@ o = ["# HTTP endpoints", "",
 # KeyError on the other.
 o += [f"| `{e['verb']} {e['path']}` | {e['manual']} |"
       for e in sorted(eps, key=lambda r: r['path']) if e.get('manual')]
+per_item = sorted((e for e in eps if e.get('per_item')), key=lambda r: (r['path'], r['verb'], r['version']))
+o += ["", "### Queries run once per element", "",
+      f"{len(per_item)} endpoints reach a query inside a loop or a per-element callback " +
+      "(`for`, `while`, `.map(...)`, `.forEach(...)`, `asyncMap(...)`) — one round trip per row of " +
+      "something loaded before, the N+1 pattern. The path names the call made once per element " +
+      "(`for each:`) and the load site it ends at. The call graph is the one `Data access` is taken " +
+      "over, so the same limits apply: an unresolved edge hides a path, it never invents one. A loop " +
+      "bounded by a handful of elements is listed all the same.", "",
+      "| Endpoint | Path to the query |",
+      "| -------- | ----------------- |"]
+o += [f"| `{e['verb']} {e['path']}` | {e['per_item']} |" for e in per_item]
+
+
+def rate(x):
+    return '—' if x is None else f"{round(x):,}" if x >= 1 else f"{x:.2g}"
+
+
+timed = [j for j in jobs if j['runs_per_hour'] is not None]
+o += ["", "### Scheduled jobs", "",
+      f"The {len(jobs)} `@DfxCron` jobs are roots of the same call graph: each reaches its load sites " +
+      "the way a handler does, and `Max cols` and the per-element path mean the same. Their schedule " +
+      "gives the load per hour, counted as every reachable load site once per run — more than a run " +
+      "taking one branch issues, less than a job querying per element does. A `both` job runs in " +
+      "every process; its figures are per process.", "",
+      "| Scope | Jobs | Runs/h | Queries/h | Columns/h | Once per element |",
+      "| ----- | ---: | -----: | --------: | --------: | ---------------: |"]
+for scope in ('worker', 'api', 'both'):
+    of = [j for j in timed if j['scope'] == scope]
+    o.append(f"| `{scope}` | {len(of)} | {rate(sum(j['runs_per_hour'] for j in of))} | " +
+             f"{rate(sum(j['queries_per_hour'] for j in of))} | {rate(sum(j['cols_per_hour'] for j in of))} | " +
+             f"{sum(1 for j in of if j['per_item'])} |")
+o += ["", "Heaviest first, in columns per hour:", "",
+      "| Job | Interval | Scope | Runs/h | Load sites | Max cols | Queries/h | Columns/h | Path to a query per element |",
+      "| --- | -------- | ----- | -----: | ---------: | -------: | --------: | --------: | --------------------------- |"]
+for j in sorted(jobs, key=lambda j: (-(j['cols_per_hour'] or 0), j['job'], j['file'])):
+    o.append(f"| `{j['job']}` | `{j['expression'].split('.')[-1]}` | {j['scope'] or '—'} | " +
+             f"{rate(j['runs_per_hour'])} | {j['sites']} | {j['maxcol'] or '—'} | " +
+             f"{rate(j['queries_per_hour'])} | {rate(j['cols_per_hour'])} | {j['per_item'] or ''} |")
 o += ["",
      "[read-path-projections.md](read-path-projections.md) explains the background, the criteria for " +
      "converting an endpoint, and how the result is tested.", "",
@@ -399,3 +436,4 @@ print(f"data access: {dict(acc)} | versions: {dict(ver)}")
 print(f"load sites: {len(loads)} ({writes} write query builders removed) | " +
       f"find {kinds['find']} / QB {kinds['query-builder']} / SQL {kinds['raw-sql']} | " +
       f"field list {sel.get(classify.SEL_FIELD_LIST, 0)}")
+print(tsparse.FILES.report())
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""The endpoint call graph, condensed into its strongly connected components.
+
+Everything `endpoint_eff.py` says about an endpoint is a summary over every method it can
+reach: the union of the load-site categories, whether every edge on the way resolved, the
+widest measured query. It used to get there by looping over every edge until nothing changed,
+recomputing all three for every node on every pass - edges times graph depth.
+
+Here the graph is condensed first (Tarjan): every cycle collapses into one component, whose
+members reach exactly the same methods and so share one summary. The condensation is acyclic,
+and Tarjan emits its components sinks first, so a single pass in that order sees every
+successor summarised before its predecessors - each component is visited once, cycles included,
+and the result is the fixpoint's exactly.
+
+Per component, the set of components it reaches is kept as a bit set, built on the first
+question, which answers "does this endpoint reach that method" in constant time.
+
+`Summary.update` takes changed local facts and re-propagates through a worklist: only the
+components upstream of a change are recomputed, and the walk stops where a summary comes out
+unchanged. Edges that change need a new `CallGraph`.
+"""
+import heapq
+
+
+class CallGraph:
+    """Condensation of a directed graph given as {node: targets}."""
+
+    def __init__(self, nodes, edges):
+        self.nodes = list(dict.fromkeys([*nodes, *edges, *(t for ts in edges.values() for t in ts)]))
+        self.edges = {n: set(edges.get(n, ())) for n in self.nodes}
+        self.comp = {}        # node -> component id; ids are in reverse topological order
+        self.members = []     # component id -> [node]
+        self._tarjan()
+        self.succ = [set() for _ in self.members]
+        self.pred = [set() for _ in self.members]
+        for n, targets in self.edges.items():
+            for t in targets:
+                a, b = self.comp[n], self.comp[t]
+                if a != b:
+                    self.succ[a].add(b)
+                    self.pred[b].add(a)
+        self._reach_bits = None
+
+    def _tarjan(self):
+        """Iterative Tarjan - a recursive one overflows the stack on a long call chain."""
+        index, low, on_stack, stack = {}, {}, set(), []
+        counter = 0
+        for root in self.nodes:
+            if root in index: continue
+            work = [(root, iter(self.edges[root]))]
+            index[root] = low[root] = counter; counter += 1
+            stack.append(root); on_stack.add(root)
+            while work:
+                node, it = work[-1]
+                advanced = False
+                for t in it:
+                    if t not in index:
+                        index[t] = low[t] = counter; counter += 1
+                        stack.append(t); on_stack.add(t)
+                        work.append((t, iter(self.edges[t])))
+                        advanced = True
+                        break
+                    if t in on_stack:
+                        low[node] = min(low[node], index[t])
+                if advanced: continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    members = []
+                    while True:
+                        m = stack.pop(); on_stack.discard(m)
+                        self.comp[m] = len(self.members)
+                        members.append(m)
+                        if m == node: break
+                    self.members.append(members)
+
+    @property
+    def reach_bits(self):
+        """Per component, the components it reaches as a bit set. Built on first use: the sets
+        grow with the graph, so building them costs components times components over 64, which
+        a run that never asks `reaches` should not pay."""
+        if self._reach_bits is None:
+            # Successors always carry a lower id, so ascending ids visit them first.
+            self._reach_bits = []
+            for c, succ in enumerate(self.succ):
+                bits = 1 << c
+                for d in succ:
+                    bits |= self._reach_bits[d]
+                self._reach_bits.append(bits)
+        return self._reach_bits
+
+    def reaches(self, a, b):
+        """Whether b is reachable from a (every node reaches itself). Constant time once the
+        bit sets are built."""
+        if a not in self.comp or b not in self.comp:
+            return a == b
+        return bool(self.reach_bits[self.comp[a]] >> self.comp[b] & 1)
+
+    def reachable(self, a):
+        """Every node reachable from a, itself included."""
+        if a not in self.comp:
+            return {a}
+        # A walk of the condensation from a's component: what a reaches, not a test of every
+        # component in the graph against its bits, which made this linear in the graph's size.
+        start = self.comp[a]
+        seen, stack = {start}, [start]
+        while stack:
+            for d in self.succ[stack.pop()]:
+                if d not in seen:
+                    seen.add(d)
+                    stack.append(d)
+        return {m for c in seen for m in self.members[c]}
+
+    def reaching(self, targets):
+        """Every node from which one of targets is reachable, targets included - the same walk
+        as `reachable`, against the edges."""
+        start = {self.comp[t] for t in targets if t in self.comp}
+        seen, stack = set(start), list(start)
+        while stack:
+            for p in self.pred[stack.pop()]:
+                if p not in seen:
+                    seen.add(p)
+                    stack.append(p)
+        return {m for c in seen for m in self.members[c]}
+
+
+class Summary:
+    """Per node, `join` over the local values of every node it reaches.
+
+    `join` must be associative, commutative and idempotent - set union, `and`, `max` - which
+    is what makes a cycle's members share one value. Nodes without a local value contribute
+    `default`.
+    """
+
+    def __init__(self, graph, local, join, default=None):
+        self.graph, self.join, self.default = graph, join, default
+        self.local = dict(local)
+        self.value = [None] * len(graph.members)
+        for c in range(len(graph.members)):
+            self.value[c] = self._compute(c)
+
+    def _compute(self, c):
+        v = None
+        for m in self.graph.members[c]:
+            x = self.local.get(m, self.default)
+            v = x if v is None else self.join(v, x)
+        for d in self.graph.succ[c]:
+            v = self.join(v, self.value[d])
+        return v
+
+    def __contains__(self, node):
+        return node in self.graph.comp
+
+    def __getitem__(self, node):
+        return self.value[self.graph.comp[node]]
+
+    def get(self, node, default=None):
+        return self[node] if node in self else default
+
+    def update(self, changed):
+        """Set new local values for some nodes and re-propagate. Returns the nodes whose summary
+        changed.
+
+        A worklist ordered by component id, so every component is recomputed after all of its
+        changed successors - each at most once - and the walk stops at summaries that come out
+        the same. Recomputing from the members' own values rather than joining in the change is
+        what lets a value shrink: a load site removed is a category an endpoint may lose.
+        """
+        self.local.update(changed)
+        queue = sorted({self.graph.comp[n] for n in changed if n in self.graph.comp})
+        queued = set(queue)
+        out = set()
+        while queue:
+            c = heapq.heappop(queue)
+            queued.discard(c)
+            v = self._compute(c)
+            if v == self.value[c]: continue
+            self.value[c] = v
+            out.update(self.graph.members[c])
+            for p in self.graph.pred[c]:
+                if p not in queued:
+                    heapq.heappush(queue, p); queued.add(p)
+        return out
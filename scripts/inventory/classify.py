@@ -41,61 +41,61 @@ SELECT_BRACKET = re.compile(r'\.select\(\s*\[')
 SELECT_IDENT = re.compile(r'\.select\(\s*([A-Za-z_$][\w$]*)\s*[,)]')
 SELECT_STRING = re.compile(r'\.select\(\s*[\'"`]([^\'"`]*)[\'"`]')
 JOIN_AND_SELECT = re.compile(r'(?:left|inner)JoinAndSelect\s*\(')
-LINE_COMMENT = re.compile(r'(?m)(?<!:)//[^\n]*')
-
-# How far past a `createQueryBuilder(` to read its chain. One number, because these are
-# all the same window on the same thing — two measures of one chain were free to disagree.
-CHAIN_WINDOW = 1500
-# How far back to look for the assignment of a variable passed to `.select(...)`. A
-# different question from the chain window, so a different name rather than one shared
-# number that would tie two unrelated limits together.
+QB_CALL = re.compile(r'\.createQueryBuilder\s*\(')
+
+# How far back to look for the assignment of a variable passed to `.select(...)`.
 ASSIGNMENT_LOOKBEHIND = 1500
 
 
-def strip_line_comments(s):
-    """Strip line comments only, protecting URLs.
+def chain_end(text, m_end, tokens=None):
+    """End of the query-builder chain opened by a `createQueryBuilder(` that ends at m_end.
+
+    Read to the end of its statement (`tsparse.statement_end`), the one measure of a chain
+    every caller shares - two measures of one chain were free to disagree. It used to be a
+    1500-character window cut at the first `;`, which a `new Brackets((qb) => { ...; })`
+    callback ended early and a long chain ran past silently.
 
-    Block comments are left alone because a regex literal can look like one. `[^\\n]*` never
-    consumes the newline, so line numbers stay identical to the source — every stage keys on
-    the position of a site, by line and column, and the whole join depends on all of them
-    stripping identically. Hence one implementation rather than a copy per stage.
+    The chain is `text[m_end:chain_end(...)]`, but callers search it in place
+    (`pattern.search(text, m_end, end)`) rather than copy it out once per question.
     """
-    return LINE_COMMENT.sub('', s)
+    from tsparse import statement_end
+    return statement_end(text, m_end, tokens)
 
 
-def select_kind(text, m_start, m_end):
+def select_kind(text, m_start, m_end, tokens=None):
     """Category of a `createQueryBuilder` call at [m_start, m_end) within text.
 
     Shared between the site scan and the per-endpoint call-graph walk. They used to decide this
     separately, and the call-graph copy recognised only a literal `.select([`: every endpoint
     projecting through the `PROJECTION.apply(...)` helper or naming its columns one at a time
     was classified as loading whole rows — including all of the deliberately converted ones.
+    `tokens`, the `tsparse.Tokens` of text, saves relexing the chain.
     """
-    chain = text[m_end:m_end + CHAIN_WINDOW].split(';')[0]
+    end = chain_end(text, m_end, tokens)
     # `getCount()`/`getExists()` discard the select list and emit COUNT(...) resp. SELECT 1 -
     # such chains materialise no row, whatever precedes them.
-    if COUNTING.search(chain):
+    if COUNTING.search(text, m_end, end):
         return SEL_COUNT_ONLY
+    ident = SELECT_IDENT.search(text, m_end, end)
+    string = SELECT_STRING.search(text, m_end, end)
     # `PROJECTION.apply(this.createQueryBuilder('x'), fields)`: the field list lives in the
     # projection constant, so the `.select([...])` is in another file entirely. The call may
     # also go through an injected repository, putting an object chain between `apply(` and
     # `createQueryBuilder`.
-    before = text[max(0, m_start - 160):m_start]
-    if APPLY_HELPER.search(before):
+    if APPLY_HELPER.search(text, max(0, m_start - 160), m_start):
         select = SEL_FIELD_LIST
-    elif SELECT_BRACKET.search(chain):
+    elif SELECT_BRACKET.search(text, m_end, end):
         select = SEL_FIELD_LIST
-    elif SELECT_IDENT.search(chain):
+    elif ident:
         # `.select(bucketExpr, 'bucket')` - the argument sits in a variable. What the body
         # assigns decides: a bare identifier would be the root alias, anything else names
         # something.
-        v = SELECT_IDENT.search(chain)
-        a = re.search(r"\b(?:const|let|var)\s+" + re.escape(v.group(1)) + r"\s*=\s*([^;\n]+)",
-                      text[max(0, m_start - ASSIGNMENT_LOOKBEHIND):m_start])
+        a = re.compile(r"\b(?:const|let|var)\s+" + re.escape(ident.group(1)) + r"\s*=\s*([^;\n]+)") \
+            .search(text, max(0, m_start - ASSIGNMENT_LOOKBEHIND), m_start)
         select = SEL_NAMED_COLUMNS if a and not re.fullmatch(r"['\"`]\w+['\"`]", a.group(1).strip()) \
             else SEL_NO_SELECT
-    elif SELECT_STRING.search(chain):
-        arg = SELECT_STRING.search(chain).group(1)
+    elif string:
+        arg = string.group(1)
         # `.select('alias')` loads every column; `.select('alias.column')` names one. Both are
         # strings - the dot in the argument is the difference. A bare identifier is the root
         # alias; anything else names something specific: a column (`userData.id`) or an
@@ -105,7 +105,7 @@ def select_kind(text, m_start, m_end):
         select = SEL_NO_SELECT
     # A `leftJoinAndSelect` fetches the joined entity whole - the projection on the root no
     # longer helps then.
-    if select in (SEL_FIELD_LIST, SEL_NAMED_COLUMNS) and JOIN_AND_SELECT.search(chain):
+    if select in (SEL_FIELD_LIST, SEL_NAMED_COLUMNS) and JOIN_AND_SELECT.search(text, m_end, end):
         select = SEL_PROJECTED_FULL_JOIN
     return select
 
@@ -117,7 +117,7 @@ NAMED_CALL = re.compile(r'\.(?:select|addSelect)\s*\(')
 ASSIGNED_TO = re.compile(r'\b(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*=\s*[^;]*$')
 
 
-def selected_columns(text, m_start, m_end, kind):
+def selected_columns(text, m_start, m_end, kind, tokens=None):
     """How many columns a narrowing query builder actually selects, where that is decidable.
 
     Returns a dict with `projection` (the name of a `ReadProjection` constant, to be resolved
@@ -134,15 +134,14 @@ def selected_columns(text, m_start, m_end, kind):
     if kind == SEL_COUNT_ONLY:
         # COUNT(*)/SELECT 1 - no row is materialised, so a column count is meaningless here.
         return {'unmeasurable': True}
-    chain = text[m_end:m_end + CHAIN_WINDOW].split(';')[0]
-    before = text[max(0, m_start - 160):m_start]
-    m = APPLY_HELPER.search(before)
+    end = chain_end(text, m_end, tokens)
+    m = APPLY_HELPER.search(text, max(0, m_start - 160), m_start)
     if m:
         return {'projection': m.group(1)}
-    lst = SELECT_LIST.search(chain)
+    lst = SELECT_LIST.search(text, m_end, end)
     if lst:
         return {'select_count': len([x for x in lst.group(1).split(',') if x.strip()])}
-    count = _named_column_count(text, m_start, m_end, chain)
+    count = _named_column_count(text, m_start, m_end, end)
     return {'select_count': count} if count else {}
 
 
@@ -159,28 +158,32 @@ METHOD_SIG = re.compile(
     r'(?!(?:if|for|while|switch|catch|return|do|else|try)\b)[\w$]+\s*\(', re.M)
 
 
-def _alias_at(text, paren):
-    """The column a select/addSelect call whose '(' is at `paren` contributes.
+def _alias_at(text, paren, end=None):
+    """The column a select/addSelect call whose '(' is at `paren` contributes, reading no
+    further than end.
 
     `.addSelect(expr, 'alias')` binds an alias — the last string literal of the call.
     `.select('leg.id')` has none, and the expression itself identifies the column.
     """
     from tsparse import skip_args
-    args = text[paren:skip_args(text, paren)]
-    strings = [next(g for g in m.groups() if g is not None) for m in STRING_LITERAL.finditer(args)]
-    return strings[-1] if strings else args
+    close = skip_args(text, paren)
+    if end is not None:
+        close = min(close, end)
+    strings = [next(g for g in m.groups() if g is not None)
+               for m in STRING_LITERAL.finditer(text, paren, close)]
+    return strings[-1] if strings else text[paren:close]
 
 
-def _named_column_count(text, m_start, m_end, chain):
-    """How many distinct columns a column-by-column query selects.
+def _named_column_count(text, m_start, m_end, stop):
+    """How many distinct columns a column-by-column query selects, its chain ending at stop.
 
     Counted by column rather than by call, for two reasons. The chain up to the first `;` is
     not the whole story — a query builder assigned to a variable is often widened by later
     `qb.addSelect(...)` statements. And a query built across an if/else adds the same column in
     every branch, which is one column in the result and several calls in the source.
     """
-    aliases = {_alias_at(chain, m.end() - 1) for m in NAMED_CALL.finditer(chain)}
-    assigned = ASSIGNED_TO.search(text[max(0, m_start - 200):m_start])
+    aliases = {_alias_at(text, m.end() - 1, stop) for m in NAMED_CALL.finditer(text, m_end, stop)}
+    assigned = ASSIGNED_TO.search(text, max(0, m_start - 200), m_start)
     if assigned:
         name = assigned.group(1)
         # Stop at the next method signature. `qb` and `query` are used in method after method,
@@ -188,12 +191,12 @@ def _named_column_count(text, m_start, m_end, chain):
         # count and be wrong with nothing to show for it. The method boundary is the right
         # bound rather than a re-declaration of the name: a closure inside this method may
         # legitimately shadow it and still be followed by a widening call on the outer one.
-        rest = text[m_end:m_end + 6000]
-        end = METHOD_SIG.search(rest)
-        if end:
-            rest = rest[:end.start()]
+        end = min(m_end + 6000, len(text))
+        sig = METHOD_SIG.search(text, m_end, end)
+        if sig:
+            end = sig.start()
         later = re.compile(r'\b' + re.escape(name) + r'\s*\.\s*(?:select|addSelect)\s*\(')
-        aliases |= {_alias_at(rest, m.end() - 1) for m in later.finditer(rest)}
+        aliases |= {_alias_at(text, m.end() - 1, end) for m in later.finditer(text, m_end, end)}
     return len(aliases)
 
 
@@ -223,42 +226,60 @@ def raw_kind_of(body):
 # only when a field list arrives with the request, and loads the full table otherwise.
 CALLER_SELECT = {'/gs/db', '/gs/db/custom'}
 
-_cache = {}
 
+def access(e):
+    """The `Data access` column of an endpoint row of `endpoint-eff.json`. `build_docs.py` renders
+    it, and `watch.py` reports how a change moves it."""
+    if e['path'] in CALLER_SELECT: return 'caller-defined'
+    k = set(e['kinds'])
+    if 'over' in k: return 'whole rows'
+    if not k: return 'none'
+    return 'projected'
+
+
+RAW_QUERY = re.compile(r'\.query\s*\(')
 
-def _lines(src, rel):
-    """Source lines of a `src/...` file, line comments stripped."""
-    from tsparse import read_text, src_path
-    if rel not in _cache:
-        _cache[rel] = strip_line_comments(read_text(src_path(src, rel))).split('\n')
-    return _cache[rel]
+
+def _at_line(src, s):
+    """(text, position) of a site's line within its `src/...` file, line comments stripped.
+
+    The site is read in place from the start of its line: every search below takes a
+    position, so nothing copies the rest of the file out per site.
+    """
+    from source import provider
+    from tsparse import src_path, stripped
+    text, starts = stripped(provider(src), src_path(src, s['file']))
+    return text, starts[s['line'] - 1] if s['line'] <= len(starts) else len(text)
 
 
 def is_write_qb(src, s):
     """Does this `createQueryBuilder` chain carry a write terminator?
 
-    The same character window the per-endpoint walk and `select_kind` use. It used to be a
-    26-line window here, which is a different measure of the same chain: a long enough
-    `.where()` run before the `.update()` would have made the site a write in one document and
-    a read in the other.
+    The same chain the per-endpoint walk and `select_kind` read. It used to be a 26-line
+    window here, which is a different measure of the same chain: a long enough `.where()` run
+    before the `.update()` would have made the site a write in one document and a read in the
+    other. Anchored on the recorded column, like `raw_kind`.
     """
-    text = '\n'.join(_lines(src, s['file'])[s['line'] - 1:])
-    chain = text[:CHAIN_WINDOW].split(';')[0]
-    return bool(WRITE_CHAIN.search(chain))
+    text, pos = _at_line(src, s)
+    call = QB_CALL.match(text, pos + s['col']) if s.get('col') is not None else None
+    call = call or QB_CALL.search(text, pos)
+    if not call:
+        return False
+    return bool(WRITE_CHAIN.search(text, call.end(), chain_end(text, call.end())))
 
 
 def raw_kind(src, s):
     """Raw SQL at a recorded site: an advisory lock, a write, or a genuine read."""
-    text = '\n'.join(_lines(src, s['file'])[s['line'] - 1:])
+    text, pos = _at_line(src, s)
     # Anchor on the recorded column when the scan supplied one, so a line carrying more than
     # one `.query(` classifies the right call. Starting the bracket walk at the beginning of
     # the line picks up whatever parenthesis comes first — `const raw = (await
     # this.query(...))` happens to still enclose the call, but only by luck.
     col = s.get('col')
     if col is None:
-        call = re.search(r'\.query\s*\(', text)
-        col = call.start() if call else 0
-    return raw_kind_of(raw_statement(text, col))
+        call = RAW_QUERY.search(text, pos)
+        col = call.start() - pos if call else 0
+    return raw_kind_of(raw_statement(text, pos + col))
 
 
 def annotate(src, sites):
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Columnar storage for the inventory's tables - the optional alternative to indented JSON.
+
+`sites.json`, `sites-measured.json`, `table.json` and `endpoint-eff.json` are lists of flat
+records that repeat the same few hundred strings - file, class, method, entity, category -
+thousands of times. Written as indented JSON they are large, and a reader that needs three of
+the fields still parses every one. Here each field is stored as a column of its own, strings
+go into one shared table and are referred to by number, and every column is compressed
+separately, so a reader decompresses only the columns it asks for.
+
+    DFXCOL 1\\n
+    {header}\\n          one line of JSON: the row count, the shapes, where each blob lies
+    blobs                 each a zlib-compressed JSON array
+
+A "shape" is the ordered key list of a record. Records keep their own keys in their own order
+- a site without a projection has no `projection` key at all, and the measurement puts `error`
+where it found one - so reading a file back gives exactly the records that were written, and
+the JSON export is byte-identical to what the JSON format writes. `measure.js` reads and writes
+the same layout.
+
+    python3 colstore.py export <file.col> [<out.json>]   the records as indented JSON
+"""
+import json, sys, zlib
+
+MAGIC = b'DFXCOL 1\n'
+
+
+def _pack(values):
+    return zlib.compress(json.dumps(values, separators=(',', ':')).encode(), 6)
+
+
+def write(path, rows):
+    """Write a list of records."""
+    shapes, shape_ids, row_shapes = [], {}, []
+    for r in rows:
+        keys = tuple(r)
+        if keys not in shape_ids:
+            shape_ids[keys] = len(shapes)
+            shapes.append(list(keys))
+        row_shapes.append(shape_ids[keys])
+    names = list(dict.fromkeys(k for s in shapes for k in s))
+    strings, string_ids, kinds, blobs = [], {}, {}, [('shape', _pack(row_shapes))]
+    for name in names:
+        values = [r.get(name) for r in rows]
+        if all(v is None or isinstance(v, str) for v in values):
+            # A column of strings refers into the shared table.
+            refs = []
+            for v in values:
+                if v is not None and v not in string_ids:
+                    string_ids[v] = len(strings)
+                    strings.append(v)
+                refs.append(None if v is None else string_ids[v])
+            kinds[name], values = 'ref', refs
+        else:
+            kinds[name] = 'json'
+        blobs.append(('col:' + name, _pack(values)))
+    blobs.append(('strings', _pack(strings)))
+    at, index = 0, {}
+    for name, blob in blobs:
+        index[name] = [at, len(blob)]
+        at += len(blob)
+    header = {'rows': len(rows), 'shapes': shapes, 'columns': kinds, 'blobs': index}
+    with open(path, 'wb') as fh:
+        fh.write(MAGIC)
+        fh.write(json.dumps(header, separators=(',', ':')).encode() + b'\n')
+        for _, blob in blobs:
+            fh.write(blob)
+
+
+def read(path, columns=None):
+    """The records of a file; with `columns`, each carrying only those of its keys."""
+    with open(path, 'rb') as fh:
+        if fh.readline() != MAGIC:
+            raise SystemExit(f"{path} is not a columnar inventory file")
+        header = json.loads(fh.readline())
+        data = fh.read()
+
+    def blob(name):
+        at, length = header['blobs'][name]
+        return json.loads(zlib.decompress(data[at:at + length]))
+
+    kinds = header['columns']
+    wanted = [n for n in kinds if columns is None or n in columns]
+    strings = blob('strings') if any(kinds[n] == 'ref' for n in wanted) else None
+    cols = {}
+    for name in wanted:
+        values = blob('col:' + name)
+        if kinds[name] == 'ref':
+            values = [None if v is None else strings[v] for v in values]
+        cols[name] = values
+    keep = set(wanted)
+    shapes = [[k for k in s if k in keep] for s in header['shapes']]
+    return [{k: cols[k][i] for k in shapes[s]} for i, s in enumerate(blob('shape'))]
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] != ['export'] or len(args) not in (2, 3):
+        raise SystemExit("usage: colstore.py export <file.col> [<out.json>]")
+    rows = read(args[1])
+    if len(args) == 3:
+        with open(args[2], 'w') as fh:
+            json.dump(rows, fh, indent=1)
+    else:
+        json.dump(rows, sys.stdout, indent=1)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""When the cron jobs fire together, and the database work that lands at once.
+
+`cron-jobs.json` gives every job a rate; a rate hides that the jobs on `EVERY_MINUTE`, every
+five minutes, every ten and every hour all start in the same minute at the top of the hour. This
+step replays the schedules minute by minute over a window - by default the seven days from
+January 1st of the reference year, a day every monthly and yearly job fires on too, so the peak
+is the worst one of the year - for the jobs one process runs: a `worker` process runs the
+`worker` and `both` jobs, an `api` process the `api` and `both` ones. It reports
+
+  peak         the minute the most jobs fire in, and what they query
+  concurrency  how many minutes see how many jobs fire
+  cohorts      the jobs firing in exactly the same minutes, and the cohorts that fire in every
+               minute another one does - the hourly jobs always fire with the per-minute ones
+  windows      firings, queries and columns per window (an hour unless asked otherwise)
+  minutes      the same per minute of the hour, summed over the window: where a job moved off
+               the hour would land
+
+A minute is the tick: every job from `EVERY_MINUTE` up fires at second 0, and the start delay
+`DfxCronService` adds to a job with `useDelay` spreads it over up to two minutes, which a finer
+tick would claim to know. A job on seconds fires several times a minute and counts each firing.
+The work of a firing is the job's estimate in `cron-jobs.json`: every load site it reaches,
+once.
+
+    inventory.py cron [--role worker|api|all] [--days N] [--start YYYY-MM-DD] [--window MIN]
+                      [--work DIR]
+
+Writes `cron-load.json`, the default window for each role.
+"""
+from datetime import date, datetime, timedelta
+
+from crontab import REFERENCE_YEAR, schedule
+import workdir
+
+# The scopes a process of each role runs.
+ROLES = {'worker': ('worker', 'both'), 'api': ('api', 'both'), 'all': ('worker', 'api', 'both')}
+START = date(REFERENCE_YEAR, 1, 1)
+DAYS = 7
+WINDOW = 60
+
+
+class Timeline:
+    """The jobs of a role, fired minute by minute over days days from the date start."""
+
+    def __init__(self, jobs, role='worker', start=START, days=DAYS):
+        self.start, self.days, self.role = start, days, role
+        runs = [(j, schedule(j['cron'])) for j in jobs if j['scope'] in ROLES[role]]
+        runs = [(j, s) for j, s in runs if s]
+        self.jobs = [j for j, _ in runs]
+        n = days * 1440
+        self.count, self.firings, self.queries, self.cols = [0] * n, [0] * n, [0] * n, [0] * n
+        self.fired = []
+        for j, s in runs:
+            minutes = s.minutes(start, days)
+            self.fired.append(frozenset(m for m, _ in minutes))
+            for m, times in minutes:
+                self.count[m] += 1
+                self.firings[m] += times
+                self.queries[m] += times * j['sites']
+                self.cols[m] += times * j['cols']
+
+    def at(self, minute):
+        return datetime.combine(self.start, datetime.min.time()) + timedelta(minutes=minute)
+
+    def peak(self):
+        """The minute the most jobs fire in - of those, the one querying the most columns, the
+        earliest of those."""
+        m = max(range(len(self.count)), key=lambda m: (self.count[m], self.cols[m], -m))
+        return {'minute': self.at(m).strftime('%Y-%m-%d %H:%M'), 'jobs': self.count[m],
+                'firings': self.firings[m], 'queries': self.queries[m], 'cols': self.cols[m],
+                'cohorts': [i for i, c in enumerate(self.cohorts()) if m in c['fired']]}
+
+    def concurrency(self):
+        """[jobs firing in a minute, the minutes that many fire in], by jobs."""
+        out = {}
+        for c in self.count:
+            out[c] = out.get(c, 0) + 1
+        return [[c, n] for c, n in sorted(out.items())]
+
+    def cohorts(self):
+        """The jobs firing in the same minutes, most frequent first; `with` are the cohorts
+        firing in every minute this one does."""
+        if not hasattr(self, '_cohorts'):
+            groups = {}
+            for j, fired in zip(self.jobs, self.fired):
+                if fired:
+                    groups.setdefault(fired, []).append(j)
+            rows = [{'fired': fired, 'minutes': len(fired), 'crons': sorted({j['cron'] for j in js}),
+                     'jobs': sorted(j['job'] for j in js)}
+                    for fired, js in sorted(groups.items(), key=lambda g: (-len(g[0]), min(g[0]), g[1][0]['job']))]
+            for r in rows:
+                r['with'] = [i for i, o in enumerate(rows) if o is not r and r['fired'] <= o['fired']]
+            self._cohorts = rows
+        return self._cohorts
+
+    def windows(self, size=WINDOW):
+        """Per window of size minutes: when it starts, and the firings, queries and columns in it."""
+        return [{'start': self.at(w).strftime('%Y-%m-%d %H:%M'), 'firings': sum(self.firings[w:w + size]),
+                 'queries': sum(self.queries[w:w + size]), 'cols': sum(self.cols[w:w + size])}
+                for w in range(0, len(self.count), size)]
+
+    def minutes_of_hour(self):
+        """Per minute of the hour, the jobs, queries and columns firing in it over the window."""
+        return [{'minute': m, 'jobs': sum(self.count[m::60]), 'queries': sum(self.queries[m::60]),
+                 'cols': sum(self.cols[m::60])} for m in range(60)]
+
+    def summary(self, size=WINDOW):
+        return {'role': self.role, 'start': self.start.isoformat(), 'days': self.days, 'jobs': len(self.jobs),
+                'peak': self.peak(), 'concurrency': self.concurrency(),
+                'cohorts': [{k: v for k, v in c.items() if k != 'fired'} for c in self.cohorts()],
+                'windows': self.windows(size), 'minutes': self.minutes_of_hour()}
+
+
+def main():
+    jobs = workdir.load('cron-jobs.json')
+    out = {role: Timeline(jobs, role).summary() for role in ROLES}
+    workdir.save('cron-load.json', out)
+    report(out['worker'])
+
+
+def report(s, size=WINDOW, top=5):
+    print(f"cron load, {s['role']} process, {s['days']} day(s) from {s['start']}: {s['jobs']} jobs")
+    if not s['jobs']:
+        return
+    p = s['peak']
+    usual = max(s['concurrency'], key=lambda c: (c[1], -c[0]))
+    print(f"  peak minute {p['minute']}: {p['jobs']} jobs, {p['firings']} firings, {p['queries']} queries, "
+          f"{p['cols']} cols; {usual[1]} of {s['days'] * 1440} minutes see {usual[0]} job(s)")
+    print(f"\n{'cohort':6s} {'jobs':>4} {'minutes':>7}  schedules (and the cohorts firing whenever it does)")
+    for i, c in enumerate(s['cohorts']):
+        crons = ', '.join(c['crons'])
+        also = f" with #{', #'.join(map(str, c['with']))}" if c['with'] else ''
+        print(f"#{i:<5d} {len(c['jobs']):4d} {c['minutes']:7d}  {crons}{also}")
+    rows = s['windows']
+    print(f"\nheaviest {min(top, len(rows))} of {len(rows)} windows of {size} min, by columns:")
+    for w in sorted(rows, key=lambda w: (-w['cols'], w['start']))[:top]:
+        print(f"  {w['start']}  {w['firings']:7d} firings {w['queries']:8d} queries {w['cols']:10d} cols")
+    minutes = sorted(s['minutes'], key=lambda m: (m['cols'], m['jobs'], m['minute']))
+    hot = minutes[-1]
+    print(f"minute of the hour: :{hot['minute']:02d} carries {hot['jobs']} jobs and {hot['cols']} cols over "
+          f"the window; the quietest are " + ', '.join(f":{m['minute']:02d} ({m['cols']})" for m in minutes[:3]))
+
+
+def replay(work, role, days, start, size):
+    """Print the timeline of the jobs a run in work found, for a role over days days from start."""
+    p = workdir.locate(work, 'cron-jobs.json')
+    if p is None:
+        raise SystemExit(f"{work} holds no cron-jobs.json - name the work directory of a finished run")
+    if days < 1 or size < 1:
+        raise SystemExit("--days and --window must be at least 1")
+    report(Timeline(workdir.read(p), role, start or START, days).summary(size), size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""The schedules `@DfxCron` declares, and how often they fire.
+
+A job names its schedule through `CronExpression` from `@nestjs/schedule` - not in the tree, so
+the values it uses are spelled out below - or through `CustomCronExpression`, which is read from
+the source. Both come down to a cron string of five fields, or six with seconds in front:
+
+    second minute hour day-of-month month day-of-week
+
+each a `*`, a value, a range, a list, or a step over either (`*/5`, `0-23/2`); months and days
+of the week may be named (`JAN`, `MON-FRI`), as the `cron` package allows. As in cron, a day
+matches when both day fields do, or either one when both are restricted. What this does not
+read - `L`, `W`, `#` - is no schedule (`schedule()` gives None), like an expression no table
+resolves.
+"""
+import calendar, re
+from datetime import date, timedelta
+
+# `CronExpression` of @nestjs/schedule, the members the jobs use and their neighbours.
+CRON_EXPRESSIONS = {
+    'EVERY_SECOND': '* * * * * *',
+    'EVERY_5_SECONDS': '*/5 * * * * *',
+    'EVERY_10_SECONDS': '*/10 * * * * *',
+    'EVERY_30_SECONDS': '*/30 * * * * *',
+    'EVERY_MINUTE': '*/1 * * * *',
+    'EVERY_5_MINUTES': '0 */5 * * * *',
+    'EVERY_10_MINUTES': '0 */10 * * * *',
+    'EVERY_30_MINUTES': '0 */30 * * * *',
+    'EVERY_HOUR': '0 0-23/1 * * *',
+    'EVERY_2_HOURS': '0 0-23/2 * * *',
+    'EVERY_6_HOURS': '0 0-23/6 * * *',
+    'EVERY_12_HOURS': '0 0-23/12 * * *',
+    'EVERY_DAY_AT_MIDNIGHT': '0 0 * * *',
+    **{f'EVERY_DAY_AT_{h % 12 or 12}{"AM" if h < 12 else "PM"}': f'0 {h:02d} * * *' for h in range(1, 24) if h != 12},
+    'EVERY_DAY_AT_NOON': '0 12 * * *',
+    'EVERY_WEEK': '0 0 * * 0',
+    'EVERY_WEEKDAY': '0 0 * * 1-5',
+    'EVERY_WEEKEND': '0 0 * * 6,0',
+    'EVERY_1ST_DAY_OF_MONTH_AT_MIDNIGHT': '0 0 1 * *',
+    'EVERY_1ST_DAY_OF_MONTH_AT_NOON': '0 12 1 * *',
+    'EVERY_QUARTER': '0 0 1 */3 *',
+    'EVERY_6_MONTHS': '0 0 1 */6 *',
+    'EVERY_YEAR': '0 0 1 1 *',
+}
+CUSTOM_ENUM = re.compile(r'enum\s+CustomCronExpression\s*\{([^}]*)\}')
+MEMBER = re.compile(r"(\w+)\s*=\s*['\"]([^'\"]*)['\"]")
+SCOPE = re.compile(r'\bscope\s*:\s*CronScope\.(\w+)')
+PROCESS = re.compile(r'\bprocess\s*:\s*Process\.(\w+)')
+TIMEOUT = re.compile(r'\btimeout\s*:\s*(\d+)')
+NO_DELAY = re.compile(r'\buseDelay\s*:\s*false\b')
+# second, minute, hour, day of month, month, day of week: the range of each.
+FIELDS = ((0, 59), (0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+# The names the month and day-of-week fields accept, lower case, by field.
+NAMES = {4: {m.lower(): i for i, m in enumerate(calendar.month_abbr) if m},
+         5: {'sun': 0, 'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6}}
+NAME = re.compile(r'[A-Za-z]+')
+# The year the day fields are averaged over. Any year gives the rate of a job that runs daily
+# or more often; for the rest it is an average of one particular calendar.
+REFERENCE_YEAR = 2025
+
+
+def custom_expressions(index):
+    """`CustomCronExpression` member -> cron string, from the enum in the source."""
+    for f in index.paths():
+        e = index.get(f)
+        if 'CustomCronExpression' not in e['text']: continue
+        m = CUSTOM_ENUM.search(e['text'])
+        if m:
+            return dict(MEMBER.findall(m.group(1)))
+    return {}
+
+
+def declaration(argument, custom):
+    """What a `@DfxCron(` argument declares: the expression as written and as a cron string
+    (None when it does not resolve), the scope, the kill-switch process, the timeout, and
+    whether the start is jittered."""
+    first = argument.split(',', 1)[0].strip()
+    owner, _, member = first.partition('.')
+    if first[:1] in '\'"':
+        cron = first.strip('\'"')
+    elif owner == 'CronExpression':
+        cron = CRON_EXPRESSIONS.get(member)
+    elif owner == 'CustomCronExpression':
+        cron = custom.get(member)
+    else:
+        cron = None
+    scope, process, timeout = SCOPE.search(argument), PROCESS.search(argument), TIMEOUT.search(argument)
+    return {'expression': first, 'cron': cron,
+            'scope': scope.group(1).lower() if scope else None,
+            'process': process.group(1) if process else None,
+            'timeout': int(timeout.group(1)) if timeout else None,
+            'delay': not NO_DELAY.search(argument)}
+
+
+def _field(text, lo, hi, names=None):
+    if names:
+        text = NAME.sub(lambda m: str(names.get(m.group().lower(), m.group())), text)
+    values = set()
+    for item in text.split(','):
+        part, _, step = item.partition('/')
+        if step and int(step) < 1:
+            raise ValueError(f"{text!r} steps by {step}")
+        if part == '*':
+            a, b = lo, hi
+        elif '-' in part:
+            a, b = map(int, part.split('-'))
+        else:
+            a = int(part)
+            b = hi if step else a
+        values.update(range(a, b + 1, int(step) if step else 1))
+    if not values or min(values) < lo or max(values) > hi:
+        raise ValueError(f"{text!r} is outside {lo}-{hi}")
+    return sorted(values)
+
+
+def schedule(cron):
+    """The Schedule of cron, or None when there is none or it does not parse."""
+    try:
+        return Schedule(cron) if cron else None
+    except ValueError:
+        return None
+
+
+class Schedule:
+    """A parsed cron string."""
+
+    def __init__(self, cron):
+        parts = cron.split()
+        if len(parts) == 5:
+            parts = ['0'] + parts
+        if len(parts) != 6:
+            raise ValueError(f"{cron!r} has {len(parts)} fields, not 5 or 6")
+        self.cron = cron
+        self.second, self.minute, self.hour, self.dom, self.month, dow = (
+            _field(p, lo, hi, NAMES.get(i)) for i, (p, (lo, hi)) in enumerate(zip(parts, FIELDS)))
+        self.dow = sorted({d % 7 for d in dow})
+        self.any_dom, self.any_dow = parts[3] == '*', parts[5] == '*'
+
+    def on(self, day):
+        """Whether the schedule fires on the date day."""
+        if day.month not in self.month:
+            return False
+        dom, dow = day.day in self.dom, (day.weekday() + 1) % 7 in self.dow
+        if self.any_dom or self.any_dow:
+            return dom and dow
+        return dom or dow
+
+    def per_day(self):
+        """Firings on a day it fires on."""
+        return len(self.second) * len(self.minute) * len(self.hour)
+
+    def minutes(self, start, days):
+        """(minute, firings in it) of every minute it fires in over days days from the date
+        start, minutes counted from the start."""
+        out, per = [], len(self.second)
+        for d in range(days):
+            if self.on(start + timedelta(days=d)):
+                out += [(d * 1440 + h * 60 + m, per) for h in self.hour for m in self.minute]
+        return out
+
+    def per_hour(self):
+        """Firings per hour, averaged over the reference year."""
+        days = 366 if calendar.isleap(REFERENCE_YEAR) else 365
+        first = date(REFERENCE_YEAR, 1, 1).toordinal()
+        on = sum(1 for d in range(days) if self.on(date.fromordinal(first + d)))
+        return self.per_day() * on / (days * 24)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""What each `eager: true` relation costs, and what turning it off would save.
+
+A `find*` call joins every eager relation of its entity, every eager relation of those, and so
+on; `measure.js` counts the SELECT list the query ends up with, not what it is made of. This
+step rebuilds every site measured at its default query from the entity metadata `measure.js`
+exports (`models` in `meta-tables.json`), walked the way the measurement's cache key walks it:
+the entity, the relations the site names, every eager relation reached from either - except
+one leading back into an entity already on the path, which TypeORM does not follow either. Per
+eager relation it reports
+
+  cols, joins    what it adds to a default query on its own entity
+  sites          the measured sites whose query joins it eagerly, and the columns they lose
+                 without it
+  endpoints      the endpoints reaching one of those sites, and by how much their Max cols
+                 would drop
+
+ranked by that drop summed over the endpoints: the payoff of the flag. A relation a site names
+in its `relations` is not counted against the eager flag - the site asks for it either way.
+
+The model is checked against the measurement: how many sites it reproduces exactly is
+reported. A site it does not reproduce keeps its measured width, minus the difference the
+model predicts.
+
+    inventory.py eager [--work DIR]                               the ranking of a run
+    inventory.py eager --off UserData.country [--off ...] [--work DIR]
+                                                                  every site and endpoint that
+                                                                  would change, code untouched
+
+Writes `eager-impact.json`.
+"""
+import json
+
+from callgraph import CallGraph, Summary
+import workdir
+
+# The files a run leaves that the ranking and a simulation are computed from.
+INPUTS = ('sites-measured.json', 'meta-tables.json', 'call-graph.json', 'endpoint-eff.json')
+
+
+def default_query(site, models):
+    """Whether `measure.js` measured site at the default query of its entity - not at a
+    projection or a counted select list."""
+    return (bool(site.get('cols')) and not site.get('projection') and site.get('select_count') is None
+            and site.get('entity') in models)
+
+
+def expansion(models, entity, relations=None, off=frozenset(), path=()):
+    """Columns and JOINs of the default query on entity loading relations, with the eager
+    relations in off ('Entity.relation') turned off, and the eager relations it joins."""
+    path = path or (entity,)
+    m = models[entity]
+    cols, joins, eager = m['cols'], 0, set()
+    for prop, r in m['relations'].items():
+        sub = relations.get(prop) if relations else None
+        edge = f"{entity}.{prop}"
+        if r['entity'] not in models: continue
+        if not sub and (not r['eager'] or edge in off or r['entity'] in path): continue
+        c, j, e = expansion(models, r['entity'], sub if isinstance(sub, dict) else None, off,
+                            path + (r['entity'],))
+        cols, joins, eager = cols + c, joins + r['joins'] + j, eager | e
+        if not sub:
+            eager.add(edge)
+    return cols, joins, eager
+
+
+class Impact:
+    """The measured sites and endpoints of a run, and how they would measure with some eager
+    relations turned off."""
+
+    def __init__(self, sites, tables, graph, endpoints):
+        self.models = {name: m for t in tables.values() for name, m in t.get('models', {}).items()}
+        measured = {(s['file'], s['line'], s.get('col')): s for s in sites if s.get('cols')}
+        self.cols = {k: s['cols'] for k, s in measured.items()}
+        self.sites = {k: s for k, s in measured.items() if default_query(s, self.models)}
+        self._built = {}
+        self.base = {k: self.build(s) for k, s in self.sites.items()}
+        self.agree = sum(1 for k, s in self.sites.items() if self.base[k][:2] == (s['cols'], s.get('joins')))
+        self.graph = CallGraph([(m['cls'], m['method']) for m in graph],
+                               {(m['cls'], m['method']): [tuple(t) for t in m['calls']] for m in graph})
+        self.holding = {(m['cls'], m['method']): [tuple(at) for at in m['sites'] if tuple(at) in measured]
+                        for m in graph}
+        self.methods_of = {}
+        for method, ats in self.holding.items():
+            for at in ats:
+                self.methods_of.setdefault(at, []).append(method)
+        self.local = self._local(self.cols, self.holding)
+        self.max_cols = Summary(self.graph, self.local, max, 0)
+        self.endpoints = endpoints
+
+    def eager(self):
+        """Every eager relation of the metadata, as 'Entity.relation'."""
+        return sorted(f"{name}.{prop}" for name, m in self.models.items()
+                      for prop, r in m['relations'].items() if r['eager'])
+
+    def build(self, site, off=frozenset()):
+        # Many sites share an entity and a relations tree; each pair is walked once per `off`.
+        key = (site['entity'], json.dumps(site.get('relations'), sort_keys=True), off)
+        if key not in self._built:
+            self._built[key] = expansion(self.models, site['entity'], site.get('relations'), off)
+        return self._built[key]
+
+    @staticmethod
+    def _local(cols, holding):
+        return {m: max([cols.get(at, 0) for at in ats] or [0]) for m, ats in holding.items()}
+
+    def simulate(self, off):
+        """The sites and endpoints whose width changes with the eager relations in off turned
+        off: {site: (cols, joins, new cols, new joins)} and [(endpoint, Max cols, new Max cols)]."""
+        off = frozenset(off)
+        sites = {}
+        for k, s in self.sites.items():
+            if not self.base[k][2] & off: continue
+            bc, bj, _ = self.base[k]
+            c, j, _ = self.build(s, off)
+            if (c, j) != (bc, bj):
+                sites[k] = (s['cols'], s.get('joins') or 0, s['cols'] - bc + c, (s.get('joins') or 0) - bj + j)
+        cols = {**self.cols, **{k: v[2] for k, v in sites.items()}}
+        methods = {m for k in sites for m in self.methods_of.get(k, ())}
+        before = [(e, self.max_cols.get((e['controller'], e['handler']), 0)) for e in self.endpoints]
+        # One propagation from the changed methods, then back: the summary is shared between
+        # the simulations of a ranking.
+        self.max_cols.update(self._local(cols, {m: self.holding[m] for m in methods}))
+        after = [self.max_cols.get((e['controller'], e['handler']), 0) for e in self.endpoints]
+        self.max_cols.update({m: self.local[m] for m in methods})
+        return sites, [(e, b, a) for (e, b), a in zip(before, after) if a != b]
+
+    def paying(self, sites):
+        """The endpoints reaching one of sites, whether or not it is their widest."""
+        reach = self.graph.reaching({m for k in sites for m in self.methods_of.get(k, ())})
+        return [e for e in self.endpoints if (e['controller'], e['handler']) in reach]
+
+
+def rank(impact):
+    """Per eager relation what it adds and who pays for it, by payoff."""
+    rows = []
+    for edge in impact.eager():
+        owner, prop = edge.split('.', 1)
+        cols, joins, _ = expansion(impact.models, owner)
+        c, j, _ = expansion(impact.models, owner, off=frozenset({edge}))
+        sites, endpoints = impact.simulate({edge})
+        rows.append({'relation': edge, 'entity': impact.models[owner]['relations'][prop]['entity'],
+                     'cols': cols - c, 'joins': joins - j,
+                     'sites': len(sites), 'site_cols': sum(v[0] - v[2] for v in sites.values()),
+                     'endpoints': len(impact.paying(sites)), 'narrowed': len(endpoints),
+                     'max_cols': sum(b - a for _, b, a in endpoints)})
+    return sorted(rows, key=lambda r: (-r['max_cols'], -r['site_cols'], r['relation']))
+
+
+def main():
+    impact = Impact(*map(workdir.load, INPUTS))
+    rows = rank(impact)
+    workdir.save('eager-impact.json', {'model': {'sites': len(impact.sites), 'agree': impact.agree},
+                                       'relations': rows})
+    report(rows, impact)
+
+
+def report(rows, impact):
+    print(f"eager relations: {len(rows)}, {sum(1 for r in rows if r['sites'])} of them joined by a "
+          f"measured site | model reproduces {impact.agree} of {len(impact.sites)} default queries")
+    ranking(rows[:10])
+
+
+def ranking(rows):
+    print(f"{'relation':40s} {'cols':>5} {'joins':>5} {'sites':>5} {'endpoints':>9} {'Max cols saved':>14}")
+    for r in rows:
+        print(f"{r['relation']:40s} {r['cols']:5d} {r['joins']:5d} {r['sites']:5d} {r['endpoints']:9d} "
+              f"{r['max_cols']:14d}")
+
+
+def what_if(work, off):
+    """Print what turning off the eager relations in off would change in the run in work; with
+    none, the ranking that run wrote."""
+    def load(name):
+        p = workdir.locate(work, name)
+        if p is None:
+            raise SystemExit(f"{work} holds no {name} - name the work directory of a finished run")
+        return workdir.read(p)
+    if not off:
+        ranking(load('eager-impact.json')['relations'])
+        return
+    impact = Impact(*map(load, INPUTS))
+    if not impact.models:
+        raise SystemExit("meta-tables.json carries no entity models - it was written by a "
+                         "measure.js from before eager_impact.py; rerun the chain")
+    unknown = sorted(set(off) - set(impact.eager()))
+    if unknown:
+        raise SystemExit(f"not an eager relation of the metadata: {', '.join(unknown)} "
+                         "(written Entity.relation, e.g. UserData.country)")
+    sites, endpoints = impact.simulate(off)
+    print(f"with {', '.join(sorted(off))} not eager: {len(sites)} sites and {len(endpoints)} endpoints change "
+          f"(the model reproduces {impact.agree} of {len(impact.sites)} default queries)")
+    print(f"\n{'cols':>11} {'joins':>7}  site")
+    for (f, line, _), (c, j, c2, j2) in sorted(sites.items(), key=lambda x: (x[1][2] - x[1][0], x[0][:2])):
+        print(f"{c:5d} > {c2:<4d} {j:3d} > {j2:<3d} {f}:{line}")
+    print(f"\n{'Max cols':>11}  endpoint")
+    for e, b, a in sorted(endpoints, key=lambda x: (x[2] - x[1], x[0]['path'], x[0]['verb'])):
+        print(f"{b:5d} > {a:<4d} {e['verb']:6s} {e['path']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -11,11 +11,19 @@ Categories per load site (verified against the TypeORM metadata):
   createQueryBuilder().select([...])        -> only the listed fields          -> proj
   .query(...)  raw SQL                      -> depends on the statement        -> raw
 """
-import re, glob, os, json
-from collections import defaultdict
+import re, operator, os, pickle
+from bisect import bisect_left
+from collections import Counter, defaultdict
 
 import classify
-from tsparse import read_text, rel_path
+import crontab
+from callgraph import CallGraph, Summary
+import incremental
+import pool
+import stageprof
+import workdir
+from srcindex import IdentifierIndex, shared
+from tsparse import READ, IntervalIndex, injected, line_col, per_item_regions, rel_path, src_path
 
 SP = os.environ.get("INVENTORY_WORK")
 if not SP:
@@ -24,53 +32,13 @@ SRC = os.environ.get("API_SRC")
 if not SRC:
     raise SystemExit("API_SRC is not set - run this through scripts/inventory/run.sh")
 
-FIND = re.compile(r'\.(find|findOne|findBy|findOneBy|findAndCount|findOneOrFail|'
-                  r'findCached|findCachedBy|findOneCached|findOneCachedBy)\s*\(')
-QB = re.compile(r'\.createQueryBuilder\s*\(')
-RAW = re.compile(r'\.query\s*\(')
-SIG = re.compile(r'^\s{2,}(?:public|private|protected)?\s*(?:async\s+)?(\w+)\s*(?:<[^>]*>)?\s*\(', re.M)
-SKIP = {'constructor', 'if', 'for', 'while', 'switch', 'catch', 'return', 'do', 'else', 'try'}
+# The reads a method body makes come from the source index's events (`tsparse.READ_CALL`):
+# `find*(...)`, `createQueryBuilder(...)` and `.query(...)` resp.
+QB, RAW = 'createQueryBuilder', 'query'
 # Calls through `this`. Dots may be surrounded by newlines - the fluent style
 # `this.service\n  .method(...)` is the rule in this repo, not the exception.
 CALL = re.compile(r'this\s*\.\s*((?:\w+\s*\.\s*)*\w+)\s*\(')
 
-def brace(s, i):
-    d = 0
-    for j in range(i, len(s)):
-        if s[j] == '{': d += 1
-        elif s[j] == '}':
-            d -= 1
-            if d == 0: return s[i + 1:j], j
-    return s[i + 1:], len(s)
-
-def body_start(s, i):
-    """First '{' AFTER the return type annotation, from position i (past the parameter list).
-
-    `Promise<{ data: X; capReached: boolean }>` contains a brace that looks like a method body.
-    Detection rule, exact rather than heuristic: if a brace group closes and another '{'
-    follows immediately, the first one was the type annotation. A real body is never
-    immediately followed by an opening brace.
-    """
-    lt, j = 0, i
-    while j < len(s):
-        c = s[j]
-        if c == '<': lt += 1
-        elif c == '>':
-            if lt: lt -= 1                     # do not let '=>' in function types go negative
-        elif c == ';' and lt == 0:
-            return -1                          # abstract declaration, no body
-        elif c == '{':
-            _, close = brace(s, j)
-            if lt > 0:                         # brace inside '<...>' = type
-                j = close + 1; continue
-            nxt = close + 1
-            while nxt < len(s) and s[nxt] in ' \n\r\t': nxt += 1
-            if nxt < len(s) and s[nxt] == '{':  # plain object return type
-                j = nxt; continue
-            return j
-        j += 1
-    return -1
-
 # Inherited write/count operations: no eager loading, and not findable on the concrete class.
 NO_LOAD = {'save', 'update', 'create', 'delete', 'remove', 'insert', 'upsert', 'increment',
            'decrement', 'count', 'countBy', 'exists', 'existsBy', 'invalidateCache', 'clear',
@@ -86,173 +54,248 @@ ARROW = re.compile(r'\s*(?:\([^()]*\)|\w+)\s*=>')
 # transaction callback — `manager.find(CustodyAccount, {...})` is a genuine repository read, and
 # leaving it out dropped seven of them without even marking the edge as unresolved.
 REPOISH = re.compile(r'repo|repository|entitymanager|^manager$', re.I)
+# What precedes a `find(`, searched back from it.
+GET_REPOSITORY = re.compile(r'getRepository\s*\([^)]*\)\s*$')
+THIS_FIELD = re.compile(r'this\s*\.\s*(\w+)\s*$')
+THIS = re.compile(r'this\s*$')
+RECEIVER = re.compile(r'(\w+)\s*$')
+RAW_RECEIVER = re.compile(r'this\.(\w+)\s*$')
 
-def is_db_find(body, fm, cls):
-    """Tells `repo.find({...})` apart from `array.find(x => ...)`.
+def is_db_find(text, lo, hi, call, start, end, cls, inject):
+    """Tells `repo.find({...})` apart from `array.find(x => ...)`, for the read of call at
+    [start, end) in the method body text[lo:hi].
 
     Arrays have `find` too - without this distinction every search in a list counts as a
     database access. `findOne`/`findBy`/`findAndCount` do not exist on arrays and are
     unambiguous; only `find` itself needs the check.
     """
-    if fm.group(1) != 'find': return True
-    if ARROW.match(body, fm.end()): return False          # callback, not a search condition
-    pre = body[max(0, fm.start() - 90):fm.start()]
-    if re.search(r'getRepository\s*\([^)]*\)\s*$', pre): return True
-    tm = re.search(r'this\s*\.\s*(\w+)\s*$', pre)
+    if call != 'find': return True
+    if ARROW.match(text, end, hi): return False          # callback, not a search condition
+    pre = max(lo, start - 90)
+    if GET_REPOSITORY.search(text, pre, start): return True
+    tm = THIS_FIELD.search(text, pre, start)
     if tm:
-        t = INJECT.get(cls, {}).get(tm.group(1), '')
+        t = inject.get(cls, {}).get(tm.group(1), '')
         return bool(REPOISH.search(tm.group(1)) or REPOISH.search(t or ''))
-    if re.search(r'this\s*$', pre): return cls.endswith('Repository')
-    vm = re.search(r'(\w+)\s*$', pre)
+    if THIS.search(text, pre, start): return cls.endswith('Repository')
+    vm = RECEIVER.search(text, pre, start)
     return bool(vm and REPOISH.search(vm.group(1)))
 
-SITES_OF = {}                    # (cls, meth) -> {(file, line)}
-METHODS = defaultdict(dict)      # cls -> meth -> list[body]
-INJECT = defaultdict(dict)       # cls -> field -> type
-DIRECT = defaultdict(dict)       # cls -> meth -> set(categories)
+def file_facts(f):
+    """What the call graph needs from one file, independent of every other file.
 
-for f in sorted(glob.glob(os.path.join(SRC, '**', '*.ts'), recursive=True)):
-    if '__tests__' in f or '.spec.' in f: continue
-    s = classify.strip_line_comments(read_text(f))
+    Kept per file so that an incremental run can rescan only the files that changed and merge
+    their facts with the previous run's: the injected fields and method bodies of each class,
+    the load-site categories and keys each method reaches directly, the parts of each body that
+    run once per element (`tsparse.per_item_regions`, relative to the body) and the load sites
+    that sit in one.
+    """
+    e = INDEX.get(f)
+    s = e['text']
     rel = rel_path(SRC, f)
-    classes = [(m.start(), m.group(1)) for m in
-               re.finditer(r'export\s+(?:abstract\s+)?class\s+(\w+)', s)]
-    if not classes: continue
-
-    def owner(pos):
-        cur = None
-        for cpos, cname in classes:
-            if cpos < pos: cur = cname
-            else: break
-        return cur
-
-    for mm in re.finditer(r'(?:private|public|protected)\s+(?:readonly\s+)?(\w+)\s*:\s*(\w+)', s):
-        c = owner(mm.start())
-        if c: INJECT[c][mm.group(1)] = mm.group(2)
-    for mm in re.finditer(r'@InjectRepository\((\w+)\)\s*(?:private|public|protected)?\s*'
-                          r'(?:readonly\s+)?(\w+)', s):
-        c = owner(mm.start())
-        if c: INJECT[c][mm.group(2)] = mm.group(1) + 'Repository'
-
-    for sm in SIG.finditer(s):
-        name = sm.group(1)
-        if name in SKIP: continue
-        cls = owner(sm.start())
-        if not cls: continue
-        # skip the parameter list (destructured parameters would otherwise be the "body")
-        dp, i = 1, sm.end()
-        while i < len(s) and dp:
-            if s[i] == '(': dp += 1
-            elif s[i] == ')': dp -= 1
-            i += 1
-        ob = body_start(s, i)
-        if ob < 0: continue
-        mb, _ = brace(s, ob)
-        METHODS[cls].setdefault(name, []).append(mb)   # name collisions: union them
-
-        kinds = DIRECT[cls].setdefault(name, set())
-        sites = SITES_OF.setdefault((cls, name), set())
+    methods, direct, sites_of, per_item, looped = {}, {}, {}, {}, {}
+    if not e['classes']:
+        return {'inject': {}, 'methods': methods, 'direct': direct, 'sites': sites_of,
+                'per_item': per_item, 'looped': looped}
+    owner = IntervalIndex(e['classes']).at
+
+    inject = injected(e['events'], owner)
+    reads = [ev for ev in e['events'] if ev[1] == READ]
+    at_read = [ev[0] for ev in reads]
+
+    # Query-builder chains by position, already cut at the end of their statement by the index.
+    chain_end = {start: end for start, _, end in e['chains']}
+    for sig, name, ob, close in e['methods']:
+        cls = owner(sig)
+        if not cls or ob < 0: continue
+        mb = s[ob + 1:close]
+        methods.setdefault(cls, {}).setdefault(name, []).append(mb)   # name collisions: union them
+        regions = per_item_regions(s, ob + 1, close, e['tokens'])
+        per_item.setdefault(cls, {}).setdefault(name, []).append([(a - ob - 1, b - ob - 1) for a, b in regions])
+
+        kinds = direct.setdefault(cls, {}).setdefault(name, set())
+        sites = sites_of.setdefault((cls, name), set())
+        per_row = looped.setdefault((cls, name), set())
         def at(off):
             """(file, line, column) of the load site.
 
             The column is part of the key because a line can carry two calls; keying on the
             line alone collapses them into one and loses the second one's measurement.
             """
-            pos = ob + 1 + off
-            return rel, s[:pos].count('\n') + 1, pos - (s.rfind('\n', 0, pos) + 1)
-        for fm in FIND.finditer(mb):
-            if is_db_find(mb, fm, cls):
-                kinds.add('over'); sites.add(at(fm.start()))
-        for qm in QB.finditer(mb):
-            chain = mb[qm.end():qm.end() + classify.CHAIN_WINDOW].split(';')[0]
+            return (rel, *line_col(e['lines'], ob + 1 + off))
+        def load(start):
+            """Record the load site at start, and whether it runs once per element."""
+            if any(a < start < b for a, b in regions): per_row.add(at(start - ob - 1))
+        # The reads inside this body, from the index's events: no pattern runs over it again.
+        inside = reads[bisect_left(at_read, ob + 1):bisect_left(at_read, close)]
+        for start, _, end, call in inside:
+            if call in (QB, RAW): continue
+            if is_db_find(s, ob + 1, close, call, start, end, cls, inject):
+                kinds.add('over'); sites.add(at(start - ob - 1)); load(start)
+        for start, _, end, call in inside:
+            if call != QB: continue
+            # The chain as the index cut it, and never past the end of this method.
             # `.update()/.delete()/.insert()` are write statements - they load nothing
-            if classify.WRITE_CHAIN.search(chain): continue
+            if classify.WRITE_CHAIN.search(s, end, min(chain_end[start], close)): continue
             # The same categorisation sites.py records, so the endpoint-level and site-level
             # views cannot disagree. Recognising only a literal `.select([` here classified
             # every endpoint projecting through `PROJECTION.apply(...)` or naming its columns
             # one at a time as loading whole rows - the converted endpoints above all others.
-            kinds.add('proj' if classify.select_kind(mb, qm.start(), qm.end()) in classify.NARROWING
+            kinds.add('proj' if classify.select_kind(mb, start - ob - 1, end - ob - 1) in classify.NARROWING
                       else 'over')
-            sites.add(at(qm.start()))
-        for rm in RAW.finditer(mb):
-            pre = mb[max(0, rm.start() - 60):rm.start()]
-            if re.search(r'this\.(\w+)\s*$', pre) or re.search(r'this\s*$', pre):
+            sites.add(at(start - ob - 1)); load(start)
+        for start, _, end, call in inside:
+            if call != RAW: continue
+            pre = max(ob + 1, start - 60)
+            if RAW_RECEIVER.search(s, pre, start) or THIS.search(s, pre, start):
                 # An advisory lock returns no rows and a raw write loads nothing - neither is
                 # a read, so neither makes the endpoint one. The statement is read to its
                 # closing parenthesis: a window would miss a write far down a long template
                 # literal, which is exactly the shape the one raw write in this repo has.
-                if classify.raw_kind_of(classify.raw_statement(mb, rm.start())) == 'read':
-                    kinds.add('raw')
-
-# ---- build the call graph (edges once, then a fixpoint instead of recursion) ----
-# The fixpoint handles cycles exactly: a recursion with cycle breaking yields different
-# results depending on the entry point, and caches them on top of that.
-EDGES = defaultdict(set)
-LOCAL_OK = {}
-for cls in METHODS:
-    for meth, bodies in METHODS[cls].items():
-        key = (cls, meth)
-        ok = True
-        for body in bodies:
+                if classify.raw_kind_of(classify.raw_statement(mb, start - ob - 1)) == 'read':
+                    kinds.add('raw'); load(start)
+    return {'inject': inject, 'methods': methods, 'direct': direct, 'sites': sites_of,
+            'per_item': per_item, 'looped': looped}
+
+
+INDEX = shared(SRC)
+
+
+def merge_facts(facts):
+    """The facts of every file, merged in file order as a single pass over the tree would have
+    collected them: (inject, methods, direct, sites_of, per_item, looped)."""
+    inject = defaultdict(dict)       # cls -> field -> type
+    methods = defaultdict(dict)      # cls -> meth -> list[body]
+    direct = defaultdict(dict)       # cls -> meth -> set(categories)
+    sites_of = {}                    # (cls, meth) -> {(file, line, col)}
+    per_item = defaultdict(dict)     # cls -> meth -> list[regions of the body at the same index]
+    looped = {}                      # (cls, meth) -> {(file, line, col)} run once per element
+    for rel in sorted(facts):
+        f = facts[rel]
+        for c, fields in f['inject'].items():
+            inject[c].update(fields)
+        for c, meths in f['methods'].items():
+            for name, bodies in meths.items():
+                methods[c].setdefault(name, []).extend(bodies)
+                per_item[c].setdefault(name, []).extend(f['per_item'][c][name])
+        for c, meths in f['direct'].items():
+            for name, kinds in meths.items():
+                direct[c].setdefault(name, set()).update(kinds)
+        for key, keys in f['sites'].items():
+            sites_of.setdefault(key, set()).update(keys)
+        for key, keys in f['looped'].items():
+            if keys: looped.setdefault(key, set()).update(keys)
+    return inject, methods, direct, sites_of, per_item, looped
+
+
+def call_edges(methods, inject, per_item, keys=None):
+    """The call edges and local completeness of every method in keys (default: all of them).
+
+    Also returns, per method, the classes its calls were resolved through: its own, the type of
+    every field on the way, every locally constructed one. Edges change only with the fields or
+    method names of those classes, which is how `watch.py` tells what a change can reach. And
+    the edges made from a part of the body that runs once per element - a call per row.
+    """
+    edges, local_ok, through, per_row = defaultdict(set), {}, {}, defaultdict(set)
+    for key in keys if keys is not None else [(c, m) for c in methods for m in methods[c]]:
+        cls, meth = key
+        ok, seen = True, {cls}
+        for body, regions in zip(methods[cls][meth], per_item[cls][meth]):
+            def call(target, pos):
+                edges[key].add(target)
+                if any(a < pos < b for a, b in regions): per_row[key].add(target)
             # locally constructed objects: `const txLogRepo = new LogRepository(manager)` and
             # then `txLogRepo.getFoo(...)` - without this edge type a transaction that builds
             # its own repository stays invisible.
             local = {m.group(1): m.group(2)
                      for m in re.finditer(r'\b(?:const|let|var)\s+(\w+)\s*=\s*new\s+(\w+)\s*\(', body)}
+            seen.update(local.values())
             for lm in re.finditer(r'\b(\w+)\s*\.\s*(\w+)\s*\(', body):
                 t = local.get(lm.group(1))
-                if t and lm.group(2) in METHODS.get(t, {}):
-                    EDGES[key].add((t, lm.group(2)))
+                if t and lm.group(2) in methods.get(t, {}):
+                    call((t, lm.group(2)), lm.start())
             for cm in CALL.finditer(body):
                 parts = [p.strip() for p in cm.group(1).split('.')]
                 called, fields = parts[-1], parts[:-1]
                 sub_cls, external = cls, False
                 for fld in fields:
-                    t = INJECT.get(sub_cls, {}).get(fld)
+                    t = inject.get(sub_cls, {}).get(fld)
                     if t in EXTERNAL: external = True; break
                     if t is None:
                         ok = False              # unknown field type: an honest doubtful case
                         external = True; break
                     sub_cls = t
+                    seen.add(t)
                 if external or sub_cls in EXTERNAL: continue
-                if called not in METHODS.get(sub_cls, {}):
+                if called not in methods.get(sub_cls, {}):
                     # no body: an inherited write/count operation loads nothing,
                     # anything else is a genuine doubtful case
                     if called not in NO_LOAD: ok = False
                     continue
-                EDGES[key].add((sub_cls, called))
-        LOCAL_OK[key] = ok
-
-# Measured column count per load site (from the TypeORM measurement), joined on file+line+column.
-# `sites.py` records the column for exactly this reason: two calls on one line would otherwise
-# share a key, and the second measurement would overwrite the first.
-with open(SP + '/sites-measured.json') as fh:
-    _measured = json.load(fh)
-MEAS = {(s['file'], s['line'], s.get('col')): s.get('cols')
-        for s in _measured if s.get('cols')}
-if not MEAS:
-    raise SystemExit("sites-measured.json carries no column counts - measure.js produced "
-                     "nothing usable, so every endpoint would report a width of zero")
-
-KINDS = {k: set(DIRECT[k[0]].get(k[1], set())) for k in LOCAL_OK}
-OK = dict(LOCAL_OK)
-MAXCOL = {k: max([MEAS.get(x, 0) for x in SITES_OF.get(k, ())] or [0]) for k in LOCAL_OK}
-changed = True
-while changed:
-    changed = False
-    for n, targets in EDGES.items():
-        for t in targets:
-            if not KINDS[t] <= KINDS[n]:
-                KINDS[n] |= KINDS[t]; changed = True
-            if OK[n] and not OK[t]:
-                OK[n] = False; changed = True
-            if MAXCOL[t] > MAXCOL[n]:
-                MAXCOL[n] = MAXCOL[t]; changed = True
-
-def reach(cls, meth):
-    key = (cls, meth)
-    if key not in KINDS: return set(), False
-    return KINDS[key], OK[key]
+                call((sub_cls, called), cm.start())
+        local_ok[key] = ok
+        through[key] = seen
+    return edges, local_ok, through, per_row
+
+
+def local_values(keys, direct, sites_of, meas):
+    """Per method, what it contributes itself: its load-site categories and its widest measured
+    site."""
+    kinds = {k: frozenset(direct[k[0]].get(k[1], ())) for k in keys}
+    maxcol = {k: max([meas.get(x, 0) for x in sites_of.get(k, ())] or [0]) for k in keys}
+    return kinds, maxcol
+
+
+class PerItem:
+    """Which methods run a query once per element of a collection - an N+1 - and how.
+
+    A method does so itself when one of its load sites sits in a loop or a per-element
+    callback, or when it calls from one into a method that reaches a load site (`kinds` is that
+    summary). Any method reaching such a method does too: the flag is one more summary over the
+    graph, joined with `or`.
+    """
+
+    def __init__(self, graph, kinds, looped, per_row, sites_of):
+        self.graph, self.looped, self.per_row, self.sites_of = graph, looped, per_row, sites_of
+        self.local = {k: bool(looped.get(k)) or any(kinds.get(t) for t in per_row.get(k, ()))
+                      for k in graph.nodes}
+        self.kinds = kinds
+        self.summary = Summary(graph, self.local, operator.or_, False)
+
+    def __contains__(self, key):
+        return bool(self.summary.get(key))
+
+    def _nearest(self, start, found):
+        """The shortest call path from start to a method for which found holds, successors in
+        sorted order so the answer does not depend on set order; None if there is none."""
+        parent, queue = {start: None}, [start]
+        for node in queue:
+            if found(node):
+                path = []
+                while node is not None:
+                    path.append(node); node = parent[node]
+                return path[::-1]
+            for t in sorted(self.graph.edges.get(node, ())):
+                if t not in parent:
+                    parent[t] = node; queue.append(t)
+        return None
+
+    def path(self, key):
+        """The path from key to the query it runs once per element, as text - `A.b → for each:
+        C.d → src/x.ts:12` - or None."""
+        if key not in self: return None
+        name = lambda k: f"{k[0]}.{k[1]}"
+        head = self._nearest(key, lambda k: self.local.get(k))
+        m = head[-1]
+        if self.looped.get(m):
+            f, line, _ = min(self.looped[m])
+            return ' → '.join(map(name, head)) + f" → for each: {f}:{line}"
+        t = min(x for x in self.per_row[m] if self.kinds.get(x))
+        tail = self._nearest(t, lambda k: self.sites_of.get(k)) or [t]
+        site = min(self.sites_of[tail[-1]]) if self.sites_of.get(tail[-1]) else None
+        return (' → '.join(map(name, head)) + ' → for each: ' + ' → '.join(map(name, tail)) +
+                (f" → {site[0]}:{site[1]}" if site else ''))
+
 
 # ---- Resolved by hand: dynamic targets the graph does not reach ----
 # Every entry was read in the source; the reason follows it. None of them loads from the
@@ -290,30 +333,124 @@ MANUAL_NO_DB = {
     ('AppController', 'getVersion'): 'reads `dist/version.txt` from disk',
 }
 
-with open(SP + '/table.json') as fh:
-    eps = json.load(fh)
-out = []
-for r in eps:
-    k, ok = reach(r['controller'], r['handler'])
+def endpoint_row(r, kinds, ok, maxcol, per_item):
+    """A route of `table.json` with what its handler reaches: `kinds`, `complete`, `manual`,
+    `maxcol`, and `per_item`, the path to a query it runs once per element (`PerItem.path`)."""
     key = (r['controller'], r['handler'])
+    k, complete = (kinds[key], ok[key]) if key in kinds else (set(), False)
     manual = None
-    if not k and not ok and key in MANUAL_NO_DB:
-        ok, manual = True, MANUAL_NO_DB[key]
-    out.append({**r, 'kinds': sorted(k), 'complete': ok, 'manual': manual,
-                'maxcol': MAXCOL.get((r['controller'], r['handler']), 0)})
-# Does any spec touch this endpoint at all? Strict: the same file names the controller AND
-# calls the handler. A weak signal and a lower bound - specs that drive a route over HTTP
-# without naming the handler fall through.
-SPECS = [read_text(f)
-         for f in glob.glob(os.path.join(SRC, '**', '*.spec.ts'), recursive=True)]
-for r in out:
-    pat = re.compile(r'\b' + re.escape(r['handler']) + r'\s*\(')
-    r['spec'] = any(r['controller'] in txt and pat.search(txt) for txt in SPECS)
-
-with open(SP + '/endpoint-eff.json', 'w') as fh:
-    json.dump(out, fh, indent=1)
-
-from collections import Counter
+    if not k and not complete and key in MANUAL_NO_DB:
+        complete, manual = True, MANUAL_NO_DB[key]
+    return {**r, 'kinds': sorted(k), 'complete': complete, 'manual': manual, 'maxcol': maxcol.get(key, 0),
+            'per_item': per_item.path(key)}
+
+
+def cron_jobs(graph, kinds, ok, maxcol, per_item, sites_of, meas):
+    """Every `@DfxCron` job, a root of the call graph as a route is: what it reaches, as for an
+    endpoint, and how often it runs.
+
+    The load per hour counts every load site the job reaches once per run - more than a run
+    that takes one branch does, less than one that queries per element (`per_item`).
+    """
+    custom = crontab.custom_expressions(INDEX)
+    rows = []
+    for f in INDEX.paths():
+        if '__tests__' in f or '.spec.' in f: continue
+        for line, cls, handler, argument in INDEX.get(f)['crons']:
+            key = (cls, handler)
+            decl = crontab.declaration(argument, custom)
+            reached = {at for m in graph.reachable(key) for at in sites_of.get(m, ())}
+            schedule = crontab.schedule(decl['cron'])
+            if schedule is None:
+                # Reported as unresolved rather than failing the step.
+                decl['cron'] = None
+            runs = schedule.per_hour() if schedule else None
+            cols = sum(meas.get(at, 0) for at in reached)
+            rows.append({'job': f"{cls}::{handler}", 'cls': cls, 'method': handler, 'file': rel_path(SRC, f),
+                         'line': line, **decl, 'kinds': sorted(kinds.get(key, ())),
+                         'complete': ok.get(key, False), 'maxcol': maxcol.get(key, 0),
+                         'per_item': per_item.path(key), 'sites': len(reached), 'cols': cols,
+                         'runs_per_hour': runs,
+                         'queries_per_hour': None if runs is None else runs * len(reached),
+                         'cols_per_hour': None if runs is None else runs * cols})
+    return sorted(rows, key=lambda r: (r['file'], r['line']))
+
+
+def main():
+    plan = incremental.load_plan()
+    if plan:
+        # Facts of the untouched files come from the previous run, the changed files are rescanned.
+        with open(plan.previous_path('endpoint-facts.pickle'), 'rb') as fh:
+            facts = {r: v for r, v in pickle.load(fh).items() if not plan.touches(r)}
+        files = [f for f in map(lambda r: src_path(SRC, r), sorted(plan.changed)) if INDEX.source.exists(f)]
+        if any('per_item' not in v for v in facts.values()):
+            # A run from before the per-element regions were recorded: its facts cannot say
+            # which calls run per row, and merging them would hide every N+1 they contain.
+            print("the previous run's facts carry no per-element regions - scanning every file")
+            facts, files = {}, INDEX.paths()
+    else:
+        facts, files = {}, INDEX.paths()
+    files = [f for f in files if '__tests__' not in f and '.spec.' not in f]
+    facts.update(zip((rel_path(SRC, f) for f in files), pool.map_files(file_facts, files, INDEX)))
+    with open(SP + '/endpoint-facts.pickle', 'wb') as fh:
+        pickle.dump(facts, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    stageprof.mark('facts')
+
+    inject, methods, direct, sites_of, regions, looped = merge_facts(facts)
+    # ---- build the call graph (edges once, then one pass over its condensation) ----
+    # Cycles are handled exactly: a recursion with cycle breaking yields different results
+    # depending on the entry point, and caches them on top of that. See callgraph.py.
+    edges, local_ok, _, per_row = call_edges(methods, inject, regions)
+    stageprof.mark('edges')
+
+    # Measured column count per load site (from the TypeORM measurement), joined on file+line+column.
+    # `sites.py` records the column for exactly this reason: two calls on one line would otherwise
+    # share a key, and the second measurement would overwrite the first.
+    meas = measurements(workdir.load('sites-measured.json'))
+    if not meas:
+        raise SystemExit("sites-measured.json carries no column counts - measure.js produced "
+                         "nothing usable, so every endpoint would report a width of zero")
+
+    graph = CallGraph(local_ok, edges)
+    kinds, maxcol = local_values(local_ok, direct, sites_of, meas)
+    kinds, ok, maxcol = (Summary(graph, kinds, operator.or_), Summary(graph, local_ok, operator.and_),
+                         Summary(graph, maxcol, max))
+    per_item = PerItem(graph, kinds, looped, per_row, sites_of)
+    stageprof.mark('propagation')
+
+    out = [endpoint_row(r, kinds, ok, maxcol, per_item) for r in workdir.load('table.json')]
+    # Does any spec touch this endpoint at all? Strict: the same file names the controller AND
+    # calls the handler. A weak signal and a lower bound - specs that drive a route over HTTP
+    # without naming the handler fall through.
+    # Only a spec that names a controller can count, so the others are never parsed for their
+    # identifiers: every controller class here is a `...Controller`, and a spec without the
+    # word is skipped.
+    anchor = 'Controller' if all('Controller' in r['controller'] for r in out if r['controller']) else ''
+    specs = IdentifierIndex(INDEX, [f for f in INDEX.paths() if f.endswith('.spec.ts') and anchor in INDEX.get(f).raw])
+    for r in out:
+        r['spec'] = bool(specs.naming(r['controller']) & specs.calling(r['handler']))
+    stageprof.mark('endpoints')
+
+    workdir.save('endpoint-eff.json', out)
+    jobs = cron_jobs(graph, kinds, ok, maxcol, per_item, sites_of, meas)
+    workdir.save('cron-jobs.json', jobs)
+    # The graph itself, one record per method: what it calls and the load sites it contains. The
+    # store (`store.py`) answers "which endpoints reach X" from it without rebuilding anything.
+    workdir.save('call-graph.json', [
+        {'cls': cls, 'method': meth, 'complete': local_ok[(cls, meth)],
+         'calls': sorted(map(list, edges.get((cls, meth), ()))),
+         'sites': sorted(map(list, sites_of.get((cls, meth), ()))),
+         'per_item_calls': sorted(map(list, per_row.get((cls, meth), ()))),
+         'per_item_sites': sorted(map(list, looped.get((cls, meth), ())))}
+        for cls, meth in sorted(local_ok)])
+    report(out)
+    report_jobs(jobs)
+
+
+def measurements(measured):
+    """Measured column count per load site, by (file, line, col)."""
+    return {(s['file'], s['line'], s.get('col')): s.get('cols') for s in measured if s.get('cols')}
+
 
 def cat(e):
     if e['path'] in classify.CALLER_SELECT: return 'caller-defined'
@@ -323,23 +460,46 @@ def cat(e):
     if k <= {'proj', 'raw'}: return 'projected'
     return 'unclear'
 
-c = Counter(cat(e) for e in out)
-print(f"endpoints total: {len(out)}")
-for k in ['whole rows', 'no db access', 'projected', 'caller-defined', 'unclear']:
-    if c[k]: print(f"  {k:20s} {c[k]:4d}  ({100*c[k]/len(out):.0f} %)")
-
-over = [e for e in out if cat(e) == 'whole rows']
-mc = sorted((e['maxcol'] for e in over if e['maxcol']), reverse=True)
-print(f"\nwidest query triggered (measured columns), {len(mc)} of {len(over)} measurable:")
-if mc:
-    print(f"  over 1000 columns: {sum(1 for x in mc if x > 1000)}")
-    print(f"  over  500 columns: {sum(1 for x in mc if x > 500)}")
-    print(f"  over  100 columns: {sum(1 for x in mc if x > 100)}")
-    print(f"  median: {mc[len(mc)//2]}")
-    print("\nwidest:")
-    for e in sorted(over, key=lambda x: -x['maxcol'])[:8]:
-        print(f"  {e['maxcol']:5d}  {e['verb']:6s} {e['path']}")
-print("\nprojected:")
-for e in out:
-    if cat(e) in ('projected', 'caller-defined'):
-        print(f"  {cat(e):20s} {e['verb']:6s} {e['path']:34s} {e['kinds']}")
+
+def report(out):
+    c = Counter(cat(e) for e in out)
+    print(f"endpoints total: {len(out)}")
+    for k in ['whole rows', 'no db access', 'projected', 'caller-defined', 'unclear']:
+        if c[k]: print(f"  {k:20s} {c[k]:4d}  ({100*c[k]/len(out):.0f} %)")
+
+    over = [e for e in out if cat(e) == 'whole rows']
+    mc = sorted((e['maxcol'] for e in over if e['maxcol']), reverse=True)
+    print(f"\nwidest query triggered (measured columns), {len(mc)} of {len(over)} measurable:")
+    if mc:
+        print(f"  over 1000 columns: {sum(1 for x in mc if x > 1000)}")
+        print(f"  over  500 columns: {sum(1 for x in mc if x > 500)}")
+        print(f"  over  100 columns: {sum(1 for x in mc if x > 100)}")
+        print(f"  median: {mc[len(mc)//2]}")
+        print("\nwidest:")
+        for e in sorted(over, key=lambda x: -x['maxcol'])[:8]:
+            print(f"  {e['maxcol']:5d}  {e['verb']:6s} {e['path']}")
+    print("\nprojected:")
+    for e in out:
+        if cat(e) in ('projected', 'caller-defined'):
+            print(f"  {cat(e):20s} {e['verb']:6s} {e['path']:34s} {e['kinds']}")
+    n1 = [e for e in out if e['per_item']]
+    print(f"\nquery once per element (N+1): {len(n1)} endpoints")
+    for e in sorted(n1, key=lambda x: (x['path'], x['verb']))[:8]:
+        print(f"  {e['verb']:6s} {e['path']:34s} {e['per_item']}")
+
+
+def report_jobs(jobs):
+    print(f"\ncron jobs: {len(jobs)}, {sum(1 for j in jobs if j['per_item'])} of them querying once per element"
+          + ''.join(f"; {j['job']}: cannot resolve {j['expression']}" for j in jobs if j['cron'] is None))
+    # `both` runs in every process; its figures are per process.
+    for scope in ('worker', 'api', 'both'):
+        of = [j for j in jobs if j['scope'] == scope and j['runs_per_hour'] is not None]
+        print(f"  {scope:6s} {len(of):4d} jobs  {sum(j['runs_per_hour'] for j in of):9.0f} runs/h  "
+              f"{sum(j['queries_per_hour'] for j in of):9.0f} queries/h  {sum(j['cols_per_hour'] for j in of):11.0f} cols/h")
+    print("heaviest, in columns per hour:")
+    for j in sorted((j for j in jobs if j['cols_per_hour']), key=lambda j: -j['cols_per_hour'])[:8]:
+        print(f"  {j['cols_per_hour']:9.0f}  {j['job']} ({j['expression'].split('.')[-1]}, {j['sites']} sites)")
+
+
+if __name__ == '__main__':
+    main()
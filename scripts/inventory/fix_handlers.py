@@ -9,10 +9,11 @@ better result for the `controller` and `file` columns.
 
 Idempotent: derives the handlers fresh from the source and merges them over (path, verb).
 """
-import glob, os, json
+import os
 
-from tsparse import (HTTP, block_and_handler, controller_scopes, full_path, read_text,
-                     rel_path, scope_at)
+import incremental, workdir
+from srcindex import controller_scopes, shared
+from tsparse import full_path, rel_path, scope_at
 
 SP = os.environ.get("INVENTORY_WORK")
 if not SP:
@@ -22,16 +23,19 @@ if not SRC:
     raise SystemExit("API_SRC is not set - run this through scripts/inventory/run.sh")
 
 fresh = {}
-for f in sorted(glob.glob(os.path.join(SRC, '**', '*.controller.ts'), recursive=True)):
-    if '__tests__' in f: continue
-    s = read_text(f)
+INDEX = shared(SRC)
+PLAN = incremental.load_plan()
+for f in INDEX.paths():
+    if not f.endswith('.controller.ts') or '__tests__' in f: continue
+    # Incremental: rows of untouched controllers were corrected in the run they came from.
+    if PLAN and not PLAN.touches(rel_path(SRC, f)): continue
+    e = INDEX.get(f)
     rel = rel_path(SRC, f)
-    scopes = controller_scopes(s)
+    scopes = controller_scopes(e)
     if not scopes: continue
-    for m in HTTP.finditer(s):
-        base, cls = scope_at(scopes, m.start())
-        _, handler = block_and_handler(s, m.end())
-        fresh.setdefault((full_path(base, m.group(2) or ''), m.group(1).upper()), []).append(
+    for pos, verb, path, block, handler in e['routes']:
+        base, cls = scope_at(scopes, pos)
+        fresh.setdefault((full_path(base, path or ''), verb.upper()), []).append(
             (cls, handler, rel))
 
 unresolved = [(k, c, r) for k, v in fresh.items() for c, h, r in v if not h or not c]
@@ -41,10 +45,10 @@ if unresolved:
         print(f"  UNRESOLVED {k[1]:6s} {k[0]:40s} {r}")
     raise SystemExit("the decorator walk lost its place - fix tsparse.py before continuing")
 
-with open(SP + '/table.json') as fh:
-    rows = json.load(fh)
+rows = workdir.load('table.json')
 used, changed = {}, 0
 for r in rows:
+    if PLAN and not PLAN.touches(r['file']): continue
     key = (r['path'], r['verb'])
     cand = fresh.get(key, [])
     n = used.get(key, 0)
@@ -53,5 +57,4 @@ for r in rows:
         if r['handler'] != h: r['handler'] = h; changed += 1
         r['controller'], r['file'] = cls, rel
 print(f"handlers corrected in table.json: {changed}")
-with open(SP + '/table.json', 'w') as fh:
-    json.dump(rows, fh, indent=1)
+workdir.save('table.json', rows)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Incremental runs: rescan only the files that changed since the last cached run.
+
+A full chain rescans all of `src/`, which takes long enough that nobody runs it per pull
+request. Most of its work is per file, though - the load sites of a file, the routes of a
+controller, the methods and injections the call graph is built from - so a run can take the
+previous run's output, drop what came from the changed files and merge in a fresh scan of just
+those. `sites.py`, the `make_table.py` -> `add_version_deprecated.py` chain and `endpoint_eff.py`
+all do that when `INVENTORY_PLAN` names a plan; without one they scan everything, as before.
+
+The previous run is kept under `$INVENTORY_CACHE/last-run/<tree>/`, one slot per source tree.
+Every run saves into it, full or not, so the next incremental run always starts from the last
+one. Two ways to decide what changed:
+
+  --incremental  every file whose content differs from what the last run saw (a hash of each
+                 file is recorded with the run), plus files added and removed since
+  --since <ref>  the files `git diff <ref>` reports, plus untracked ones, on top of the
+                 above: a last run made on another commit than <ref>, or over edits since
+                 reverted, is caught up rather than trusted
+
+    python3 incremental.py plan [--since <ref>]   writes $INVENTORY_WORK/plan.json
+    python3 incremental.py save                   records this run as the last one
+
+A change that reaches beyond its own file falls back to a full scan: `sites.py` resolves a
+site's entity against the set of all entity classes, so when that set changes, every file is
+rescanned.
+"""
+import hashlib, json, os, shutil, subprocess, sys
+
+import source
+import workdir
+from srcindex import cache_dir
+from tsparse import rel_path
+
+# What a run leaves behind that the next incremental run merges into.
+STATE_FILES = ('sites.json', 'entities.json', 'table.json', 'endpoint-eff.json',
+               'endpoint-facts.pickle')
+# Kept with the run for `inventory.py query`, not merged into; a run without them saves none.
+RESULT_FILES = ('inventory.sqlite',)
+
+
+def state_dir(src):
+    """Slot of the last run over the source tree at src."""
+    key = hashlib.sha1(os.path.realpath(src).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir(), 'last-run', key)
+
+
+def manifest(src):
+    """Content hash of every `.ts` file under src, by `src/...` path."""
+    tree = source.provider(src)
+    return {rel_path(src, f): hashlib.sha1(tree.read_text(f).encode('utf-8', 'surrogatepass')).hexdigest()
+            for f in tree.paths()}
+
+
+def git_head(src):
+    r = subprocess.run(['git', '-C', src, 'rev-parse', 'HEAD'], capture_output=True, text=True)
+    return r.stdout.strip() if r.returncode == 0 else None
+
+
+def changed_since(src, ref):
+    """`src/...` paths of the `.ts` files that differ from ref, tracked or not."""
+    def git(*args):
+        r = subprocess.run(['git', '-C', src, *args], capture_output=True, text=True)
+        if r.returncode != 0:
+            raise SystemExit(f"git {' '.join(args)} failed in {src}: "
+                             f"{r.stderr.strip() or 'unknown error'}")
+        return [p for p in r.stdout.split('\n') if p.endswith('.ts')]
+    paths = git('diff', '--name-only', '--relative', ref, '--', '.')
+    paths += git('ls-files', '--others', '--exclude-standard')
+    return {'src/' + p for p in paths}
+
+
+class Plan:
+    """Which files to rescan, and where the previous run's output lies."""
+
+    def __init__(self, prev, changed):
+        self.prev = prev
+        self.changed = set(changed)
+
+    def touches(self, rel):
+        return rel in self.changed
+
+    def previous(self, name):
+        return workdir.read(self.previous_path(name))
+
+    def previous_path(self, name):
+        """Where the previous run left name, in whichever format it was written."""
+        return workdir.locate(self.prev, name) or os.path.join(self.prev, name)
+
+
+def load_plan():
+    """The plan of this run, or None for a full scan."""
+    path = os.environ.get('INVENTORY_PLAN')
+    if not path:
+        return None
+    with open(path) as fh:
+        p = json.load(fh)
+    return Plan(p['prev'], p['changed'])
+
+
+def plan(src, work, since=None):
+    """Write the plan for this run, or nothing if there is no previous run to merge into."""
+    prev = state_dir(src)
+    missing = [n for n in STATE_FILES + ('manifest.json',) if not workdir.locate(prev, n)]
+    if missing:
+        print(f"no previous run cached for {src} - running the full chain")
+        return False
+    with open(os.path.join(prev, 'manifest.json')) as fh:
+        last = json.load(fh)
+    # The diff against the last run's manifest is what makes the merge correct; `git diff`
+    # alone misses whatever changed between the last run and <ref>. The result is saved as the
+    # next baseline, so a file missed here would stay stale in every later run.
+    now, then = manifest(src), last['files']
+    changed = {f for f in now.keys() | then.keys() if now.get(f) != then.get(f)}
+    if since:
+        changed |= changed_since(src, since)
+    with open(os.path.join(work, 'plan.json'), 'w') as fh:
+        json.dump({'prev': prev, 'changed': sorted(changed)}, fh, indent=1)
+    print(f"incremental run: {len(changed)} changed file(s) since the last run")
+    for f in sorted(changed)[:20]:
+        print(f"  {f}")
+    if len(changed) > 20:
+        print(f"  ... and {len(changed) - 20} more")
+    return True
+
+
+def save(src, work):
+    """Record the run in work as the last one over src."""
+    dst = state_dir(src)
+    tmp = dst + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in map(workdir.filename, STATE_FILES):
+        shutil.copyfile(os.path.join(work, name), os.path.join(tmp, name))
+    for name in RESULT_FILES:
+        if os.path.exists(os.path.join(work, name)):
+            shutil.copyfile(os.path.join(work, name), os.path.join(tmp, name))
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as fh:
+        json.dump({'src': os.path.realpath(src), 'head': git_head(src), 'files': manifest(src)}, fh)
+    shutil.rmtree(dst, ignore_errors=True)
+    os.replace(tmp, dst)
+    print(f"saved as the last run for incremental runs: {dst}")
+
+
+if __name__ == '__main__':
+    SP = os.environ.get("INVENTORY_WORK")
+    if not SP:
+        raise SystemExit("INVENTORY_WORK is not set - run this through scripts/inventory/run.sh")
+    SRC = os.environ.get("API_SRC")
+    if not SRC:
+        raise SystemExit("API_SRC is not set - run this through scripts/inventory/run.sh")
+    args = sys.argv[1:]
+    if args[:1] == ['plan'] and len(args) in (1, 3) and (len(args) == 1 or args[1] == '--since'):
+        sys.exit(0 if plan(SRC, SP, args[2] if len(args) == 3 else None) else 3)
+    if args == ['save']:
+        save(SRC, SP)
+        sys.exit(0)
+    raise SystemExit("usage: incremental.py plan [--since <ref>] | save")
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""Which load sites filter on a column no index serves.
+
+The entities declare their indices with `@Index`, the migrations under `migration/` create
+them, and neither says which query an index is for. This step reads per load site the columns
+it filters and sorts on - the `where:` and `order:` of a `find*(...)`, the argument itself for
+`findBy` and its kin, and the `.where/.andWhere/.orWhere/.orderBy/.addOrderBy` calls of a
+query builder - and resolves them to table columns through the entity metadata `measure.js`
+exports with the table widths (`meta-tables.json`). Each column is then judged against the
+indices the migrations leave behind, replayed in order:
+
+  indexed      an index leads with it, or every column in front of it is filtered on too
+  non-leading  it is in a composite index, behind a column the site does not filter on
+  unindexed    no index contains it
+
+A site is judged by the filters on its own table: it is flagged when none of them is indexed.
+One usable index is all Postgres needs to avoid reading the whole table - the other conditions
+are checked against the rows it finds, and listing them would bury the sites that scan. A site
+whose filter is a variable rather than a literal is `unresolved`: it is not guessed at.
+
+The endpoints reaching a flagged site come from the call graph `endpoint_eff.py` wrote. Every
+index that serves no site is listed as well, and so is every index an entity declares that no
+migration creates.
+
+Writes `index-coverage.json`.
+"""
+import glob, os, re
+from collections import Counter, defaultdict
+
+import classify
+from callgraph import CallGraph
+import workdir
+from srcindex import shared
+from tsparse import LITERALS, READ, IntervalIndex, matching, skip_trivia, src_path
+
+SP = os.environ.get("INVENTORY_WORK")
+if not SP:
+    raise SystemExit("INVENTORY_WORK is not set - run this through scripts/inventory/run.sh")
+SRC = os.environ.get("API_SRC")
+if not SRC:
+    raise SystemExit("API_SRC is not set - run this through scripts/inventory/run.sh")
+# The migrations sit next to `src/`, as they do in the repository.
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(SRC)), 'migration')
+
+INDEXED, NON_LEADING, UNINDEXED = 'indexed', 'non-leading', 'unindexed'
+NO_FILTER, UNRESOLVED = 'no filter', 'unresolved'
+FLAGGED = (NON_LEADING, UNINDEXED)
+
+# ---- The indices the migrations leave behind ----
+# Only `up` is replayed: `down` undoes it. The statements are the ones TypeORM generates and
+# the hand-written migrations of this repository use; an index created in a `DO $$` block or
+# through a variable is not seen.
+UP = re.compile(r'\basync\s+up\s*\(')
+DOWN = re.compile(r'\basync\s+down\s*\(')
+QUERY = re.compile(r'\.query\(\s*(?:`((?:[^`\\]|\\.)*)`|\'((?:[^\'\\]|\\.)*)\'|"((?:[^"\\]|\\.)*)")', re.S)
+_NAME = r'(?:"\w+"\.)?"(\w+)"'
+CREATE_INDEX = re.compile(r'CREATE\s+(UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?"(\w+)"\s+'
+                          r'ON\s+(?:ONLY\s+)?' + _NAME + r'\s*(?:USING\s+\w+\s*)?\(([^)]*)\)\s*(WHERE\b)?', re.I)
+DROP_INDEX = re.compile(r'DROP\s+INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+EXISTS\s+)?' + _NAME, re.I)
+CREATE_TABLE = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?' + _NAME, re.I)
+DROP_TABLE = re.compile(r'DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?' + _NAME, re.I)
+ALTER_TABLE = re.compile(r'ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?' + _NAME, re.I)
+CONSTRAINT = re.compile(r'CONSTRAINT\s+"(\w+)"\s+(PRIMARY\s+KEY|UNIQUE)\s*\(([^)]*)\)', re.I)
+DROP_CONSTRAINT = re.compile(r'DROP\s+CONSTRAINT\s+(?:IF\s+EXISTS\s+)?"(\w+)"', re.I)
+RENAME_COLUMN = re.compile(r'RENAME\s+COLUMN\s+"(\w+)"\s+TO\s+"(\w+)"', re.I)
+DROP_COLUMN = re.compile(r'DROP\s+COLUMN\s+(?:IF\s+EXISTS\s+)?"(\w+)"', re.I)
+RENAME_TABLE = re.compile(r'RENAME\s+TO\s+"(\w+)"', re.I)
+
+
+def columns_of(listing):
+    """The columns of an index's column list, `"a", "b" DESC` -> ['a', 'b']. An expression
+    is kept as written: it matches no column, which is what it serves a plain filter as."""
+    return [c.strip().split('"')[1] if c.strip().startswith('"') else c.strip()
+            for c in listing.split(',') if c.strip()]
+
+
+def migrated_indices(directory):
+    """{name: index} of every index the migrations in directory leave in place, replayed in
+    file order. An index is a dict: `name`, `table`, `columns`, `unique`, `partial`."""
+    indices = {}
+
+    def add(name, table, listing, unique, partial=False):
+        indices[name] = {'name': name, 'table': table, 'columns': columns_of(listing),
+                         'unique': unique, 'partial': partial}
+
+    for path in sorted(glob.glob(os.path.join(directory, '*.js'))):
+        with open(path, encoding='utf-8') as fh:
+            text = fh.read()
+        up = UP.search(text)
+        if not up: continue
+        down = DOWN.search(text, up.end())
+        for q in QUERY.finditer(text, up.end(), down.start() if down else len(text)):
+            sql = next(g for g in q.groups() if g is not None)
+            m = CREATE_TABLE.search(sql)
+            if m:
+                for c in CONSTRAINT.finditer(sql, m.end()):
+                    add(c.group(1), m.group(1), c.group(3), True)
+                continue
+            m = CREATE_INDEX.search(sql)
+            if m:
+                add(m.group(2), m.group(3), m.group(4), bool(m.group(1)), bool(m.group(5)))
+                continue
+            m = DROP_INDEX.search(sql)
+            if m:
+                indices.pop(m.group(1), None)
+                continue
+            m = DROP_TABLE.search(sql)
+            if m:
+                indices = {n: ix for n, ix in indices.items() if ix['table'] != m.group(1)}
+                continue
+            m = ALTER_TABLE.search(sql)
+            if not m: continue
+            table, rest = m.group(1), m.end()
+            for c in CONSTRAINT.finditer(sql, rest):
+                add(c.group(1), table, c.group(3), True)
+            for d in DROP_CONSTRAINT.finditer(sql, rest):
+                indices.pop(d.group(1), None)
+            for r in RENAME_COLUMN.finditer(sql, rest):
+                for ix in indices.values():
+                    if ix['table'] == table:
+                        ix['columns'] = [r.group(2) if c == r.group(1) else c for c in ix['columns']]
+            for d in DROP_COLUMN.finditer(sql, rest):
+                # Postgres drops every index on a dropped column with it.
+                indices = {n: ix for n, ix in indices.items()
+                           if ix['table'] != table or d.group(1) not in ix['columns']}
+            r = RENAME_TABLE.search(sql, rest)
+            if r and not RENAME_COLUMN.search(sql, rest):
+                for ix in indices.values():
+                    if ix['table'] == table: ix['table'] = r.group(1)
+    return indices
+
+
+def declared_indices(tables):
+    """{name: index} of what the entity metadata declares, primary keys included. A table
+    exported before the metadata carried its indices still has the `id` every entity here
+    inherits."""
+    indices = {}
+    for table, t in sorted(tables.items()):
+        primary = t.get('primary') or ['id']
+        indices[f'PK {table}'] = {'name': f'PK {table}', 'table': table, 'columns': primary,
+                                  'unique': True, 'partial': False}
+        for ix in t.get('indices', ()):
+            indices[ix['name']] = {'name': ix['name'], 'table': table, 'columns': ix['columns'],
+                                   'unique': ix['unique'], 'partial': ix.get('where') is not None}
+    return indices
+
+
+# ---- What a site filters and sorts on ----
+KEY = re.compile(r'''(?:([A-Za-z_$][\w$]*)|'([^']*)'|"([^"]*)")\s*(:)?''')
+# `findBy(where)` and its kin take the condition itself; the others an options object.
+WHERE_ARGUMENT = re.compile(r'By(?:OrFail)?$')
+FILTER_CALL = re.compile(r'\.(where|andWhere|orWhere|orderBy|addOrderBy)\s*\(')
+JOIN = re.compile(r'\.(?:left|inner)Join(?:AndSelect|AndMapOne|AndMapMany)?\s*\(\s*[\'"](\w+)\.(\w+)[\'"]\s*,'
+                  r'\s*[\'"](\w+)[\'"]')
+ALIAS_PROPERTY = re.compile(r'\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)')
+
+
+def value_end(s, j, close, tokens):
+    """Position of the `,` that ends the value starting at j, or close. Brackets, literals
+    and template interpolations are skipped whole."""
+    while j < close:
+        c = s[j]
+        if c == ',': return j
+        if c in '([{$\'"`/':
+            t = tokens.at(j)
+            if t < len(tokens) and tokens.start[t] == j:
+                if tokens.kind[t] in LITERALS:
+                    j = tokens.end[t]; continue
+                if tokens.kind[t] > 0:
+                    j = matching(s, j, tokens) + 1; continue
+        j += 1
+    return close
+
+
+def entries(s, i, tokens):
+    """(key, position of its value) of every property of the object literal whose `{` is at
+    i. The position is None for a shorthand `{ id }`; a spread is not a property and is left
+    out, and so is anything after a key that cannot be read."""
+    close = min(matching(s, i, tokens), len(s))
+    j = i + 1
+    while True:
+        j = skip_trivia(s, j, tokens)
+        if j >= close: return
+        if s.startswith('...', j):
+            j = value_end(s, j, close, tokens) + 1
+            continue
+        m = KEY.match(s, j, close)
+        if not m or m.end() == j: return
+        key = next(g for g in m.groups()[:3] if g is not None)
+        value = skip_trivia(s, m.end(), tokens) if m.group(4) else None
+        yield key, value
+        j = value_end(s, value if value is not None else m.end(), close, tokens) + 1
+
+
+def arguments(s, paren, tokens):
+    """Start of every argument of the call whose `(` is at paren."""
+    close = min(matching(s, paren, tokens), len(s))
+    j = paren + 1
+    while True:
+        j = skip_trivia(s, j, tokens)
+        if j >= close: return
+        yield j
+        j = value_end(s, j, close, tokens) + 1
+
+
+class Site:
+    """The columns one load site filters (`where`) and sorts (`order`) on, by table."""
+
+    def __init__(self, tables, table):
+        self.tables, self.table = tables, table
+        self.filters = []           # (table, column, role), in source order
+        self.resolved = True
+
+    def column(self, table, prop):
+        """The column of table that prop is stored in; None if it is none of its. Without the
+        property map (metadata exported before it was) TypeORM's default naming holds."""
+        t = self.tables.get(table)
+        if t is None: return None
+        fields = t.get('fields')
+        if fields is None: return prop
+        if prop in fields: return fields[prop]
+        return prop if prop in fields.values() else None
+
+    def relation(self, table, prop):
+        """{'table', 'column'} of the relation prop of table, or None."""
+        return (self.tables.get(table) or {}).get('relations', {}).get(prop)
+
+    def add(self, table, prop, role):
+        col = self.column(table, prop)
+        if col is not None and (table, col, role) not in self.filters:
+            self.filters.append((table, col, role))
+
+    def literal(self, s, i, tokens, table, role):
+        """The conditions of an object literal at i, or of an array of them (alternatives)."""
+        if s.startswith('[', i):
+            for a in arguments(s, i, tokens):
+                self.literal(s, a, tokens, table, role)
+            return
+        if not s.startswith('{', i):
+            self.resolved = False
+            return
+        for key, value in entries(s, i, tokens):
+            rel = self.relation(table, key)
+            if value is not None and s.startswith('{', value):
+                keys = [k for k, _ in entries(s, value, tokens)]
+                if rel and keys and set(keys) <= {'id'}:
+                    # `{ user: { id } }` is the join column on this table, no join at all.
+                    if rel['column']: self.add(table, rel['column'], role)
+                elif rel:
+                    self.literal(s, value, tokens, rel['table'], role)
+                elif self.tables.get(table, {}).get('fields') is None and set(keys) <= {'id'}:
+                    self.add(table, key + 'Id', role)
+                continue
+            if rel and rel['column']:
+                self.add(table, rel['column'], role)
+            else:
+                self.add(table, key, role)
+
+    def find(self, s, paren, call, tokens):
+        """A `find*(...)` call whose `(` is at paren."""
+        args = list(arguments(s, paren, tokens))
+        if 'Cached' in call:
+            args = args[1:]         # the cache key (`CachedRepository`)
+        arg = next((a for a in args if s[a] in '{['), None)
+        if arg is None:
+            # `find()` loads the table; `find(options)` with a variable could filter on anything.
+            self.resolved = not args
+            return
+        if WHERE_ARGUMENT.search(call):
+            self.literal(s, arg, tokens, self.table, 'where')
+            return
+        if not s.startswith('{', arg):
+            self.resolved = False
+            return
+        for key, value in entries(s, arg, tokens):
+            if key in ('where', 'order'):
+                if value is None or s[value] not in '{[':
+                    self.resolved = False
+                else:
+                    self.literal(s, value, tokens, self.table, key)
+
+    def query_builder(self, s, start, end, tokens, method_end):
+        """A `createQueryBuilder(...)` whose `(` ends at end: its chain, and the statements
+        after it that go on building it through the variable it is assigned to."""
+        paren = end - 1
+        close = min(matching(s, paren, tokens), len(s))
+        aliases = [next(g for g in m.groups() if g is not None)
+                   for m in classify.STRING_LITERAL.finditer(s, paren, close)]
+        if not aliases:
+            self.resolved = False
+            return
+        tables = {aliases[-1]: self.table}
+        stop = classify.chain_end(s, end, tokens)
+        spans = [(end, stop)]
+        assigned = classify.ASSIGNED_TO.search(s, max(0, start - 200), start)
+        if assigned:
+            later = re.compile(r'\b' + re.escape(assigned.group(1)) + r'\s*(?=\.)')
+            for m in later.finditer(s, stop, method_end):
+                spans.append((m.end(), classify.chain_end(s, m.end(), tokens)))
+        for lo, hi in spans:
+            for m in JOIN.finditer(s, lo, hi):
+                parent, prop, alias = m.groups()
+                rel = self.relation(tables.get(parent), prop)
+                if rel: tables[alias] = rel['table']
+        for lo, hi in spans:
+            for m in FILTER_CALL.finditer(s, lo, hi):
+                role = 'order' if m.group(1).endswith('rderBy') else 'where'
+                paren = m.end() - 1
+                first = skip_trivia(s, paren + 1, tokens)
+                if role == 'where' and s.startswith('{', first):
+                    self.literal(s, first, tokens, self.table, role)
+                    continue
+                for lit in classify.STRING_LITERAL.finditer(s, paren, min(matching(s, paren, tokens), hi)):
+                    text = next(g for g in lit.groups() if g is not None)
+                    for ref in ALIAS_PROPERTY.finditer(text):
+                        alias, prop = ref.groups()
+                        if alias not in tables: continue
+                        rel = self.relation(tables[alias], prop)
+                        self.add(tables[alias], rel['column'] if rel and rel['column'] else prop, role)
+
+
+def judge(column, filtered, indices):
+    """(status, index) of a column for a site that filters on every column in filtered."""
+    status = UNINDEXED
+    for ix in indices:
+        if column not in ix['columns']: continue
+        k = ix['columns'].index(column)
+        if all(c in filtered for c in ix['columns'][:k]):
+            return INDEXED, ix['name']
+        status = NON_LEADING
+    return status, None
+
+
+def analyse(site, tables, by_table, table_of):
+    """The filters of one measured site and its verdict, as written to the output."""
+    out = {k: site.get(k) for k in ('file', 'line', 'col', 'cls', 'method', 'call', 'entity')}
+    table = table_of.get(site.get('entity'))
+    out['table'] = table
+    if table is None:
+        return {**out, 'filters': [], 'coverage': UNRESOLVED}
+    e, reads_at, bodies = entry(site['file'])
+    s, tokens = e['text'], e['tokens']
+    start = e['lines'][site['line'] - 1] + site['col']
+    read = reads_at.get(start)
+    if read is None:
+        return {**out, 'filters': [], 'coverage': UNRESOLVED}
+    found = Site(tables, table)
+    if site['call'] == 'createQueryBuilder':
+        if classify.WRITE_CHAIN.search(s, read[2], classify.chain_end(s, read[2], tokens)):
+            return None             # an update or delete through a builder reads nothing
+        body = bodies.at(start)
+        found.query_builder(s, start, read[2], tokens, body if body and body > start else len(s))
+    else:
+        found.find(s, read[2] - 1, site['call'], tokens)
+    filters = []
+    for t in dict.fromkeys(t for t, _, _ in found.filters):
+        filtered = {c for t2, c, role in found.filters if t2 == t and role == 'where'}
+        for t2, col, role in found.filters:
+            if t2 != t: continue
+            status, ix = judge(col, filtered, by_table.get(t, ()))
+            filters.append({'table': t, 'column': col, 'role': role, 'status': status, 'index': ix})
+    own = [x['status'] for x in filters if x['table'] == table and x['role'] == 'where']
+    if not found.resolved:
+        coverage = UNRESOLVED
+    elif not own:
+        coverage = NO_FILTER
+    elif INDEXED in own:
+        coverage = INDEXED
+    else:
+        coverage = NON_LEADING if NON_LEADING in own else UNINDEXED
+    return {**out, 'filters': filters, 'coverage': coverage}
+
+
+INDEX = shared(SRC)
+_ENTRIES = {}
+
+
+def entry(rel):
+    """The index entry of file rel, with what `analyse` looks a site up by: its reads by
+    position, and the end of the method body each position lies in."""
+    if rel not in _ENTRIES:
+        e = INDEX.get(src_path(SRC, rel))
+        _ENTRIES[rel] = (e, {ev[0]: ev for ev in e['events'] if ev[1] == READ},
+                         IntervalIndex((ob, close) for _, _, ob, close in e['methods'] if ob >= 0))
+    return _ENTRIES[rel]
+
+
+def main():
+    sites = workdir.load('sites.json')
+    tables = workdir.load('meta-tables.json')
+    endpoints = workdir.load('endpoint-eff.json')
+    graph = workdir.load('call-graph.json')
+
+    declared = declared_indices(tables)
+    migrated = migrated_indices(MIGRATIONS) if os.path.isdir(MIGRATIONS) else {}
+    # The migrations are what the database has. Without them (a tree that keeps none) the
+    # entity declarations are the best there is.
+    indices = migrated or declared
+    by_table = defaultdict(list)
+    for ix in sorted(indices.values(), key=lambda x: (len(x['columns']), x['name'])):
+        by_table[ix['table']].append(ix)
+    table_of = {ent: name for name, t in tables.items() for ent in t['entities']}
+
+    out = [a for a in (analyse(x, tables, by_table, table_of)
+                       for x in sites if x['kind'] in ('find', 'query-builder')) if a is not None]
+
+    # What each index serves: a site filtering or sorting on its table by its leading column.
+    served = Counter()
+    for x in out:
+        cols = {(f['table'], f['column']) for f in x['filters']}
+        for ix in indices.values():
+            if ix['columns'] and (ix['table'], ix['columns'][0]) in cols:
+                served[ix['name']] += 1
+    migrated_shapes = {(ix['table'], tuple(ix['columns'])) for ix in migrated.values()}
+    not_migrated = sorted((ix for ix in declared.values()
+                           if migrated and (ix['table'], tuple(ix['columns'])) not in migrated_shapes),
+                          key=lambda x: (x['table'], x['name']))
+
+    # The endpoints reaching a flagged site, through the closure store.py builds the same way.
+    flagged = {(x['file'], x['line'], x['col']): x for x in out if x['coverage'] in FLAGGED}
+    holding = {(m['cls'], m['method']): [tuple(at) for at in m['sites'] if tuple(at) in flagged] for m in graph}
+    holding = {k: v for k, v in holding.items() if v}
+    cg = CallGraph([(m['cls'], m['method']) for m in graph],
+                   {(m['cls'], m['method']): [tuple(t) for t in m['calls']] for m in graph})
+    reach = []
+    for e in endpoints:
+        key = (e['controller'], e['handler'])
+        if key not in cg.comp: continue
+        hit = sorted({at for m in cg.reachable(key) for at in holding.get(m, ())})
+        if hit:
+            reach.append({'verb': e['verb'], 'path': e['path'], 'version': e.get('version'),
+                          'controller': e['controller'], 'handler': e['handler'],
+                          'coverage': UNINDEXED if any(flagged[at]['coverage'] == UNINDEXED for at in hit)
+                          else NON_LEADING,
+                          'sites': [f"{f}:{line}" for f, line, _ in hit]})
+
+    workdir.save('index-coverage.json', {
+        'source': 'migrations' if migrated else 'entity metadata',
+        'indices': [dict(ix, sites=served[ix['name']]) for ix in
+                    sorted(indices.values(), key=lambda x: (x['table'], x['name']))],
+        'not_migrated': not_migrated,
+        'sites': out,
+        'endpoints': sorted(reach, key=lambda r: (r['path'], r['verb'], r['version'] or '')),
+    })
+    report(out, indices, served, not_migrated, reach, bool(migrated))
+
+
+def report(out, indices, served, not_migrated, reach, migrated):
+    by = Counter(x['coverage'] for x in out)
+    print(f"indices: {len(indices)} from the {'migrations' if migrated else 'entity metadata'}, "
+          f"{sum(1 for n in indices if not served[n])} serving no site"
+          + (f", {len(not_migrated)} declared on an entity but created by no migration" if migrated else ''))
+    print(f"load sites: {len(out)} | " + ', '.join(f"{k} {by[k]}" for k in
+                                                   (INDEXED, NON_LEADING, UNINDEXED, NO_FILTER, UNRESOLVED)))
+    for x in sorted((x for x in out if x['coverage'] in FLAGGED), key=lambda x: (x['file'], x['line']))[:8]:
+        cols = ', '.join(f"{f['column']} ({f['status']})" for f in x['filters']
+                         if f['table'] == x['table'] and f['role'] == 'where')
+        print(f"  {x['coverage']:12s} {x['file']}:{x['line']} {x['table']}: {cols}")
+    print(f"endpoints reaching a site without a usable index: {len(reach)}")
+
+
+if __name__ == '__main__':
+    main()
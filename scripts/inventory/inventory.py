@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+"""The inventory chain in one process, as a graph of steps.
+
+    python3 inventory.py run [--write-docs] [--incremental | --since <ref>] [--jobs N]
+                             [--format json|columnar] [--no-cache] [--profile | --profile-dump]
+    python3 inventory.py watch [--jobs N] [--no-cache] [--poll]
+    python3 inventory.py query <question> [arguments] [--db <inventory.sqlite>]
+    python3 inventory.py eager [--off <Entity.relation> ...] [--work <dir>]
+    python3 inventory.py cron [--role worker|api|all] [--days N] [--start <date>] [--window <minutes>]
+                              [--work <dir>]
+
+`run.sh` used to start the seven steps one after another, each a process of its own that
+imported the shared modules again, globbed `src/` again and parsed the JSON its predecessor
+had just written. Here the Python steps run inside this process: they share one source index,
+and a result one step saves is handed to the next in memory (`workdir.py`) - the files are
+still written, as the record of the run. `measure.js` is the one step that runs as a child
+process, and it starts as soon as `sites.json` exists, alongside the route-table steps rather
+than before them:
+
+    sites ──> measure ───────────────────────────┐
+    make_table ──> fix_handlers ──> add_version ──> endpoint_eff ──> build_docs
+                                                                 ├─> index_coverage
+                                                                 ├─> eager_impact
+                                                                 ├─> cron_load
+                                                                 └─> store
+
+A step's predecessors are the steps that last produced its inputs, so the graph follows from
+what each step reads and writes rather than being spelled out a second time.
+
+Every step's output is cached under a key over everything it depends on: the code of the
+chain, the content of its input files, the source tree (and the incremental plan, if any) for
+the steps that read `src/`, and the compiled `dist/` for the measurement. A rerun restores the
+steps whose key is unchanged and runs only the others - after a change to `build_docs.py`, only
+`build_docs`; over an unchanged tree, nothing. `--no-cache` runs every step.
+
+`watch` runs the chain once and keeps it in memory, re-analysing each file as it is saved and
+printing how the endpoints it reaches changed (`watch.py`).
+
+`store` leaves the run as a SQLite database (`store.py`), kept with the last run, and `query`
+asks it the canned questions - "which endpoints reach `LimitRequest`" - in milliseconds.
+
+`eager` ranks the `eager: true` relations by what they cost the endpoints, and with `--off`
+recomputes every site's width and every endpoint's Max cols as if the named relations were not
+eager (`eager_impact.py`), from the work directory of a run.
+
+`cron` replays the `@DfxCron` schedules of a run minute by minute and prints the minute the most
+jobs fire in, the jobs that always fire together, and the queries and columns per window
+(`cron_load.py`).
+"""
+import argparse, hashlib, json, os, runpy, shutil, subprocess, sys, tempfile, threading, time, traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date
+
+import artifacts
+import incremental
+import pool
+import srcindex
+import stageprof
+import store
+import workdir
+from srcindex import cache_dir
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(HERE))
+STEP_CACHE_VERSION = 1
+# Outputs kept per step. A few, so switching between two branches finds both in the cache.
+STEP_CACHE_KEEP = 4
+
+# The Python steps share this process - its environment, its stdout, the modules they import -
+# so they run one at a time. Only a child process runs next to them.
+_IN_PROCESS = threading.Lock()
+
+
+class Step:
+    """One step of the chain: what it reads and writes, and how to run it.
+
+    `inputs` and `outputs` are file names in the work directory; `reads` names what else the
+    output depends on - 'src' for the source tree, 'dist' for the compiled one, 'migration' for
+    the migrations next to the source tree.
+    """
+
+    def __init__(self, name, run, inputs=(), outputs=(), reads=()):
+        self.name, self.run = name, run
+        self.inputs, self.outputs, self.reads = tuple(inputs), tuple(outputs), tuple(reads)
+        self.after = set()
+
+
+def stage(script, fans_out=False):
+    """A Python step, run in this process.
+
+    A step that fans its files out over a process pool (`pool.py`) runs as a child process
+    instead when `--jobs` asks for workers: the pool is forked, and a fork from this process
+    would copy the locks the other step threads hold.
+    """
+    path = os.path.join(HERE, script)
+    def run():
+        if fans_out and pool.jobs() > 1:
+            return child(script, path)
+        with _IN_PROCESS:
+            stageprof.preload(path)
+            with stageprof.step(os.path.splitext(script)[0]):
+                runpy.run_path(path, run_name='__main__')
+    return run
+
+
+def child(script, path):
+    env = dict(os.environ, INVENTORY_JOBS=str(pool.jobs()), INVENTORY_CACHE=cache_dir())
+    with stageprof.step(os.path.splitext(script)[0], in_process=False), tempfile.TemporaryDirectory() as tmp:
+        record = os.path.join(tmp, 'record.json')
+        with subprocess.Popen(stageprof.child_command(path, record), stdout=subprocess.PIPE, text=True,
+                              env=env) as p:
+            for line in p.stdout:
+                sys.stdout.write(line)
+            _, status, usage = os.wait4(p.pid, 0)
+            p.returncode = os.waitstatus_to_exitcode(status)
+            stageprof.child(usage)
+        stageprof.child_record(record)
+    # What the child wrote replaces any copy of it this process kept.
+    for name in os.listdir(workdir.work()):
+        workdir.forget(name)
+    if p.returncode != 0:
+        raise SystemExit(f"{script} exited with {p.returncode}")
+
+
+def node(script, *args, report=None):
+    """A Node step, run as a child process; args are work-directory file names.
+
+    The script reports progress as lines of JSON with a `step` key; `report` is handed each of
+    them as a dict. Everything it prints is passed through.
+    """
+    def run():
+        env = dict(os.environ, INVENTORY_CACHE=cache_dir())
+        with stageprof.step(os.path.splitext(script)[0], in_process=False), \
+                subprocess.Popen(['node', os.path.join(HERE, script), *map(workdir.path, args)],
+                                 stdout=subprocess.PIPE, text=True, env=env) as p:
+            for line in p.stdout:
+                sys.stdout.write(line)
+                if report and line.startswith('{"step"'):
+                    report(json.loads(line))
+            # Reaped here rather than by `wait()`, for what the child used.
+            _, status, usage = os.wait4(p.pid, 0)
+            p.returncode = os.waitstatus_to_exitcode(status)
+            stageprof.child(usage)
+        if p.returncode != 0:
+            raise SystemExit(f"{script} exited with {p.returncode}")
+    return run
+
+
+def measure_report(event):
+    if event['step'] == 'cache':
+        print(f"[measure] measurement cache: {event['hits']} site(s) reused, {event['misses']} measured")
+    elif event['step'] == 'timing':
+        stageprof.note(measure={k: v for k, v in event.items() if k not in ('step', 'peak_rss_kb')},
+                       peak_rss_kb=event['peak_rss_kb'], peak_rss_scope='step')
+        if stageprof.ACTIVE:
+            print(f"[measure] buildMetadatas() {event['build_metadatas_ms'] / 1000:.1f}s, "
+                  f"{event['queries']} queries built in {event['queries_ms'] / 1000:.1f}s")
+
+
+STEPS = (
+    Step('sites', stage('sites.py', fans_out=True), outputs=('sites.json', 'entities.json'), reads=('src',)),
+    Step('measure', node('measure.js', 'sites.json', 'sites-measured.json', 'meta-tables.json',
+                         report=measure_report),
+         inputs=('sites.json',), outputs=('sites-measured.json', 'meta-tables.json'), reads=('dist',)),
+    Step('make_table', stage('make_table.py'), outputs=('table.json',), reads=('src',)),
+    Step('fix_handlers', stage('fix_handlers.py'), inputs=('table.json',), outputs=('table.json',),
+         reads=('src',)),
+    Step('add_version_deprecated', stage('add_version_deprecated.py'), inputs=('table.json',),
+         outputs=('table.json',), reads=('src',)),
+    Step('endpoint_eff', stage('endpoint_eff.py', fans_out=True), inputs=('table.json', 'sites-measured.json'),
+         outputs=('endpoint-eff.json', 'endpoint-facts.pickle', 'call-graph.json', 'cron-jobs.json'),
+         reads=('src',)),
+    Step('index_coverage', stage('index_coverage.py'),
+         inputs=('sites.json', 'meta-tables.json', 'endpoint-eff.json', 'call-graph.json'),
+         outputs=('index-coverage.json',), reads=('src', 'migration')),
+    Step('eager_impact', stage('eager_impact.py'),
+         inputs=('sites-measured.json', 'meta-tables.json', 'call-graph.json', 'endpoint-eff.json'),
+         outputs=('eager-impact.json',)),
+    Step('cron_load', stage('cron_load.py'), inputs=('cron-jobs.json',), outputs=('cron-load.json',)),
+    Step('store', stage('store.py'),
+         inputs=('sites-measured.json', 'endpoint-eff.json', 'call-graph.json', 'meta-tables.json'),
+         outputs=('inventory.sqlite',)),
+    Step('build_docs', stage('build_docs.py'),
+         inputs=('endpoint-eff.json', 'sites-measured.json', 'cron-jobs.json'),
+         outputs=('endpoints.md', 'load-sites.md'), reads=('src',)),
+)
+
+
+def link(steps):
+    """Set every step's predecessors: for each input, the last earlier step that writes it."""
+    for i, step in enumerate(steps):
+        step.after = set()
+        for name in step.inputs:
+            writers = [s.name for s in steps[:i] if name in s.outputs]
+            if not writers:
+                raise SystemExit(f"step {step.name} reads {name}, which no earlier step writes")
+            step.after.add(writers[-1])
+    return steps
+
+
+def _digest(*parts):
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else str(p).encode('utf-8', 'surrogatepass'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _file_digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Fingerprints:
+    """What the steps depend on besides their input files, each hashed once per run."""
+
+    def __init__(self, src, dist):
+        self.src, self.dist = src, dist
+        self._done = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, what):
+        with self._lock:
+            if what not in self._done:
+                self._done[what] = getattr(self, '_' + what)()
+            return self._done[what]
+
+    def _code(self):
+        return artifacts.code_digest()
+
+    def _src(self):
+        # An incremental run merges into the last saved run, so that run and the plan are
+        # inputs too. Its output matches a full run's, but a stale `--since` plan would not.
+        files = incremental.manifest(self.src)
+        plan = incremental.load_plan()
+        prev = [] if not plan else [
+            (os.path.basename(plan.previous_path(n)), _file_digest(plan.previous_path(n)))
+            for n in incremental.STATE_FILES]
+        return _digest(json.dumps(sorted(files.items())), json.dumps(sorted(plan.changed) if plan else None),
+                       json.dumps(prev))
+
+    def _migration(self):
+        directory = os.path.join(os.path.dirname(os.path.abspath(self.src)), 'migration')
+        if not os.path.isdir(directory):
+            return _digest('none')
+        return _digest(*(f'{n}:{_file_digest(os.path.join(directory, n))}' for n in sorted(os.listdir(directory))
+                         if os.path.isfile(os.path.join(directory, n))))
+
+    def _dist(self):
+        # Size and modification time: hashing every compiled file would cost more than it saves.
+        entries = []
+        for d, _, names in os.walk(self.dist):
+            for n in names:
+                st = os.stat(os.path.join(d, n))
+                entries.append(f'{os.path.relpath(os.path.join(d, n), self.dist)}:{st.st_size}:{st.st_mtime_ns}')
+        return _digest(*sorted(entries))
+
+
+class StepCache:
+    """Outputs of earlier step runs, by key, under `$INVENTORY_CACHE/steps/<step>/<key>/`."""
+
+    def __init__(self, root=None):
+        self.root = os.path.join(root or cache_dir(), 'steps')
+
+    def key(self, step, prints):
+        inputs = [f'{n}:{_file_digest(workdir.path(n))}' for n in step.inputs]
+        # The format is part of the key: the same step writes other files under another one.
+        return _digest(STEP_CACHE_VERSION, step.name, workdir.current_format(), prints['code'],
+                       *(prints[r] for r in step.reads), *inputs)
+
+    def restore(self, step, key):
+        slot = os.path.join(self.root, step.name, key)
+        if not all(os.path.exists(os.path.join(slot, n)) for n in step.outputs):
+            return False
+        for n in step.outputs:
+            shutil.copyfile(os.path.join(slot, n), workdir.path(n))
+            workdir.forget(n)
+        os.utime(slot)
+        return True
+
+    def store(self, step, key):
+        # Copied under a private name and renamed into place: a cache that cannot be written
+        # costs the next run time, never this one its result.
+        slot = os.path.join(self.root, step.name, key)
+        tmp = f'{slot}.{os.getpid()}.tmp'
+        try:
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            for n in step.outputs:
+                shutil.copyfile(workdir.path(n), os.path.join(tmp, n))
+            shutil.rmtree(slot, ignore_errors=True)
+            os.replace(tmp, slot)
+            self._prune(os.path.dirname(slot))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _prune(self, d):
+        slots = sorted((os.path.join(d, n) for n in os.listdir(d) if not n.endswith('.tmp')),
+                       key=os.path.getmtime, reverse=True)
+        for old in slots[STEP_CACHE_KEEP:]:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def execute(steps, src, work, dist=None, cache=None):
+    """Run the steps over src into work, each as soon as its predecessors are done.
+
+    `cache` is a `StepCache`, or None to run every step. Returns {step: 'ran' | 'cached'}.
+    """
+    link(steps)
+    env = {'API_SRC': src, 'INVENTORY_WORK': work, **({'DIST': dist} if dist else {})}
+    saved = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    srcindex.release()
+    prints = Fingerprints(src, dist)
+    outcome, failed = {}, []
+
+    def one(step):
+        key = cache.key(step, prints) if cache else None
+        if key and cache.restore(step, key):
+            print(f"[{step.name}] inputs unchanged - output restored from the step cache")
+            stageprof.cached(step.name)
+            return 'cached'
+        print(f"[{step.name}] running")
+        t0 = time.time()
+        step.run()
+        if key:
+            cache.store(step, key)
+        print(f"[{step.name}] done in {time.time() - t0:.1f}s")
+        return 'ran'
+
+    try:
+        pending, running = list(steps), {}
+        with ThreadPoolExecutor(max_workers=len(steps)) as pool:
+            while pending or running:
+                if not failed:
+                    for step in [s for s in pending if s.after <= outcome.keys()]:
+                        pending.remove(step)
+                        running[pool.submit(one, step)] = step
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    step = running.pop(f)
+                    try:
+                        outcome[step.name] = f.result()
+                    except SystemExit as exc:      # how a stage reports a failure
+                        failed.append(f"{step.name}: {exc}")
+                    except BaseException as exc:
+                        traceback.print_exception(exc)
+                        failed.append(f"{step.name}: {exc!r}")
+    finally:
+        for k, v in saved.items():
+            if v is None: os.environ.pop(k, None)
+            else: os.environ[k] = v
+    if failed:
+        raise SystemExit("the chain stopped - " + '; '.join(failed))
+    return outcome
+
+
+def run(args):
+    dist = os.path.join(ROOT, 'dist')
+    if not os.path.isdir(dist):
+        raise SystemExit("dist/ not found - run `npm run build` first")
+    src = os.path.join(ROOT, 'src')
+    work = tempfile.mkdtemp()
+    print(f"work directory: {work} (kept after the run; remove it when you are done)")
+    if args.jobs:
+        os.environ['INVENTORY_JOBS'] = args.jobs
+    os.environ['INVENTORY_FORMAT'] = args.format
+    os.environ.pop('INVENTORY_PLAN', None)
+    if args.incremental or args.since:
+        if incremental.plan(src, work, args.since):
+            os.environ['INVENTORY_PLAN'] = os.path.join(work, 'plan.json')
+
+    if args.profile or args.profile_dump:
+        stageprof.start(os.path.join(work, 'profile') if args.profile_dump else None)
+    t0 = time.time()
+    try:
+        outcome = execute(list(STEPS), src, work, dist, None if args.no_cache else StepCache())
+    finally:
+        stageprof.stop()
+    ran = [n for n, o in outcome.items() if o == 'ran']
+    print(f"chain done in {time.time() - t0:.1f}s - {len(ran)} of {len(outcome)} steps ran")
+    if args.profile or args.profile_dump:
+        profile(os.path.join(work, 'profile.json'), time.time() - t0, args)
+    os.environ.update(API_SRC=src, INVENTORY_WORK=work)
+    incremental.save(src, work)
+    # Kept by the tree it was made of, where `apply_drift.py` finds it as the current run.
+    tree = artifacts.worktree_tree(src)
+    if tree and artifacts.ArtifactCache().store(tree, work, map(workdir.filename, artifacts.RUN_FILES)):
+        print(f"kept as the run of tree {tree[:12]} in the artifact cache")
+
+    print()
+    if args.write_docs:
+        for name in ('endpoints.md', 'load-sites.md'):
+            shutil.copyfile(os.path.join(work, name), os.path.join(ROOT, 'docs', name))
+            print(f"Overwrote {ROOT}/docs/{name}")
+        print("The hand-adjusted passages of the published documents are gone from these files - check")
+        print("`git diff docs/` before keeping the result.")
+    else:
+        print(f"Generated {work}/endpoints.md")
+        print(f"Generated {work}/load-sites.md")
+        print("docs/ was not touched. These are a data source, not a replacement for the published")
+        print("documents - see scripts/inventory/README.md. Compare with:")
+        print(f"  diff {work}/load-sites.md {ROOT}/docs/load-sites.md")
+
+
+def profile(path, seconds, args):
+    records = stageprof.write(path, wall_s=round(seconds, 3), jobs=os.environ.get('INVENTORY_JOBS') or '1',
+                              format=args.format, incremental=bool(os.environ.get('INVENTORY_PLAN')))
+    print(f"\n{'step':<24} {'wall':>7} {'cpu':>7} {'peak rss':>10} {'files':>6}  busiest pattern")
+    for r in records:
+        if r['status'] == 'cached':
+            print(f"{r['step']:<24} {'cached':>7}")
+            continue
+        busiest = next(iter(r.get('regex_matches') or {}), '')
+        print(f"{r['step']:<24} {r['wall_s']:>6.2f}s {r['cpu_s']:>6.2f}s {r['peak_rss_kb'] / 1024:>7.0f} MB "
+              f"{r.get('files_read', ''):>6}  {busiest}")
+    print(f"profile written to {path}")
+
+
+def query(args):
+    db = args.db or os.path.join(incremental.state_dir(os.path.join(ROOT, 'src')), 'inventory.sqlite')
+    columns, rows, seconds = store.query(db, args.question, args.arguments)
+    widths = [max([len(c), *(len(str(r[i])) for r in rows)]) for i, c in enumerate(columns)]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)).rstrip())
+    for r in rows:
+        print('  '.join(str(v).ljust(w) for v, w in zip(r, widths)).rstrip())
+    print(f"({len(rows)} row{'' if len(rows) == 1 else 's'} in {seconds * 1000:.1f} ms from {db})",
+          file=sys.stderr)
+
+
+def eager(args):
+    work = args.work or os.environ.get('INVENTORY_WORK')
+    if not work:
+        raise SystemExit("name the work directory of a run with --work (`run` prints it)")
+    import eager_impact
+    eager_impact.what_if(work, args.off)
+
+
+def cron(args):
+    work = args.work or os.environ.get('INVENTORY_WORK')
+    if not work:
+        raise SystemExit("name the work directory of a run with --work (`run` prints it)")
+    import cron_load
+    cron_load.replay(work, args.role, args.days, args.start, args.window)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='inventory.py')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('run', help='run the inventory chain and leave both documents in a work directory')
+    p.add_argument('--write-docs', action='store_true',
+                   help='overwrite docs/endpoints.md and docs/load-sites.md with the fresh run, '
+                        'discarding the hand-adjusted passages they carry')
+    p.add_argument('--incremental', action='store_true',
+                   help='rescan only the files whose content changed since the last run, and merge '
+                        'them into its output')
+    p.add_argument('--since', metavar='REF',
+                   help='the same, with the changed files taken from `git diff REF`')
+    p.add_argument('--jobs', metavar='N',
+                   help="scan files over N worker processes ('auto': one per core); the output is "
+                        "identical to a serial run")
+    p.add_argument('--format', choices=workdir.FORMATS, default=os.environ.get('INVENTORY_FORMAT') or 'json',
+                   help='how the tables between the steps are stored: indented JSON, or compressed '
+                        'columns (colstore.py; `colstore.py export` turns one back into JSON)')
+    p.add_argument('--no-cache', action='store_true',
+                   help='run every step, even where the step cache holds its output')
+    p.add_argument('--profile', action='store_true',
+                   help='record time, memory, files read and regex matches per step in profile.json '
+                        '(stageprof.py); slows the run down')
+    p.add_argument('--profile-dump', action='store_true',
+                   help='--profile, and a cProfile dump per step under profile/ in the work directory')
+    w = sub.add_parser('watch', help='keep the inventory in memory and report, on every save under src/, how the '
+                                     "endpoints' Data access and Max cols changed")
+    w.add_argument('--jobs', metavar='N', help='worker processes for the first run, as for `run`')
+    w.add_argument('--no-cache', action='store_true', help='run every step of the first run')
+    w.add_argument('--poll', action='store_true',
+                   help='look for changes once a second instead of through inotify, for a mount that '
+                        'does not pass its events on')
+    questions = '\n'.join(f"  {name} {' '.join(f'<{a}>' for a in params)}: {text}"
+                          for name, (params, text, _) in store.QUERIES.items())
+    q = sub.add_parser('query', help='ask the database of the last run a question',
+                       formatter_class=argparse.RawDescriptionHelpFormatter,
+                       description='questions:\n' + questions +
+                                   '\n  sql <statement> [<parameter> ...]: any read-only statement, see store.py')
+    q.add_argument('question', choices=[*store.QUERIES, 'sql'], metavar='question')
+    q.add_argument('arguments', nargs='*')
+    q.add_argument('--db', help='the database to ask (default: the last run over src/)')
+    e = sub.add_parser('eager', help='rank the eager relations by what they cost, or recompute the widths with '
+                                     'some of them turned off')
+    e.add_argument('--off', action='append', default=[], metavar='ENTITY.RELATION',
+                   help='simulate this relation without `eager: true`; repeat for several')
+    e.add_argument('--work', help='the work directory of the run to use (default: $INVENTORY_WORK)')
+    c = sub.add_parser('cron', help='replay the cron schedules of a run and show when the jobs fire together')
+    c.add_argument('--role', choices=('worker', 'api', 'all'), default='worker',
+                   help='the process whose jobs to replay: worker and api also run the `both` jobs')
+    c.add_argument('--days', type=int, default=7, help='how many days to replay (default: 7)')
+    c.add_argument('--start', type=date.fromisoformat, metavar='YYYY-MM-DD',
+                   help='the first day replayed (default: January 1st, when the monthly and yearly jobs fire too)')
+    c.add_argument('--window', type=int, default=60, metavar='MINUTES',
+                   help='the windows the work is summed over (default: 60)')
+    c.add_argument('--work', help='the work directory of the run to use (default: $INVENTORY_WORK)')
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'watch':
+        import watch
+        watch.main(args)
+    elif args.command == 'query':
+        query(args)
+    elif args.command == 'eager':
+        eager(args)
+    elif args.command == 'cron':
+        cron(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
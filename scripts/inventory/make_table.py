@@ -5,10 +5,11 @@ Decorators between the route decorator and the method are skipped by counting br
 and comments respected), otherwise a multi-line `@UseGuards(` has its guard read as the handler.
 The parsing itself lives in tsparse.py and is shared with the other controller readers.
 """
-import glob, os, json
+import os
 
-from tsparse import (HTTP, block_and_handler, controller_scopes, full_path, read_text,
-                     rel_path, scope_at)
+import incremental, workdir
+from srcindex import controller_scopes, shared
+from tsparse import full_path, rel_path, scope_at
 
 SP = os.environ.get("INVENTORY_WORK")
 if not SP:
@@ -18,19 +19,27 @@ if not SRC:
     raise SystemExit("API_SRC is not set - run this through scripts/inventory/run.sh")
 
 rows = []
-for f in sorted(glob.glob(os.path.join(SRC, '**', '*.controller.ts'), recursive=True)):
-    if '__tests__' in f: continue
-    s = read_text(f)
+INDEX = shared(SRC)
+PLAN = incremental.load_plan()
+for f in INDEX.paths():
+    if not f.endswith('.controller.ts') or '__tests__' in f: continue
+    # Incremental: only the changed controllers are read; the rest come from the last run below.
+    if PLAN and not PLAN.touches(rel_path(SRC, f)): continue
+    e = INDEX.get(f)
     rel = rel_path(SRC, f)
-    scopes = controller_scopes(s)
+    scopes = controller_scopes(e)
     if not scopes: continue
-    for m in HTTP.finditer(s):
-        base, cls = scope_at(scopes, m.start())
-        block, handler = block_and_handler(s, m.end())
-        rows.append({'verb': m.group(1).upper(), 'path': full_path(base, m.group(2) or ''),
+    for pos, verb, path, block, handler in e['routes']:
+        base, cls = scope_at(scopes, pos)
+        rows.append({'verb': verb.upper(), 'path': full_path(base, path or ''),
                      'controller': cls, 'handler': handler, 'file': rel,
                      'internal': '@ApiExcludeEndpoint' in block})
 
+if PLAN:
+    # Rows of untouched controllers already went through the later steps last time, and carry
+    # their corrected handler, version and deprecation with them.
+    rows += [r for r in PLAN.previous('table.json') if not PLAN.touches(r['file'])]
+
 if not rows:
     raise SystemExit(f"no routes found under {SRC} - is API_SRC pointing at the source tree?")
 
@@ -45,6 +54,5 @@ if broken:
                      "controller - fix the decorator parsing in tsparse.py before continuing")
 
 rows.sort(key=lambda r: (r['path'], r['verb']))
-with open(SP + '/table.json', 'w') as fh:
-    json.dump(rows, fh, indent=1)
+workdir.save('table.json', rows)
 print('routes:', len(rows), '| internal:', sum(1 for r in rows if r['internal']))
@@ -1,9 +1,12 @@
 /**
  * Measures the real SELECT column count per load site from the TypeORM metadata.
  *
- * Changed against the earlier version outside this repository in exactly two points:
+ * Changed against the earlier version outside this repository in these points:
  *   - parameterised (DIST, INPUT, OUT_MEASURED, OUT_TABLES via environment/argv) instead of hard-wired,
- *   - `buildMetadatas()` instead of `initialize()`, so WITHOUT a database.
+ *   - `buildMetadatas()` instead of `initialize()`, so WITHOUT a database,
+ *   - the sites may come and go in the columnar layout of colstore.py,
+ *   - a measurement is cached under the metadata of everything its query joins (INVENTORY_CACHE),
+ *   - it reports the time spent in `buildMetadatas()` and in building the per-site queries.
  * The output format is unchanged, so build_docs.py reads it as is.
  *
  * The stub bootstrap is needed because three things get in the way of merely loading the entity
@@ -40,15 +43,206 @@ Module._load = function (request) {
 };
 
 require('reflect-metadata');
+const crypto = require('crypto');
 const fs = require('fs');
+const path = require('path');
+const zlib = require('zlib');
 const { DataSource } = require('typeorm');
+const TYPEORM_VERSION = require('typeorm/package.json').version;
+
+// The sites come in, and go out measured, as indented JSON - or, for a `.col` path, in the
+// columnar layout of colstore.py (`inventory.py run --format columnar`). Same layout on both
+// sides: a magic line, a one-line JSON header, then zlib-compressed JSON arrays.
+const COL_MAGIC = 'DFXCOL 1\n';
+
+function readTable(file) {
+  const buf = fs.readFileSync(file);
+  if (!file.endsWith('.col')) return JSON.parse(buf.toString('utf8'));
+  if (buf.toString('latin1', 0, COL_MAGIC.length) !== COL_MAGIC) {
+    throw new Error(`${file} is not a columnar inventory file`);
+  }
+  const nl = buf.indexOf(10, COL_MAGIC.length);
+  const header = JSON.parse(buf.toString('utf8', COL_MAGIC.length, nl));
+  const data = buf.subarray(nl + 1);
+  const blob = (name) => {
+    const [at, length] = header.blobs[name];
+    return JSON.parse(zlib.inflateSync(data.subarray(at, at + length)).toString('utf8'));
+  };
+  const strings = blob('strings');
+  const cols = {};
+  for (const [name, kind] of Object.entries(header.columns)) {
+    const values = blob('col:' + name);
+    cols[name] = kind === 'ref' ? values.map((v) => (v === null ? null : strings[v])) : values;
+  }
+  return blob('shape').map((s, i) => Object.fromEntries(header.shapes[s].map((k) => [k, cols[k][i]])));
+}
+
+function writeTable(file, rows) {
+  if (!file.endsWith('.col')) {
+    fs.writeFileSync(file, JSON.stringify(rows, null, 1));
+    return;
+  }
+  const pack = (values) => zlib.deflateSync(Buffer.from(JSON.stringify(values)), { level: 6 });
+  // A key whose value is undefined is absent, as JSON.stringify would have it.
+  const shapes = [];
+  const shapeIds = new Map();
+  const rowShapes = rows.map((r) => {
+    const keys = Object.keys(r).filter((k) => r[k] !== undefined);
+    const id = JSON.stringify(keys);
+    if (!shapeIds.has(id)) {
+      shapeIds.set(id, shapes.length);
+      shapes.push(keys);
+    }
+    return shapeIds.get(id);
+  });
+  const names = [...new Set(shapes.flat())];
+  const strings = [];
+  const stringIds = new Map();
+  const columns = {};
+  const blobs = [['shape', pack(rowShapes)]];
+  for (const name of names) {
+    let values = rows.map((r) => (r[name] === undefined ? null : r[name]));
+    if (values.every((v) => v === null || typeof v === 'string')) {
+      values = values.map((v) => {
+        if (v === null) return null;
+        if (!stringIds.has(v)) {
+          stringIds.set(v, strings.length);
+          strings.push(v);
+        }
+        return stringIds.get(v);
+      });
+      columns[name] = 'ref';
+    } else {
+      columns[name] = 'json';
+    }
+    blobs.push(['col:' + name, pack(values)]);
+  }
+  blobs.push(['strings', pack(strings)]);
+  const index = {};
+  let at = 0;
+  for (const [name, blob] of blobs) {
+    index[name] = [at, blob.length];
+    at += blob.length;
+  }
+  const header = { rows: rows.length, shapes, columns, blobs: index };
+  fs.writeFileSync(
+    file,
+    Buffer.concat([Buffer.from(COL_MAGIC + JSON.stringify(header) + '\n'), ...blobs.map((b) => b[1])]),
+  );
+}
+
+// Measurements of earlier runs, under `$INVENTORY_CACHE/measure/` (the Python side passes the
+// directory; run by hand without it, nothing is cached). A default-query measurement depends on
+// the entity, the relations the site asks for, and the metadata of every entity the query
+// joins - the ones named in `relations` and every `eager: true` relation reached from any of
+// them. The key hashes exactly that tree, each visited entity with its columns - and whether
+// each one is selected at all (`select: false`, a virtual column) - and with every one of its
+// relations, their eager flags and how they join, so a column added to a joined entity or
+// hidden from the SELECT, or a relation turned eager anywhere in the expansion, re-measures the
+// sites it reaches and no other. Projections and counted selects are measured without a query and are not cached.
+// Bump when what a measurement records changes.
+const MEASURE_CACHE_VERSION = 2;
+// Entries kept, as a multiple of the sites this run measured - enough for a second branch.
+const MEASURE_CACHE_KEEP = 4;
+
+function sha1(...parts) {
+  const h = crypto.createHash('sha1');
+  for (const p of parts) h.update(String(p)).update('\0');
+  return h.digest('hex');
+}
+
+// (entity metadata, relations of a site) -> fingerprint of everything the query would join.
+function fingerprinter() {
+  const own = new Map();
+  const ownPrint = (m) => {
+    if (!own.has(m)) {
+      own.set(
+        m,
+        sha1(
+          m.name,
+          m.tableName,
+          m.discriminatorValue,
+          ...m.columns.map(
+            (c) =>
+              `${c.propertyPath}:${c.databaseName}${c.isSelect ? '' : ' unselected'}` +
+              `${c.isVirtual ? ' virtual' : ''}${c.isVirtualProperty ? ' virtual-property' : ''}`,
+          ),
+          ...m.relations.map(
+            (r) =>
+              `${r.propertyPath}${r.isEager ? ' eager' : ''} ${r.relationType} -> ${r.inverseEntityMetadata.name}` +
+              ` on ${r.joinColumns.map((c) => c.databaseName).join(',')}` +
+              (r.junctionEntityMetadata ? ` via ${r.junctionEntityMetadata.tableName}` : ''),
+          ),
+        ),
+      );
+    }
+    return own.get(m);
+  };
+  const tree = (m, relations, stack) => {
+    const parts = [ownPrint(m)];
+    for (const r of m.relations) {
+      const sub = relations && relations[r.propertyName];
+      if (!sub && !r.isEager) continue;
+      const target = r.inverseEntityMetadata;
+      // An eager relation back into the expansion is a cycle TypeORM does not follow either.
+      if (!sub && stack.includes(target)) continue;
+      parts.push(r.propertyPath, tree(target, typeof sub === 'object' ? sub : null, [...stack, target]));
+    }
+    return sha1(...parts);
+  };
+  return (meta, relations) => tree(meta, relations, [meta]);
+}
+
+function openCache(dir) {
+  if (!dir) return null;
+  const file = path.join(dir, 'measure', `v${MEASURE_CACHE_VERSION}.json`);
+  let entries = {};
+  try {
+    entries = JSON.parse(fs.readFileSync(file, 'utf8'));
+  } catch (e) {
+    // No cache yet, or an unreadable one: every site is measured.
+  }
+  const used = {};
+  let hits = 0;
+  let misses = 0;
+  return {
+    get(key) {
+      const e = entries[key];
+      if (e) {
+        hits++;
+        used[key] = { at: Date.now(), result: e.result };
+      }
+      return e && e.result;
+    },
+    put(key, result) {
+      misses++;
+      used[key] = { at: Date.now(), result };
+    },
+    stats: () => ({ hits, misses }),
+    // Written under a private name and renamed into place; a cache that cannot be written costs
+    // the next run time, never this one its result.
+    save() {
+      const keep = Object.entries({ ...entries, ...used })
+        .sort((a, b) => b[1].at - a[1].at)
+        .slice(0, MEASURE_CACHE_KEEP * Math.max(1, Object.keys(used).length));
+      try {
+        fs.mkdirSync(path.dirname(file), { recursive: true });
+        const tmp = `${file}.${process.pid}.tmp`;
+        fs.writeFileSync(tmp, JSON.stringify(Object.fromEntries(keep)));
+        fs.renameSync(tmp, file);
+      } catch (e) {
+        console.error(`[inventory] cannot write the measurement cache ${file}: ${e.message}`);
+      }
+    },
+  };
+}
 
 const DIST = process.env.DIST;
 const INPUT = process.argv[2];
 const OUT_MEASURED = process.argv[3];
 const OUT_TABLES = process.argv[4];
 if (!DIST || !INPUT || !OUT_MEASURED || !OUT_TABLES) {
-  console.error('usage: DIST=<dist> node measure.js <sites.json> <measured.json> <meta-tables.json>');
+  console.error('usage: DIST=<dist> node measure.js <sites.json|.col> <measured.json|.col> <meta-tables.json>');
   process.exit(2);
 }
 
@@ -63,7 +257,9 @@ async function main() {
 
   // No initialize(): the metadata is enough, and a connection would only add a failure mode
   // that has nothing to do with the measurement.
+  let t0 = performance.now();
   await ds.buildMetadatas();
+  const buildMs = performance.now() - t0;
   console.log(JSON.stringify({ step: 'init', entities: ds.entityMetadatas.length }));
   // Without entities every site below reports "entity not found" and the run still ends with
   // exit 0 - the whole chain then completes and publishes a document whose every column count
@@ -74,15 +270,56 @@ async function main() {
     process.exit(1);
   }
 
+  // Per table, beside its width: the column each property is stored in, where each relation
+  // leads and by which join column, and the indices the entities declare - what
+  // index_coverage.py resolves a `where` against. Entities sharing a table (single-table
+  // inheritance) contribute to one entry; an index they share is listed once.
+  // `models` keeps each entity apart: its own width, and per relation the entity it leads to,
+  // whether it is eager and the JOINs it costs (two for a many-to-many, through the junction
+  // table) - what eager_impact.py rebuilds a default query from, eager flags turned off or not.
   const perTable = {};
   for (const m of ds.entityMetadatas) {
-    perTable[m.tableName] = perTable[m.tableName] || { cols: m.columns.length, entities: [] };
-    perTable[m.tableName].entities.push(m.name);
-    perTable[m.tableName].cols = Math.max(perTable[m.tableName].cols, m.columns.length);
+    const t = (perTable[m.tableName] = perTable[m.tableName] || {
+      cols: m.columns.length,
+      entities: [],
+      fields: {},
+      relations: {},
+      primary: m.primaryColumns.map((c) => c.databaseName),
+      indices: [],
+      models: {},
+    });
+    t.entities.push(m.name);
+    t.models[m.name] = {
+      cols: m.columns.length,
+      relations: Object.fromEntries(
+        m.relations.map((r) => [
+          r.propertyName,
+          { entity: r.inverseEntityMetadata.name, eager: r.isEager, joins: r.isManyToMany ? 2 : 1 },
+        ]),
+      ),
+    };
+    t.cols = Math.max(t.cols, m.columns.length);
+    for (const c of m.columns) t.fields[c.propertyPath] = c.databaseName;
+    for (const r of m.relations) {
+      t.relations[r.propertyPath] = {
+        table: r.inverseEntityMetadata.tableName,
+        column: r.joinColumns.length === 1 ? r.joinColumns[0].databaseName : null,
+      };
+    }
+    const declared = [
+      ...m.indices.map((i) => ({ name: i.name, columns: i.columns, unique: i.isUnique, where: i.where || null })),
+      ...m.uniques.map((u) => ({ name: u.name, columns: u.columns, unique: true, where: null })),
+    ];
+    for (const i of declared) {
+      if (t.indices.some((x) => x.name === i.name)) continue;
+      t.indices.push({ ...i, columns: i.columns.map((c) => c.databaseName) });
+    }
   }
   fs.writeFileSync(OUT_TABLES, JSON.stringify(perTable, null, 1));
 
-  const sites = JSON.parse(fs.readFileSync(INPUT, 'utf8'));
+  const sites = readTable(INPUT);
+  const cache = openCache(process.env.INVENTORY_CACHE);
+  const fingerprint = fingerprinter();
 
   // A site that narrows its columns must be measured at what it selects, not at the default
   // query. Building the query without the projection reports the width the read path was
@@ -107,6 +344,9 @@ async function main() {
   }
 
   const out = [];
+  let queries = 0,
+    queriesMs = 0;
+  const sitesStart = performance.now();
   for (const s of sites) {
     // getCount()/getExists() discard the select list - no row is materialised, so a column
     // count would be a number about a query that never returns one.
@@ -139,6 +379,22 @@ async function main() {
       out.push({ ...s, error: 'entity not found' });
       continue;
     }
+    const key =
+      cache &&
+      sha1(
+        MEASURE_CACHE_VERSION,
+        TYPEORM_VERSION,
+        s.entity,
+        JSON.stringify(s.relations ?? null),
+        fingerprint(meta, s.relations),
+      );
+    const known = cache && cache.get(key);
+    if (known) {
+      out.push({ ...s, ...known });
+      continue;
+    }
+    let result;
+    t0 = performance.now();
     try {
       const qb = ds.createQueryBuilder(meta.target, 'root');
       qb.setFindOptions({ relations: s.relations });
@@ -149,12 +405,42 @@ async function main() {
       // Key is `cols`, not `columns`: endpoint_eff.py and build_docs.py both read `cols`, and an
       // earlier variant of this script emitted the wider name - which left every measurement
       // silently unmatched and every column count at zero.
-      out.push({ ...s, cols, joins, over: cols > 1664 });
+      result = { cols, joins, over: cols > 1664 };
     } catch (e) {
-      out.push({ ...s, error: String(e.message).slice(0, 120) });
+      result = { error: String(e.message).slice(0, 120) };
     }
+    queries++;
+    queriesMs += performance.now() - t0;
+    if (cache) cache.put(key, result);
+    out.push({ ...s, ...result });
+  }
+  const sitesMs = performance.now() - sitesStart;
+  writeTable(OUT_MEASURED, out);
+  if (cache) {
+    cache.save();
+    console.log(JSON.stringify({ step: 'cache', ...cache.stats() }));
+  }
+  // Where the time goes: loading the entity modules and building their metadata, against
+  // building a query per site - the part the measurement cache saves.
+  const ms = (x) => Math.round(x * 10) / 10;
+  // VmHWM, not resourceUsage().maxRSS: the latter starts from the size of the forking parent.
+  let peak = process.resourceUsage().maxRSS;
+  try {
+    peak = Number(/VmHWM:\s*(\d+)/.exec(fs.readFileSync('/proc/self/status', 'utf8'))[1]);
+  } catch (e) {
+    // not Linux
   }
-  fs.writeFileSync(OUT_MEASURED, JSON.stringify(out, null, 1));
+  console.log(
+    JSON.stringify({
+      step: 'timing',
+      build_metadatas_ms: ms(buildMs),
+      sites: sites.length,
+      sites_ms: ms(sitesMs),
+      queries,
+      queries_ms: ms(queriesMs),
+      peak_rss_kb: peak,
+    }),
+  );
   const ok = out.filter((o) => o.cols !== undefined);
   const tables = Object.keys(perTable).length;
   const columns = Object.values(perTable).reduce((a, t) => a + t.cols, 0);
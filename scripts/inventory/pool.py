@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Per-file work fanned out over a process pool, merged back in input order.
+
+The site scan and the call-graph facts are computed file by file, with nothing shared between
+files, so they spread over as many cores as there are. The merge is what has to stay exact:
+results come back in the order the files went in, so the output is byte-identical to a serial
+run - same sort order, same `(file, line, col)` keys - and nothing downstream can tell.
+
+The number of workers comes from `--jobs N` on the command line or `INVENTORY_JOBS` in the
+environment (`run.sh --jobs N` sets it), and defaults to 1: serial, in-process, as before.
+Workers are forked, so they inherit the stage's module state without importing the stage
+again. A fork copies only the thread that calls it, and with it every lock another thread
+happened to hold, which the child then never sees released. So the pool is forked only from a
+process running a single thread: `inventory.py run` starts a step that fans out as a process of
+its own when `--jobs` asks for workers, rather than from one of its step threads. Where fork is
+not available, or other threads are running, the work runs serially.
+"""
+import multiprocessing, os, sys, threading
+
+import stageprof
+
+_FN = None
+_INDEX = None
+
+
+def jobs():
+    """Worker count requested for this stage."""
+    args = sys.argv[1:]
+    for i, a in enumerate(args):
+        if a == '--jobs' and i + 1 < len(args):
+            return _count(args[i + 1])
+        if a.startswith('--jobs='):
+            return _count(a.split('=', 1)[1])
+    return _count(os.environ.get('INVENTORY_JOBS') or '1')
+
+
+def _count(v):
+    if v == 'auto':
+        return os.cpu_count() or 1
+    if not v.isdigit() or int(v) < 1:
+        raise SystemExit(f"--jobs needs a positive number or 'auto', not {v!r}")
+    return int(v)
+
+
+def _run(path):
+    parsed, reused = _INDEX.parsed, _INDEX.reused
+    snap = stageprof.snapshot() if stageprof.ACTIVE else None
+    out = _FN(path)
+    return out, _INDEX.parsed - parsed, _INDEX.reused - reused, snap and stageprof.since(snap)
+
+
+def map_files(fn, paths, index, n=None):
+    """[fn(p) for p in paths], over n workers. The index's counters - and, when profiling, the
+    counts of `stageprof.py` - include the workers' work."""
+    global _FN, _INDEX
+    n = jobs() if n is None else n
+    paths = list(paths)
+    if stageprof.ACTIVE:
+        fn = stageprof.timed(fn)
+    if (n <= 1 or len(paths) < 2 or 'fork' not in multiprocessing.get_all_start_methods()
+            or threading.active_count() > 1):
+        return [fn(p) for p in paths]
+    _FN, _INDEX = fn, index
+    try:
+        with multiprocessing.get_context('fork').Pool(n) as workers:
+            out = workers.map(_run, paths, chunksize=max(1, len(paths) // (n * 8)))
+    finally:
+        _FN = _INDEX = None
+    index.parsed += sum(p for _, p, _, _ in out)
+    index.reused += sum(r for _, _, r, _ in out)
+    for _, _, _, counted in out:
+        if counted:
+            stageprof.merge(counted)
+    return [o for o, _, _, _ in out]
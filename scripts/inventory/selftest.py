@@ -13,13 +13,14 @@ appeared write site does not reach the published document.
 
 Needs no `dist/` and no database. Run it directly: `python3 scripts/inventory/selftest.py`.
 """
-import json, os, shutil, subprocess, sys, tempfile
+import json, os, re, shutil, subprocess, sys, tempfile, time
+from datetime import date
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, HERE)
 
 import classify
-from tsparse import read_text
+from tsparse import line_col, line_starts, read_text
 
 FAILURES = []
 
@@ -98,6 +99,26 @@ export class WidgetController {
     return this.service.twoBuildersOnOneLine();
   }
 
+  @Get('perRow')
+  async perRowWidgets(): Promise<Widget[]> {
+    return this.service.onePerRow([1, 2]);
+  }
+
+  @Get('mapped')
+  async mappedWidgets(): Promise<Widget[]> {
+    return this.service.onePerRowMapped([1, 2]);
+  }
+
+  @Get('beforeLoop')
+  async beforeLoopWidgets(): Promise<number> {
+    return this.service.loadsOnceBeforeTheLoop();
+  }
+
+  @Get('byColour')
+  async colouredWidgets(): Promise<Widget[]> {
+    return this.service.byColour('red');
+  }
+
   @Post('sync')
   @ApiExcludeEndpoint()
   @ApiOperation({ description: 'takes a (parenthesised) note', deprecated: true })
@@ -279,6 +300,50 @@ export class WidgetService {
     return this.widgetRepo.query('SELECT name FROM widget WHERE id = $1', [1]);
   }
 
+  async onePerRow(ids: number[]): Promise<Widget[]> {
+    const out = [];
+    for (const id of ids) {
+      out.push(await this.widgetRepo.findOneBy({ id }));
+    }
+    return out;
+  }
+
+  async onePerRowMapped(ids: number[]): Promise<Widget[]> {
+    return Promise.all(ids.map((id) => this.byId(id)));
+  }
+
+  async byId(id: number): Promise<Widget> {
+    return this.widgetRepo.findOneBy({ id });
+  }
+
+  async loadsOnceBeforeTheLoop(): Promise<number> {
+    let n = 0;
+    for (const w of await this.widgetRepo.find()) n += w.name.length;
+    return n;
+  }
+
+  async byAmount(): Promise<Widget[]> {
+    return this.widgetRepo.findBy({ amount: MoreThan(5) });
+  }
+
+  async byColour(colour: string): Promise<Widget[]> {
+    return this.widgetRepo.find({ where: { colour }, order: { name: 'ASC' } });
+  }
+
+  async byNameAndAmount(name: string): Promise<Widget[]> {
+    const qb = this.widgetRepo.createQueryBuilder('w').where('w.name = :name', { name });
+    qb.andWhere('w.amount > 5');
+    return qb.getMany();
+  }
+
+  async byOwner(ownerId: number): Promise<Widget[]> {
+    return this.widgetRepo.find({ where: [{ owner: { id: ownerId } }, { owner: { mail: 'x' } }] });
+  }
+
+  async byCondition(where: object): Promise<Widget[]> {
+    return this.widgetRepo.find({ where });
+  }
+
   async twoQueriesOnOneLine(): Promise<unknown> {
     await this.widgetRepo.query('DELETE FROM widget WHERE id = 0'); return this.widgetRepo.query('SELECT name FROM widget');
   }
@@ -286,18 +351,79 @@ export class WidgetService {
 """
 
 
+# Three schedules: a `CronExpression`, a member of the enum below, and a constant no table
+# resolves. The decorator commented out is not a job.
+JOBS = """\
+import { CronExpression } from '@nestjs/schedule';
+import { CronScope, DfxCron } from 'src/shared/utils/cron';
+import { CustomCronExpression } from './custom-cron-expression';
+
+@Injectable()
+export class WidgetJobService {
+  constructor(private readonly widgetService: WidgetService) {}
+
+  @DfxCron(CronExpression.EVERY_MINUTE, { scope: CronScope.WORKER, process: Process.WIDGET_SYNC, timeout: 1800 })
+  async syncWidgets(): Promise<void> {
+    await this.widgetService.onePerRow([1, 2]);
+  }
+
+  // @DfxCron(CronExpression.EVERY_SECOND, { scope: CronScope.WORKER })
+  @DfxCron(CustomCronExpression.EVERY_15_MINUTES, {
+    scope: CronScope.BOTH,
+    useDelay: false,
+  })
+  @Lock(900)
+  async refreshWidgets(): Promise<void> {
+    await this.widgetService.byId(1);
+  }
+
+  @DfxCron(WIDGET_SCHEDULE, { scope: CronScope.API })
+  async idle(): Promise<void> {
+    return;
+  }
+
+  @DfxCron(CustomCronExpression.LAST_DAY_OF_MONTH, { scope: CronScope.API })
+  async closeMonth(): Promise<void> {
+    return;
+  }
+}
+"""
+
+CUSTOM_CRON = """\
+export enum CustomCronExpression {
+  EVERY_15_SECONDS = '*/15 * * * * *',
+  EVERY_15_MINUTES = '0 */15 * * * *',
+  LAST_DAY_OF_MONTH = '0 0 L * *',
+}
+"""
+
+
+# Names the controller and calls one handler; the other is only mentioned, never called.
+SPEC = """\
+describe('WidgetController', () => {
+  it('lists', async () => {
+    await controller.listWidgets();
+  });
+  it('does not call namedWidgets', () => undefined);
+});
+"""
+
+
 def build_fixture(root):
     src = os.path.join(root, 'src')
     os.makedirs(src)
     write_text(os.path.join(src, 'widget.controller.ts'), CONTROLLER)
     write_text(os.path.join(src, 'widget.entity.ts'), ENTITY)
     write_text(os.path.join(src, 'widget.service.ts'), SERVICE)
+    write_text(os.path.join(src, 'widget-job.service.ts'), JOBS)
+    write_text(os.path.join(src, 'custom-cron-expression.ts'), CUSTOM_CRON)
+    write_text(os.path.join(src, 'widget.controller.spec.ts'), SPEC)
     return src
 
 
-def run_step(script, src, work):
-    env = dict(os.environ, API_SRC=src, INVENTORY_WORK=work, PYTHONPATH=HERE)
-    r = subprocess.run([sys.executable, os.path.join(HERE, script)],
+def run_step(script, src, work, *args, **env_extra):
+    env = dict(os.environ, API_SRC=src, INVENTORY_WORK=work, PYTHONPATH=HERE, **env_extra)
+    r = subprocess.run([sys.executable, os.path.join(HERE, script), *args],
                        capture_output=True, text=True, env=env)
     if r.returncode != 0:
         print(f"  FAIL {script} exited {r.returncode}: {r.stderr.strip()[:400]}")
@@ -347,9 +473,141 @@ def test_select_categories(src, work):
     # only would read as "zero sites of this kind" instead of failing.
     emitted = {s['select'] for s in sites if s['select']}
     check('no category outside the shared list', emitted - set(classify.SELECT_KINDS), set())
+    # Every stage keys a site on the line table; it has to agree with counting newlines.
+    text = read_text(os.path.join(src, 'widget.service.ts'))
+    starts = line_starts(text)
+    check('line table agrees with counting newlines',
+          all(line_col(starts, p) == (text[:p].count('\n') + 1, p - (text.rfind('\n', 0, p) + 1))
+              for p in range(0, len(text), 7)), True)
     return sites
 
 
+def test_source_index_is_reused(src, work):
+    """A second stage over an unchanged tree must not parse anything again.
+
+    The index is what every stage reads the source through; if its key ever stopped matching -
+    a path in the hash, a version that changes per run - each stage would quietly go back to
+    parsing the whole tree, and nothing but the run time would show it.
+    """
+    print("the source index is reused across stages")
+    r = run_step('sites.py', src, work)
+    check('nothing parsed twice', ' 0 files parsed' in r.stdout, True)
+    reused = re.search(r'(\d+) reused', r.stdout)
+    check('every file reused', bool(reused) and int(reused.group(1)) >= 3, True)
+
+
+def test_index_parts_are_lazy(root):
+    """A part of an index entry is parsed only when a stage reads one of its keys, and the
+    decorators only of a file that has one - otherwise a cold run lexes the whole tree again."""
+    print("the source index parses a part on first use")
+    import sqlite3
+    from srcindex import SourceIndex
+    tree = os.path.join(root, 'lazy', 'src')
+    os.makedirs(tree)
+    files = {
+        'dto.ts': 'export class ADto {\n  name: string;\n}\n',
+        'a.service.ts': 'export class AService {\n  load(id: number) {\n    return id;\n  }\n}\n',
+        'a.controller.ts': "@Controller('a')\nexport class AController {\n  @Get('x')\n"
+                           "  get() {\n    return 1;\n  }\n}\n",
+    }
+    for name, text in files.items():
+        write_text(os.path.join(tree, name), text)
+    index = SourceIndex(tree, cache=os.path.join(root, 'lazy', 'cache'))
+
+    def rows():
+        with sqlite3.connect(index.db_path) as db:
+            return sorted(db.execute('SELECT part FROM parts').fetchall())
+    entry = {os.path.basename(p): index.get(p) for p in index.paths()}
+    check('a read parses only the core', rows(), [('core',)] * 3)
+    check('no body to find without a signature', entry['dto.ts']['methods'], [])
+    check('undecorated file has no routes', entry['a.service.ts']['routes'], [])
+    check('neither lexed nor parsed for decorators', rows(), [('bodies',)] + [('core',)] * 3)
+    check('a route read from its decorator', [r[1:3] for r in entry['a.controller.ts']['routes']],
+          [('Get', 'x')])
+    check('a body found through the token stream', [m[1] for m in entry['a.service.ts']['methods']], ['load'])
+    check('each part kept once', rows(), [('bodies',)] * 2 + [('core',)] * 3 + [('decorators',), ('tokens',)])
+
+
+def test_index_is_pruned(root):
+    """The index cache drops what no run reads again: the parts of another INDEX_VERSION, the
+    pickles of the index before it, and past its size the parts used longest ago."""
+    print("the source index cache is pruned")
+    import sqlite3
+    import srcindex
+    cache = os.path.join(root, 'pruned')
+    os.makedirs(os.path.join(cache, 'index'))
+    write_text(os.path.join(cache, 'index', 'old.pickle'), '')
+    first = srcindex.SourceIndex(root, cache=cache)
+    first._keep('stale', 'core', b'x')
+    first._keep('recent', 'core', b'x' * 4096)
+    with sqlite3.connect(first.db_path) as db:
+        for digest, used in (('old', 1), ('older', 0)):
+            db.execute('INSERT INTO parts VALUES (?, ?, ?, ?, ?)',
+                       (digest, 'core', srcindex.INDEX_VERSION, used, b'x' * 4096))
+        db.execute("UPDATE parts SET version = ? WHERE digest = 'stale'", (srcindex.INDEX_VERSION - 1,))
+    check('the pickles of the old index removed', os.path.exists(os.path.join(cache, 'index')), False)
+    saved, srcindex.INDEX_KEEP_BYTES = srcindex.INDEX_KEEP_BYTES, 12000
+    try:
+        srcindex.SourceIndex(root, cache=cache)._connect()
+    finally:
+        srcindex.INDEX_KEEP_BYTES = saved
+    with sqlite3.connect(first.db_path) as db:
+        kept = sorted(d for (d,) in db.execute('SELECT digest FROM parts'))
+    check('another version dropped, the least recently used evicted', kept, ['old', 'recent'])
+
+
+def test_parallel_scan_matches_serial(src, work):
+    """A scan over a process pool must write exactly what the serial scan writes."""
+    print("a parallel scan is byte-identical to the serial one")
+    serial = read_text(os.path.join(work, 'sites.json'))
+    par = os.path.join(work, 'parallel')
+    os.makedirs(par)
+    run_step('sites.py', src, par, '--jobs', '3')
+    check('sites.json identical with --jobs 3', read_text(os.path.join(par, 'sites.json')), serial)
+    import threading
+    import pool
+    # A fork copies held locks along and not the threads that would release them.
+    stop = threading.Event()
+    other = threading.Thread(target=stop.wait)
+    other.start()
+    try:
+        pids = pool.map_files(lambda _: os.getpid(), ['a', 'b', 'c'], None, n=2)
+    finally:
+        stop.set()
+        other.join()
+    check('no pool forked while another thread runs', set(pids), {os.getpid()})
+
+
+def test_git_source_matches_worktree(src, root, work):
+    """A scan of a commit read from git must be the scan of that commit checked out.
+
+    The checkout is changed after the commit, so a scan that reads the disk by mistake shows.
+    Over two workers too: each forked worker has to talk to a `git cat-file` of its own.
+    """
+    print("a scan from git objects matches the scan of a checkout")
+    repo = os.path.join(root, 'git-source')
+    shutil.copytree(src, os.path.join(repo, 'src'))
+    git = ['git', '-C', repo]
+    subprocess.run(git + ['init', '-q'], check=True)
+    subprocess.run(git + ['config', 'user.email', 'selftest@example.com'], check=True)
+    subprocess.run(git + ['config', 'user.name', 'selftest'], check=True)
+    subprocess.run(git + ['config', 'commit.gpgsign', 'false'], check=True)
+    subprocess.run(git + ['add', '.'], check=True)
+    subprocess.run(git + ['commit', '-q', '-m', 'fixture'], check=True)
+    service = os.path.join(repo, 'src', 'widget.service.ts')
+    write_text(service, read_text(service).replace(
+        '  async all(', '  async later(): Promise<Widget[]> {\n    return this.widgetRepo.findBy({ id: 2 });\n  }\n\n'
+        '  async all('))
+    os.remove(os.path.join(repo, 'src', 'widget.controller.spec.ts'))
+    want = read_text(os.path.join(work, 'sites.json'))
+    for jobs in ('1', '2'):
+        out = os.path.join(root, f'git-source-{jobs}')
+        os.makedirs(out)
+        run_step('sites.py', os.path.join(repo, 'src'), out, INVENTORY_REF='HEAD', INVENTORY_JOBS=jobs)
+        check(f'sites.json of HEAD identical to the checkout\'s (--jobs {jobs})',
+              read_text(os.path.join(out, 'sites.json')) == want, True)
+
+
 def test_write_classification(src, sites):
     print("writes, locks and raw INSERT are classified as writes")
     classify.annotate(src, sites)
@@ -373,6 +631,9 @@ def test_write_classification(src, sites):
     # An escaped quote must not split the string it sits in.
     check('escaped quote stays inside its string',
           classify._alias_at(".addSelect('it\\'s', 'label')", 10), 'label')
+    # Read in place within the whole file: a string past the end it is given is not its alias.
+    check('alias read no further than its bound',
+          classify._alias_at(".addSelect(expr, 'label')", 10, 16), '(expr,')
 
 
 def test_route_table(src, work):
@@ -437,12 +698,731 @@ def test_endpoint_matches_site_classification(src, work):
     # (file, line) alone the second overwrites the first, and the wider query disappears.
     two = eps.get(('GET', '/widget/twoOnOneLine'))
     check('both measurements on one line survive the join', two and two['maxcol'], 900)
+    # The spec column: the same file names the controller and calls the handler.
+    listing, named = eps.get(('GET', '/widget/list')), eps.get(('GET', '/widget/named'))
+    check('a handler called in a spec is covered', listing and listing['spec'], True)
+    check('a handler only mentioned in a spec is not', named and named['spec'], False)
+    # A query per element: in a loop body, and in a callback mapped over the ids - there
+    # through a call, so the path names both. A read in the loop's header runs once.
+    per_item = {p: eps[('GET', p)]['per_item'] for p in ('/widget/perRow', '/widget/mapped', '/widget/beforeLoop')}
+    check('a read in a loop body runs once per element',
+          per_item['/widget/perRow'], 'WidgetController.perRowWidgets → WidgetService.onePerRow '
+                                      '→ for each: src/widget.service.ts:164')
+    check('a call mapped over a list runs its read once per element',
+          per_item['/widget/mapped'], 'WidgetController.mappedWidgets → WidgetService.onePerRowMapped '
+                                      '→ for each: WidgetService.byId → src/widget.service.ts:174')
+    check('a read in a loop header runs once', per_item['/widget/beforeLoop'], None)
+    check('an endpoint without loops is not flagged', eps[('GET', '/widget/list')]['per_item'], None)
     check('lock and raw write are not reads',
           classify.raw_kind_of("query('SELECT pg_advisory_xact_lock(1)')"), 'lock')
     check('raw INSERT is not a read',
           classify.raw_kind_of("query('INSERT INTO widget VALUES (1)')"), 'write')
 
 
+def test_cron_jobs(work):
+    """Every `@DfxCron` job is a root of the call graph, with its schedule turned into a load per
+    hour: every load site it reaches, once per run."""
+    print("cron jobs are roots of the call graph")
+    jobs = {j['method']: j for j in read_json(os.path.join(work, 'cron-jobs.json'))}
+    check('every declared job, the commented one not', sorted(jobs),
+          ['closeMonth', 'idle', 'refreshWidgets', 'syncWidgets'])
+    sync, refresh, idle = jobs['syncWidgets'], jobs['refreshWidgets'], jobs['idle']
+    check('the declaration read', (sync['job'], sync['cron'], sync['scope'], sync['process'], sync['timeout'],
+                                   sync['delay']),
+          ('WidgetJobService::syncWidgets', '*/1 * * * *', 'worker', 'WIDGET_SYNC', 1800, True))
+    check('a custom expression from its enum, past a later decorator',
+          (refresh['cron'], refresh['scope'], refresh['delay']), ('0 */15 * * * *', 'both', False))
+    check('what a job reaches, as for an endpoint', (sync['kinds'], sync['sites'], sync['maxcol']), (['over'], 1, 5))
+    check('a job querying per element', sync['per_item'],
+          'WidgetJobService.syncWidgets → WidgetService.onePerRow → for each: src/widget.service.ts:164')
+    check('runs, queries and columns per hour', [(j['runs_per_hour'], j['queries_per_hour'], j['cols_per_hour'])
+                                                 for j in (sync, refresh)], [(60, 60, 300), (4, 4, 20)])
+    check('a schedule no table resolves is no rate', (idle['cron'], idle['runs_per_hour'], idle['scope']),
+          (None, None, 'api'))
+    check('nor a cron string this does not read', (jobs['closeMonth']['cron'], jobs['closeMonth']['runs_per_hour']),
+          (None, None))
+    import crontab
+    check('named months and days of the week', crontab.Schedule('0 0 * JAN,jul MON-FRI').per_hour(),
+          crontab.Schedule('0 0 * 1,7 1-5').per_hour())
+    check('no schedule of what does not parse', [crontab.schedule(c) for c in ('0 0 L * *', '*/0 * * * *')],
+          [None, None])
+    check('day fields: either when both are restricted',
+          [round(crontab.Schedule(c).per_hour() * 24 * 365) for c in ('0 0 1 * *', '0 0 * * 1', '0 0 1 * 1')],
+          [12, 52, 12 + 52 - 2])
+
+
+
+def test_cron_load(src, work):
+    """The schedules replayed minute by minute: the per-minute job fires with the quarter-hourly
+    one at every quarter hour, and the `both` job runs in either process."""
+    print("cron schedules replayed minute by minute")
+    import cron_load
+    run_step('cron_load.py', src, work)
+    out = read_json(os.path.join(work, 'cron-load.json'))
+    worker, api = out['worker'], out['api']
+    check('the jobs of each process', (worker['jobs'], api['jobs'], out['all']['jobs']), (2, 1, 2))
+    check('the first minute the most jobs fire in', (worker['peak']['minute'], worker['peak']['jobs']),
+          ('2025-01-01 00:00', 2))
+    check('minutes by the jobs firing in them', worker['concurrency'], [[1, 7 * (1440 - 96)], [2, 7 * 96]])
+    check('the quarter-hourly job always fires with the per-minute one',
+          [(c['jobs'], c['minutes'], c['with']) for c in worker['cohorts']],
+          [(['WidgetJobService::syncWidgets'], 10080, []), (['WidgetJobService::refreshWidgets'], 672, [0])])
+    check('work per hour', {(w['firings'], w['queries'], w['cols']) for w in worker['windows']}, {(64, 64, 320)})
+    check('work per minute of the hour', [m['jobs'] for m in worker['minutes'][:2]], [7 * 24 * 2, 7 * 24])
+    monthly = {'job': 'WidgetJobService::monthly', 'cron': '0 0 1 * *', 'scope': 'worker', 'sites': 2, 'cols': 9}
+    jobs = read_json(os.path.join(work, 'cron-jobs.json')) + [monthly]
+    t = cron_load.Timeline(jobs, 'worker', date(2025, 3, 30), 3)
+    check('a monthly job on the day it fires', (t.peak()['minute'], t.peak()['jobs'], t.peak()['cols']),
+          ('2025-04-01 00:00', 3, 19))
+    r = subprocess.run([sys.executable, os.path.join(HERE, 'inventory.py'), 'cron', '--work', work, '--role', 'api',
+                        '--days', '1', '--window', '15'], capture_output=True, text=True)
+    check('the replay from the command line', (r.returncode, 'of 96 windows of 15 min' in r.stdout), (0, True))
+
+def test_store_answers_the_canned_questions(src, work):
+    """The database must answer from the same graph and sites the documents are built from.
+
+    The sites on an entity lead to the methods that contain them, and those to every endpoint
+    that reaches one - through the closure `store.py` precomputes, not a walk of its own.
+    """
+    print("the inventory database answers the canned questions")
+    import store
+    write_json(os.path.join(work, 'meta-tables.json'), {'widget': {'cols': 3, 'entities': ['Widget']}})
+    run_step('store.py', src, work)
+    db = os.path.join(work, 'inventory.sqlite')
+
+    def ask(name, *args):
+        return store.query(db, name, list(args))[1]
+
+    reaching = {(r[0], r[1]) for r in ask('reaching', 'Widget')}
+    check('an endpoint reaching a Widget read is found', ('GET', '/widget/list') in reaching, True)
+    check('an endpoint searching an array is not', ('GET', '/widget/arraySearch') in reaching, False)
+    check('callers of a service method', [r[:2] for r in ask('callers', 'WidgetService', 'all')],
+          [('GET', '/widget/list')])
+    check('only the wide site is wider than 100 columns',
+          [(r[3], r[6]) for r in ask('wide', 'Widget', '100')], [('twoBuildersOnOneLine', 900)])
+    check('the table lists its entity', [r[0] for r in ask('table', 'widget')], ['Widget'])
+    check('the endpoints querying per element', [r[:2] for r in ask('per-item')],
+          [('GET', '/widget/mapped'), ('GET', '/widget/perRow')])
+    try:
+        ask('sql')
+        refused = None
+    except SystemExit as exc:
+        refused = str(exc)
+    check('sql without a statement is refused, not a crash', refused,
+          "sql takes a statement: sql <statement> [<parameter> ...]")
+
+
+# Replayed in file order, `up` only: the colour index is dropped again, the name index stays.
+MIGRATIONS = {
+    '1000-Init.js': """\
+module.exports = class Init1000 {
+  async up(queryRunner) {
+    await queryRunner.query(`CREATE TABLE "widget" ("id" SERIAL NOT NULL, "name" character varying, "amount" integer, "colour" character varying, "ownerId" integer, CONSTRAINT "PK_widget" PRIMARY KEY ("id"))`);
+    await queryRunner.query(`CREATE INDEX "IDX_widget_name_amount" ON "widget" ("name", "amount") `);
+    await queryRunner.query(`CREATE INDEX "IDX_widget_colour" ON "widget" ("colour") `);
+    await queryRunner.query(`CREATE TABLE "owner" ("id" SERIAL NOT NULL, "mail" character varying, CONSTRAINT "PK_owner" PRIMARY KEY ("id"))`);
+  }
+
+  async down(queryRunner) {
+    await queryRunner.query(`DROP INDEX "IDX_widget_name_amount"`);
+  }
+};
+""",
+    '2000-DropColour.js': """\
+module.exports = class DropColour2000 {
+  async up(queryRunner) {
+    await queryRunner.query(`DROP INDEX "public"."IDX_widget_colour"`);
+    await queryRunner.query(`CREATE INDEX "IDX_widget_owner" ON "widget" ("ownerId") `);
+  }
+};
+""",
+}
+
+
+def test_index_coverage(src, root, work):
+    """Every filter resolved to its column and judged against the indices the migrations leave.
+
+    A leading column is served, a column behind an unfiltered one is not, an index dropped by a
+    later migration serves nothing, and `{ owner: { id } }` is the join column on the table
+    itself. A condition handed in as a variable is not guessed at.
+    """
+    print("index coverage follows the migrations")
+    os.makedirs(os.path.join(root, 'migration'))
+    for name, text in MIGRATIONS.items():
+        write_text(os.path.join(root, 'migration', name), text)
+    write_json(os.path.join(work, 'meta-tables.json'), {
+        'widget': {'cols': 5, 'entities': ['Widget'], 'primary': ['id'],
+                   'fields': {'id': 'id', 'name': 'name', 'amount': 'amount', 'colour': 'colour', 'owner': 'ownerId'},
+                   'relations': {'owner': {'table': 'owner', 'column': 'ownerId'}},
+                   'indices': [{'name': 'IDX_widget_name_amount', 'columns': ['name', 'amount'], 'unique': False},
+                               {'name': 'IDX_widget_label', 'columns': ['label'], 'unique': False}]},
+        'owner': {'cols': 2, 'entities': ['Owner'], 'primary': ['id'],
+                  'fields': {'id': 'id', 'mail': 'mail'}, 'relations': {}, 'indices': []}})
+    run_step('index_coverage.py', src, work)
+    out = read_json(os.path.join(work, 'index-coverage.json'))
+    sites = {x['method']: x for x in out['sites']}
+
+    def verdict(method):
+        x = sites[method]
+        return x['coverage'], [(f['table'], f['column'], f['role'], f['status']) for f in x['filters']]
+
+    check('a primary key lookup is indexed', verdict('byId'), ('indexed', [('widget', 'id', 'where', 'indexed')]))
+    check('a second column alone is non-leading', verdict('byAmount'),
+          ('non-leading', [('widget', 'amount', 'where', 'non-leading')]))
+    check('a dropped index serves nothing, an order is read too', verdict('byColour'),
+          ('unindexed', [('widget', 'colour', 'where', 'unindexed'), ('widget', 'name', 'order', 'indexed')]))
+    check('both columns of a builder across statements', verdict('byNameAndAmount'),
+          ('indexed', [('widget', 'name', 'where', 'indexed'), ('widget', 'amount', 'where', 'indexed')]))
+    check('a relation id is the join column, a deeper filter the joined table', verdict('byOwner'),
+          ('indexed', [('widget', 'ownerId', 'where', 'indexed'), ('owner', 'mail', 'where', 'unindexed')]))
+    check('a condition in a variable is unresolved', sites['byCondition']['coverage'], 'unresolved')
+    check('a write through a builder is no site', 'writeChain' in sites, False)
+    check('the endpoint reaching the unindexed read', [(e['verb'], e['path'], e['coverage']) for e in out['endpoints']],
+          [('GET', '/widget/byColour', 'unindexed')])
+    check('the indices come from the migrations', (out['source'], sorted(ix['name'] for ix in out['indices'])),
+          ('migrations', ['IDX_widget_name_amount', 'IDX_widget_owner', 'PK_owner', 'PK_widget']))
+    check('an entity index no migration creates', [ix['name'] for ix in out['not_migrated']],
+          ['IDX_widget_label'])
+
+
+def test_eager_impact(src, work):
+    """What each eager relation costs, rebuilt from the metadata and simulated away.
+
+    A site naming a relation in its `relations` keeps it with the eager flag off; an eager
+    relation back into an entity on the path is not followed. A site the model does not
+    reproduce keeps its measurement, less the difference the model predicts.
+    """
+    print("eager relations ranked and simulated away")
+    import eager_impact
+    # A directory of its own: the widths below are not the ones the later tests compare against.
+    run = os.path.join(work, 'eager')
+    os.makedirs(run)
+    for name in ('call-graph.json', 'endpoint-eff.json'):
+        shutil.copyfile(os.path.join(work, name), os.path.join(run, name))
+    # Widget (4 columns) -> owner (2) -> country (3), all eager; Owner.widgets leads back.
+    write_json(os.path.join(run, 'meta-tables.json'), {
+        'widget': {'cols': 4, 'entities': ['Widget'], 'models': {'Widget': {'cols': 4, 'relations': {
+            'owner': {'entity': 'Owner', 'eager': True, 'joins': 1},
+            'tags': {'entity': 'Tag', 'eager': False, 'joins': 2}}}}},
+        'owner': {'cols': 2, 'entities': ['Owner'], 'models': {'Owner': {'cols': 2, 'relations': {
+            'country': {'entity': 'Country', 'eager': True, 'joins': 1},
+            'widgets': {'entity': 'Widget', 'eager': True, 'joins': 1}}}}},
+        'country': {'cols': 3, 'entities': ['Country'], 'models': {'Country': {'cols': 3, 'relations': {}}}},
+        'tag': {'cols': 2, 'entities': ['Tag'], 'models': {'Tag': {'cols': 2, 'relations': {}}}}})
+    measured = [dict(s, cols=900 if s.get('cols') == 900 else 9, joins=2) if s['entity'] == 'Widget'
+                and s.get('cols') and s.get('select_count') is None and not s.get('projection') else s
+                for s in read_json(os.path.join(work, 'sites-measured.json'))]
+    write_json(os.path.join(run, 'sites-measured.json'), measured)
+    run_step('eager_impact.py', src, run)
+    out = read_json(os.path.join(run, 'eager-impact.json'))
+    check('the model reproduces all but the wide site', out['model'], {'sites': 23, 'agree': 22})
+    check('ranked by payoff, each with what it adds to its own entity',
+          [(r['relation'], r['cols'], r['joins']) for r in out['relations']],
+          [('Widget.owner', 5, 2), ('Owner.country', 3, 1), ('Owner.widgets', 4, 1)])
+    check('a site naming the relation does not pay for the flag',
+          [(r['relation'], r['sites']) for r in out['relations']],
+          [('Widget.owner', 22), ('Owner.country', 23), ('Owner.widgets', 0)])
+    impact = eager_impact.Impact(*(read_json(os.path.join(run, name)) for name in eager_impact.INPUTS))
+    sites, endpoints = impact.simulate({'Widget.owner', 'Owner.country'})
+    by_method = {s['method']: sites.get((s['file'], s['line'], s['col'])) for s in measured}
+    check('both flags off: the named owner stays, its country goes', by_method['all'], (9, 2, 6, 1))
+    check('both flags off: the entity alone', by_method['noSelect'], (9, 2, 4, 0))
+    check('the wide site less what the model takes away', sorted(v[2] for v in sites.values())[-1], 895)
+    moved = {e['path']: (b, a) for e, b, a in endpoints}
+    check('Max cols recomputed over the call graph', (moved['/widget/list'], moved['/widget/twoOnOneLine']),
+          ((9, 6), (900, 895)))
+    r = subprocess.run([sys.executable, os.path.join(HERE, 'inventory.py'), 'eager', '--work', run,
+                        '--off', 'Widget.colour'], capture_output=True, text=True)
+    check('an unknown relation is named, not simulated', (r.returncode, 'Widget.colour' in r.stderr), (1, True))
+
+
+def test_columnar_matches_json(src, work):
+    """A run in the columnar format must hold exactly the records of a JSON run.
+
+    The stages write the four tables through `colstore` when `INVENTORY_FORMAT=columnar`; the
+    export of each must be the JSON run's file byte for byte, and a read of a few columns must
+    give those keys of the same records.
+    """
+    print("the columnar format holds what the JSON format holds")
+    import colstore
+    col = os.path.join(work, 'columnar')
+    os.makedirs(col)
+    for script in ('sites.py', 'make_table.py', 'fix_handlers.py', 'add_version_deprecated.py'):
+        run_step(script, src, col, INVENTORY_FORMAT='columnar')
+    colstore.write(os.path.join(col, 'sites-measured.col'),
+                   read_json(os.path.join(work, 'sites-measured.json')))
+    run_step('endpoint_eff.py', src, col, INVENTORY_FORMAT='columnar')
+    for name in ('sites', 'table', 'endpoint-eff'):
+        check(f'no {name}.json in a columnar run', os.path.exists(os.path.join(col, name + '.json')), False)
+        out = os.path.join(col, name + '.exported.json')
+        subprocess.run([sys.executable, os.path.join(HERE, 'colstore.py'), 'export',
+                        os.path.join(col, name + '.col'), out], check=True)
+        check(f'{name}.col exports to the JSON run\'s file',
+              read_text(out) == read_text(os.path.join(work, name + '.json')), True)
+    narrow = colstore.read(os.path.join(col, 'sites.col'), ('file', 'line', 'projection'))
+    check('a column read carries only the asked keys of the same records', narrow,
+          [{k: s[k] for k in s if k in ('file', 'line', 'projection')}
+           for s in read_json(os.path.join(work, 'sites.json'))])
+
+
+def test_incremental_run_matches_full_run(root):
+    """An incremental run must produce exactly what a full run over the same tree produces.
+
+    It merges a rescan of the changed files into the previous run's output, so every merge is
+    a chance to keep a row that should have gone, or to put rows in a different order.
+    """
+    print("an incremental run matches a full run")
+    src = os.path.join(root, 'src-incremental')
+    shutil.copytree(os.path.join(root, 'src'), src)
+
+    def chain(name, **env):
+        work = os.path.join(root, name)
+        os.makedirs(work, exist_ok=True)
+        for script in ('sites.py', 'make_table.py', 'fix_handlers.py', 'add_version_deprecated.py'):
+            run_step(script, src, work, **env)
+        write_json(os.path.join(work, 'sites-measured.json'),
+                   [dict(x, cols=5, joins=0) for x in read_json(os.path.join(work, 'sites.json'))])
+        run_step('endpoint_eff.py', src, work, **env)
+        return work
+
+    run_step('incremental.py', src, chain('incr-first'), 'save')
+
+    # A new load site in the service and a new route in the controller.
+    service = os.path.join(src, 'widget.service.ts')
+    write_text(service, read_text(service).replace(
+        '  async all(): Promise<Widget[]> {',
+        '  async added(): Promise<Widget[]> {\n    return this.widgetRepo.findBy({ id: 1 });\n  }\n\n'
+        '  async all(): Promise<Widget[]> {'))
+    controller = os.path.join(src, 'widget.controller.ts')
+    write_text(controller, read_text(controller).replace(
+        "  @Get('whole')",
+        "  @Get('added')\n  async addedWidgets(): Promise<Widget[]> {\n"
+        "    return this.service.added();\n  }\n\n  @Get('whole')"))
+
+    incr = os.path.join(root, 'incr-second')
+    os.makedirs(incr)
+    r = run_step('incremental.py', src, incr, 'plan')
+    check('plan names the two changed files', '2 changed file(s)' in r.stdout, True)
+    chain('incr-second', INVENTORY_PLAN=os.path.join(incr, 'plan.json'))
+    full = chain('incr-full')
+    for name in ('sites.json', 'table.json', 'endpoint-eff.json'):
+        check(f'{name} identical to a full run',
+              read_json(os.path.join(incr, name)) == read_json(os.path.join(full, name)), True)
+    added = [e for e in read_json(os.path.join(incr, 'endpoint-eff.json')) if e['handler'] == 'addedWidgets']
+    check('the new route reaches its new load site', added and added[0]['kinds'], ['over'])
+
+    # `--since` with a last run made on an older commit than the ref: the commits in between
+    # must be rescanned too, not only what `git diff <ref>` lists.
+    src = os.path.join(root, 'src-since')
+    shutil.copytree(os.path.join(root, 'src'), src)
+
+    def git(*args):
+        subprocess.run(['git', '-C', src, '-c', 'user.name=t', '-c', 'user.email=t@t', *args],
+                       check=True, capture_output=True)
+    git('init', '-q')
+    git('add', '-A')
+    git('commit', '-qm', 'old')
+    run_step('incremental.py', src, chain('since-first'), 'save')
+    service = os.path.join(src, 'widget.service.ts')
+    write_text(service, read_text(service).replace(
+        '  async all(): Promise<Widget[]> {',
+        '  async added(): Promise<Widget[]> {\n    return this.widgetRepo.findBy({ id: 1 });\n  }\n\n'
+        '  async all(): Promise<Widget[]> {'))
+    git('commit', '-qam', 'new')
+    since = os.path.join(root, 'since-second')
+    os.makedirs(since)
+    r = run_step('incremental.py', src, since, 'plan', '--since', 'HEAD')
+    check('--since rescans what changed after the last run, not only after the ref',
+          read_json(os.path.join(since, 'plan.json'))['changed'], ['src/widget.service.ts'])
+    chain('since-second', INVENTORY_PLAN=os.path.join(since, 'plan.json'))
+    full = chain('since-full')
+    check('sites.json identical to a full run',
+          read_json(os.path.join(since, 'sites.json')) == read_json(os.path.join(full, 'sites.json')), True)
+
+
+def test_orchestrator_matches_chain(root):
+    """`inventory.py run` must produce what the steps produce run one by one, and a rerun must
+    run only the steps whose inputs changed.
+
+    The steps run in-process here, with the measurement replaced by the same stand-in the other
+    tests use - the orchestration is under test, not `measure.js`. `build_docs.py` is left out:
+    it checks its hand-maintained tables against the real tree, which the fixture is not.
+    """
+    print("the orchestrator matches the step-by-step chain")
+    import contextlib, io
+    import inventory, workdir
+    src = os.path.join(root, 'src-orchestrated')
+    shutil.copytree(os.path.join(root, 'src'), src)
+
+    def measure():
+        write_json(workdir.path('sites-measured.json'),
+                   [dict(x, cols=5, joins=0) for x in workdir.load('sites.json')])
+        write_json(workdir.path('meta-tables.json'), {'widget': {'cols': 3, 'entities': ['Widget']}})
+    steps = [inventory.Step('measure', measure, s.inputs, s.outputs) if s.name == 'measure' else s
+             for s in inventory.STEPS if s.name != 'build_docs']
+    cache = inventory.StepCache()
+
+    def orchestrated(name):
+        work = os.path.join(root, name)
+        os.makedirs(work)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return work, inventory.execute(steps, src, work, cache=cache)
+
+    first, outcome = orchestrated('orch-first')
+    check('every step ran', sorted(outcome.values()), ['ran'] * len(steps))
+    stepwise = os.path.join(root, 'orch-stepwise')
+    os.makedirs(stepwise)
+    for script in ('sites.py', 'make_table.py', 'fix_handlers.py', 'add_version_deprecated.py'):
+        run_step(script, src, stepwise)
+    shutil.copyfile(os.path.join(first, 'sites-measured.json'), os.path.join(stepwise, 'sites-measured.json'))
+    run_step('endpoint_eff.py', src, stepwise)
+    for name in ('sites.json', 'table.json', 'endpoint-eff.json', 'call-graph.json'):
+        check(f'{name} identical to the step-by-step chain',
+              read_text(os.path.join(first, name)) == read_text(os.path.join(stepwise, name)), True)
+
+    _, outcome = orchestrated('orch-again')
+    check('an unchanged tree runs nothing', set(outcome.values()), {'cached'})
+    # A new route and no new load site: every step that reads src/ runs again, but the sites it
+    # finds are the same, so the measurement of them is not repeated.
+    controller = os.path.join(src, 'widget.controller.ts')
+    write_text(controller, read_text(controller).replace(
+        "  @Get('whole')",
+        "  @Get('again')\n  async again(): Promise<Widget[]> {\n    return this.service.all();\n  }\n\n"
+        "  @Get('whole')"))
+    _, outcome = orchestrated('orch-changed')
+    check('a changed controller reruns the source steps, not the measurement',
+          (outcome['make_table'], outcome['endpoint_eff'], outcome['measure']), ('ran', 'ran', 'cached'))
+
+    # With workers, the steps that fan out run as processes of their own, forking their pool
+    # there rather than from a step thread.
+    serial, parallel = os.path.join(root, 'orch-serial'), os.path.join(root, 'orch-parallel')
+    for work, jobs in ((serial, '1'), (parallel, '2')):
+        os.makedirs(work)
+        os.environ['INVENTORY_JOBS'] = jobs
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                inventory.execute(steps, src, work)
+        finally:
+            os.environ.pop('INVENTORY_JOBS')
+    for name in ('sites.json', 'endpoint-eff.json', 'call-graph.json', 'cron-load.json'):
+        check(f'{name} identical with --jobs 2', read_text(os.path.join(parallel, name)),
+              read_text(os.path.join(serial, name)))
+
+
+def test_profile_changes_nothing_but_records_every_step(root):
+    """`--profile` measures the steps; what they produce must stay byte for byte the same, and
+    the patterns must be plain ones again once it is over."""
+    print("a profiled run matches an unprofiled one and records every step")
+    import contextlib, io, pstats, re
+    import inventory, stageprof, tsparse, workdir
+    src = os.path.join(root, 'src')
+
+    def measure():
+        write_json(workdir.path('sites-measured.json'),
+                   [dict(x, cols=5, joins=0) for x in workdir.load('sites.json')])
+        write_json(workdir.path('meta-tables.json'), {'widget': {'cols': 3, 'entities': ['Widget']}})
+    steps = [inventory.Step('measure', measure, s.inputs, s.outputs) if s.name == 'measure' else s
+             for s in inventory.STEPS if s.name != 'build_docs']
+    works = {}
+    for name in ('plain', 'profiled'):
+        works[name] = os.path.join(root, f'prof-{name}')
+        os.makedirs(works[name])
+        if name == 'profiled':
+            stageprof.start(os.path.join(works[name], 'profile'))
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                inventory.execute(steps, src, works[name])
+        finally:
+            stageprof.stop()
+    for name in ('sites.json', 'table.json', 'endpoint-eff.json', 'call-graph.json'):
+        check(f'{name} identical with --profile', read_text(os.path.join(works['plain'], name)),
+              read_text(os.path.join(works['profiled'], name)))
+    records = {r['step']: r for r in stageprof.write(os.path.join(works['profiled'], 'profile.json'))}
+    check('every in-process step recorded', sorted(records),
+          sorted(s.name for s in steps if s.name != 'measure'))
+    ts = [os.path.join(d, n) for d, _, names in os.walk(src) for n in names if n.endswith('.ts')]
+    check('sites read every file once', (records['sites']['files_read'], records['sites']['bytes_read']),
+          (len(ts), sum(os.path.getsize(p) for p in ts)))
+    check('the patterns of the modules sites.py reads through counted',
+          any(k.startswith('classify.') and n > 0 for k, n in records['sites']['regex_matches'].items()), True)
+    check('a cProfile dump per step', pstats.Stats(records['endpoint_eff']['cprofile']).total_calls > 0, True)
+    # A step that fans out runs in a process of its own with --jobs, and reports from there.
+    works['jobs'] = os.path.join(root, 'prof-jobs')
+    os.makedirs(works['jobs'])
+    os.environ['INVENTORY_JOBS'] = '2'
+    stageprof.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            inventory.execute(steps, src, works['jobs'])
+    finally:
+        stageprof.stop()
+        os.environ.pop('INVENTORY_JOBS')
+    records = {r['step']: r for r in stageprof.write(os.path.join(works['jobs'], 'profile.json'))}
+    # Each of its two passes reads the files in the workers, which keep no index for the other.
+    check('sites reports the reads of its workers from a process of its own',
+          records['sites']['files_read'] >= len(ts), True)
+    check('and its pattern counts with it',
+          any(k.startswith('classify.') and n > 0 for k, n in records['sites']['regex_matches'].items()), True)
+    functions = re.compile, re.search, re.fullmatch
+    stageprof.start()
+    try:
+        check('the re module left alone while profiling', (re.compile, re.search, re.fullmatch), functions)
+    finally:
+        stageprof.stop()
+    check('patterns restored', (isinstance(tsparse.SIG, re.Pattern), re.compile.__module__), (True, 're'))
+
+
+def test_bench_times_every_step(root):
+    """`bench.py` must get a generated tree through the whole chain and time every step of it."""
+    print("the benchmark's generated tree runs through the chain")
+    import bench
+    tree = os.path.join(root, 'bench')
+    files, _ = bench.generate(tree, 1, domains=16)
+    check('every domain generated', files, sum(len(list(bench.Domain(d, 16).files())) for d in range(16)))
+    steps = bench.timed_run(os.path.join(tree, 'src'), os.path.join(tree, 'work'), os.path.join(tree, 'cache'), 1)
+    check('every step timed', sorted(steps),
+          sorted(s for s in ('sites', 'make_table', 'fix_handlers', 'add_version_deprecated', 'endpoint_eff',
+                             'index_coverage', 'eager_impact', 'cron_load', 'store')))
+    check('the propagation timed on its own', 'propagation' in steps['endpoint_eff'].get('phases', {}), True)
+    routes = read_json(os.path.join(tree, 'work', 'table.json'))
+    check('every generated route found', len(routes),
+          8 * sum(1 for d in range(16) if bench.Domain(d, 16).controller))
+
+
+def test_watch_follows_edits(root):
+    """`inventory.py watch` must end up where a full run over the edited tree ends up - after a
+    change that only moves a category, and after one that adds a method, a call and a route."""
+    print("watch mode follows edits as a full run would")
+    import contextlib, io
+    import inventory, watch, workdir
+    src = os.path.join(root, 'src-watched')
+    shutil.copytree(os.path.join(root, 'src'), src)
+
+    def measured(sites):
+        return [dict(x, cols=x.get('select_count') or 5, joins=0) for x in sites]
+
+    def measure():
+        write_json(workdir.path('sites-measured.json'), measured(workdir.load('sites.json')))
+        write_json(workdir.path('meta-tables.json'), {'widget': {'cols': 3, 'entities': ['Widget']}})
+    steps = [inventory.Step('measure', measure, s.inputs, s.outputs) if s.name == 'measure' else s
+             for s in inventory.STEPS if s.name not in ('store', 'build_docs')]
+    os.makedirs(os.path.join(root, 'watch'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        session = watch.Session(src, os.path.join(root, 'watch'), steps=steps, measure=measured)
+
+    def edit(name, old, new):
+        path = os.path.join(src, name)
+        write_text(path, read_text(path).replace(old, new))
+        with contextlib.redirect_stdout(io.StringIO()):
+            return session.apply({path})
+
+    def matches_a_full_run(name):
+        work = os.path.join(root, name)
+        os.makedirs(work)
+        with contextlib.redirect_stdout(io.StringIO()):
+            inventory.execute(steps, src, work)
+        full = [{k: v for k, v in e.items() if k != 'spec'} for e in read_json(os.path.join(work, 'endpoint-eff.json'))]
+        return session.endpoints() == full
+
+    changed = edit('widget.service.ts', "return this.widgetRepo.createQueryBuilder('w').getMany();",
+                   "return this.widgetRepo.createQueryBuilder('w').select(['w.id']).getMany();")
+    check('a conversion reported as it moves the endpoint', changed.get(('GET', '/widget/whole', '1')),
+          (('whole rows', 5), ('projected', 1)))
+    check('a category change matches a full run', matches_a_full_run('watch-full-first'), True)
+    edit('widget.service.ts', '  async all(): Promise<Widget[]> {',
+         '  async added(): Promise<Widget[]> {\n    return this.widgetRepo.findBy({ id: 1 });\n  }\n\n'
+         '  async all(): Promise<Widget[]> {')
+    changed = edit('widget.controller.ts', "  @Get('whole')",
+                   "  @Get('added')\n  async addedWidgets(): Promise<Widget[]> {\n"
+                   "    return this.service.added();\n  }\n\n  @Get('whole')")
+    check('a new route reported with what it reaches', changed.get(('GET', '/widget/added', '1')),
+          (None, ('whole rows', 5)))
+    check('a new method, call and route match a full run', matches_a_full_run('watch-full-second'), True)
+
+    # The watcher itself: inotify where there is one, and polling.
+    for make in (watch.Inotify, lambda d: watch.Poller(d, 0.05)):
+        try:
+            source = make(src)
+        except OSError:
+            continue
+        path = os.path.join(src, 'widget.service.ts')
+        time.sleep(0.05)
+        write_text(path, read_text(path) + '\n')
+        check(f'{type(source).__name__} sees a save', path in source.changes(2), True)
+        source.close()
+
+
+def test_condensed_graph_matches_fixpoint():
+    """The condensed propagation must give what the edge-by-edge fixpoint gave, cycles included.
+
+    Compared on random graphs dense enough to be full of cycles, against the fixpoint the walk
+    used before - and again after a local change, which goes through the worklist instead.
+    """
+    print("the condensed call graph matches the fixpoint")
+    import random
+    from callgraph import CallGraph, Summary
+
+    def fixpoint(nodes, edges, local):
+        val = {n: set(local[n]) for n in nodes}
+        changed = True
+        while changed:
+            changed = False
+            for n, targets in edges.items():
+                for t in targets:
+                    if not val[t] <= val[n]:
+                        val[n] |= val[t]; changed = True
+        return val
+
+    rng = random.Random(7)
+    same, reach_ok, updated = True, True, True
+    for _ in range(40):
+        nodes = list(range(rng.randint(1, 40)))
+        edges = {n: {rng.choice(nodes) for _ in range(rng.randint(0, 3))} for n in nodes}
+        local = {n: frozenset(rng.sample('abcdef', rng.randint(0, 2))) for n in nodes}
+        graph = CallGraph(nodes, edges)
+        summary = Summary(graph, local, frozenset.union)
+        want = fixpoint(nodes, edges, local)
+        same &= all(summary[n] == want[n] for n in nodes)
+        closure = fixpoint(nodes, edges, {n: {n} for n in nodes})
+        reach_ok &= all(graph.reaches(a, b) == (b in closure[a]) for a in nodes for b in nodes)
+        reach_ok &= all(graph.reachable(a) == closure[a] for a in nodes)
+        changes = {n: frozenset(rng.sample('abcdefgh', rng.randint(0, 3)))
+                   for n in rng.sample(nodes, min(2, len(nodes)))}
+        summary.update(changes)
+        local.update(changes)
+        want = fixpoint(nodes, edges, local)
+        updated &= all(summary[n] == want[n] for n in nodes)
+    check('summaries identical to the fixpoint', same, True)
+    check('reachability identical to the transitive closure', reach_ok, True)
+    check('worklist update identical to a fresh fixpoint', updated, True)
+
+
+def test_lexer():
+    """What the character loops got wrong: literals that hide brackets, and chains cut short.
+
+    A `}` inside a template interpolation or a regex literal, `//` inside a string, and a `;`
+    inside a `Brackets` callback or a type argument each used to end a method body, a comment
+    or a chain in the wrong place.
+    """
+    print("the lexer keeps literals and nested blocks intact")
+    from tsparse import Tokens, matching, statement_end, strip_line_comments
+    body = ("{\n  const a = `${ {x: 1}['x'] } }`;\n  const r = /[}']+/g;\n"
+            "  const u = 'http://host//path'; // gone\n  return a;\n}")
+    check('brace after a template and a regex literal', matching(body, 0), len(body) - 1)
+    check('same answer from the token stream', Tokens(body).matching(0), len(body) - 1)
+    stripped = strip_line_comments(body)
+    check('comment stripped, URL kept', ("// gone" not in stripped, "'http://host//path'" in stripped),
+          (True, True))
+    check('line count kept', stripped.count('\n'), body.count('\n'))
+    chain = (".createQueryBuilder('w')\n      .where(new Brackets((qb) => { qb.where('a'); }))\n"
+             "      .getRawMany<{ id: number; n: string }>()\n      .then((r) => r);\n  }")
+    m_end = chain.index('(') + 1
+    check('chain runs past a `;` in a callback and a type argument',
+          chain[statement_end(chain, m_end):], ';\n  }')
+    check('chain without a `;` ends with its block',
+          statement_end(chain.replace(';\n  }', '\n  }'), m_end), len(chain) - 2)
+    check('a join past the callback is seen',
+          classify.select_kind(chain.replace('.then', ".leftJoinAndSelect('w.x', 'x').select(['w.id']).then"),
+                               0, m_end), classify.SEL_PROJECTED_FULL_JOIN)
+    from tsparse import SIG, method_body, skip_trivia
+    cls = ("class A {\n  key(): `0x${string}` {\n    return k;\n  }\n"
+           "  async get(): Promise<{ a: '<'; b: X }> {\n    return b;\n  }\n"
+           "  @UseGuards(\n    AuthGuard(),\n  )\n  run() {\n    go();\n  }\n}")
+    bodies = {m.group(1): method_body(cls, m.end(), Tokens(cls)) for m in SIG.finditer(cls)}
+    check('body after a template literal type', cls[bodies['key'][0]:bodies['key'][1] + 1], '{\n    return k;\n  }')
+    check('body after an object type with a quoted `<`', cls[bodies['get'][0] + 1:bodies['get'][1]].strip(),
+          'return b;')
+    check('a call inside a decorator has no body', bodies['AuthGuard'], (-1, -1))
+    check('same bodies without the token stream',
+          {n: method_body(cls, m.end()) for n, m in ((m.group(1), m) for m in SIG.finditer(cls))}, bodies)
+    trivia = "  /* a */ // b\n  'c // d'"
+    check('trivia skipped up to the string', skip_trivia(trivia, 0, Tokens(trivia)), trivia.index("'"))
+    check('same without the token stream', skip_trivia(trivia, 0), trivia.index("'"))
+
+
+def test_per_item_regions():
+    """The parts of a body that run once per element: loop bodies and per-element callbacks.
+
+    A loop's header runs once, and so does a callback handed to anything but an iteration; a
+    `for` inside a string or a comment is no loop at all.
+    """
+    print("loop bodies and per-element callbacks are found, headers are not")
+    from tsparse import per_item_regions
+    body = ("{\n  for (const x of await load()) { each(x); }\n  while (more()) next();\n"
+            "  const t = 'for (;;) {}'; // for (a of b) {}\n  await Promise.all(xs.map((x) => one(x)));\n"
+            "  await asyncMap(xs, async (x) => two(x));\n  setTimeout(() => three(), 1);\n}")
+    inside = lambda word: [any(a < body.index(word) < b for a, b in per_item_regions(body, 1, len(body) - 1))]
+    check('loop body, header, while, literal',
+          [*inside('each'), *inside('load'), *inside('more'), *inside('next'), *inside(';;')],
+          [True, False, True, True, False])
+    check('callbacks of map and asyncMap, not of setTimeout',
+          [*inside('one'), *inside('two'), *inside('three')], [True, True, False])
+
+
+def test_file_cache():
+    """The shared file cache: least recently used out first, and one source never answers for
+    another."""
+    print("the file cache is bounded and keyed on its source")
+    from tsparse import FileCache, stripped
+    import tsparse
+    cache = FileCache(limit=10)
+    cache.put('a', ('aaaa', [0])); cache.put('b', ('bbbb', [0]))
+    cache.get('a', None)
+    cache.put('c', ('cccc', [0]))
+    check('least recently used evicted first', (cache.evicted, cache.size), (1, 8))
+    check('evicted entry loaded again', (cache.get('a', None), cache.get('b', lambda: ('bb', [0]))),
+          (('aaaa', [0]), ('bb', [0])))
+    check('hits and misses counted', (cache.hits, cache.misses), (2, 1))
+
+    class Tree:
+        def __init__(self, text): self.text, self.reads = text, 0
+        def read_text(self, path): self.reads += 1; return self.text
+    old, new = Tree('a // x\nb'), Tree('c\nd')
+    saved, tsparse.FILES = tsparse.FILES, FileCache()
+    try:
+        check('stripped text with its line table', stripped(old, 'f.ts'), ('a \nb', [0, 3]))
+        check('another source reads for itself', stripped(new, 'f.ts'), ('c\nd', [0, 2]))
+        stripped(old, 'f.ts')
+        check('each file read once', (old.reads, new.reads), (1, 1))
+    finally:
+        tsparse.FILES = saved
+
+
+def test_scan_events():
+    """The anchors the site scan and the call-graph walk read, found once per file."""
+    print("one scan yields every read and injection in source order")
+    from tsparse import READ, REPO, injected, scan_events
+    text = ("class A {\n  constructor(@InjectRepository(W) private readonly repo: Repository<W>,\n"
+            "              private readonly other: OtherService) {}\n"
+            "  f() { return this.repo.find({}).then(() => this.repo.createQueryBuilder('w')); }\n}")
+    events = scan_events(text)
+    check('reads in order', [ev[3] for ev in events if ev[1] == READ], ['find', 'createQueryBuilder'])
+    check('events sorted by position', [ev[0] for ev in events], sorted(ev[0] for ev in events))
+    check('an injected repository is typed by its entity', injected(events),
+          {'repo': 'WRepository', 'other': 'OtherService'})
+    check('a file without the anchors yields nothing', scan_events('const a = [1].map((x) => x);'), [])
+    check('no repository event without the decorator', [ev for ev in scan_events(text.replace('@Inject', ''))
+                                                          if ev[1] == REPO], [])
+
+
+def test_interval_index():
+    """A position belongs to the last declaration that starts before it, as the linear walks
+    every caller used to carry decided."""
+    print("the interval index answers what the linear walk answered")
+    from tsparse import IntervalIndex
+    pairs = [(10, 'A'), (40, 'B'), (40, 'C'), (90, 'D')]
+    index = IntervalIndex(pairs)
+
+    def walk(pos):
+        cur = None
+        for p, n in pairs:
+            if p < pos: cur = n
+            else: break
+        return cur
+    check('same answer at every position', [index.at(p) for p in range(100)], [walk(p) for p in range(100)])
+    check('default before the first declaration', IntervalIndex([]).at(5, ('', None)), ('', None))
+
+
 def test_measure_reports_unresolvable_projection(work):
     """An unresolvable projection must produce an error, never a number.
 
@@ -491,6 +1471,36 @@ def test_measure_reports_unresolvable_projection(work):
     check('unresolvable projection is reported', bool(out['gone'].get('error')), True)
 
 
+def test_measure_cache_reuses_measurements(work):
+    """A second measurement of the same sites must build no query and write the same result.
+
+    The cache key is the metadata of every entity the query would join; over an unchanged
+    `dist/` every default-query site is a hit.
+    """
+    print("measure.js reuses cached measurements")
+    repo = os.path.dirname(os.path.dirname(HERE))
+    dist = os.path.join(repo, 'dist')
+    if not shutil.which('node') or not os.path.isdir(os.path.join(dist, 'src')):
+        print("  skip  needs node and a built dist/ (npm run build)")
+        return
+    site = {'file': 'src/x.ts', 'line': 1, 'cls': 'R', 'method': 'm', 'call': 'find', 'kind': 'find',
+            'entity': 'BuyCrypto', 'via': None, 'select': None}
+    sites_path = os.path.join(work, 'cache-sites.json')
+    write_json(sites_path, [dict(site, relations=None), dict(site, line=2, relations={'buy': True})])
+    env = dict(os.environ, DIST=dist, INVENTORY_CACHE=os.path.join(work, 'measure-cache'))
+    runs = []
+    for n in (1, 2):
+        out = os.path.join(work, f'cache-measured-{n}.json')
+        r = subprocess.run(['node', os.path.join(HERE, 'measure.js'), sites_path, out,
+                            os.path.join(work, 'cache-tables.json')],
+                           capture_output=True, text=True, env=env, cwd=repo)
+        stats = [json.loads(l) for l in r.stdout.splitlines() if l.startswith('{"step":"cache"')]
+        runs.append((stats[0] if stats else None, read_text(out) if os.path.exists(out) else None))
+    check('first run measures both sites', runs[0][0] and runs[0][0]['misses'], 2)
+    check('second run reuses both', runs[1][0] and (runs[1][0]['hits'], runs[1][0]['misses']), (2, 0))
+    check('reused measurements are identical', runs[0][1] is not None and runs[0][1] == runs[1][1], True)
+
+
 def test_drift_excludes_writes(src, root, work):
     """A newly appeared write site must not reach the published document.
 
@@ -546,6 +1556,84 @@ def test_drift_excludes_writes(src, root, work):
     check('published row kept', 'OtherService.load' in body, True)
 
 
+def test_drift_runs_come_from_the_artifact_cache(src, root, work):
+    """Without `gen/`, apply_drift must scan the publication commit itself, keep that run, and
+    find the current tree's run where `inventory.py run` keeps it - with the result a drift run
+    over the same runs given by hand produces.
+    """
+    print("apply_drift makes the old run once and fetches it after")
+    import artifacts
+    chain = os.path.join(root, 'chain')
+    os.makedirs(chain)
+    for n in (*artifacts.CHAIN, 'bench.py'):
+        shutil.copyfile(os.path.join(HERE, n), os.path.join(chain, n))
+    digest = artifacts.code_digest(chain)
+    write_text(os.path.join(chain, 'bench.py'), '# edited\n')
+    check('editing the benchmark keeps the chain\'s digest', artifacts.code_digest(chain), digest)
+    write_text(os.path.join(chain, 'tsparse.py'), read_text(os.path.join(chain, 'tsparse.py')) + '# edited\n')
+    check('editing a module of the chain changes it', artifacts.code_digest(chain) != digest, True)
+    repo = os.path.join(root, 'drift-repo')
+    shutil.copytree(src, os.path.join(repo, 'src'))
+    write_text(os.path.join(repo, 'load-sites.md'), read_text(os.path.join(work, 'pubrepo', 'load-sites.md')))
+    git = ['git', '-C', repo]
+    subprocess.run(git + ['init', '-q'], check=True)
+    subprocess.run(git + ['config', 'user.email', 'selftest@example.com'], check=True)
+    subprocess.run(git + ['config', 'user.name', 'selftest'], check=True)
+    subprocess.run(git + ['config', 'commit.gpgsign', 'false'], check=True)
+    subprocess.run(git + ['add', '.'], check=True)
+    subprocess.run(git + ['commit', '-q', '-m', 'published'], check=True)
+    # The current tree's run, kept as `inventory.py run` keeps it.
+    tree = artifacts.worktree_tree(os.path.join(repo, 'src'))
+    check('an unchanged checkout hashes to its commit\'s tree', tree, artifacts.tree_of(repo, 'HEAD'))
+    # Edited, added, deleted and made executable: still what `git add --all` would commit, and
+    # nothing is written into the copy's .git/objects on the way.
+    edited = os.path.join(root, 'drift-edited')
+    shutil.copytree(repo, edited)
+    esrc = os.path.join(edited, 'src')
+    ts = sorted(os.path.join(d, f) for d, _, fs in os.walk(esrc) for f in fs if f.endswith('.ts'))
+    write_text(ts[0], read_text(ts[0]) + '\n// edited\n')
+    os.remove(ts[1])
+    os.chmod(ts[2], 0o755)
+    os.makedirs(os.path.join(esrc, 'added', 'deep'))
+    write_text(os.path.join(esrc, 'added', 'deep', 'new.ts'), 'export const x = 1;\n')
+    objects = lambda: sorted(os.path.join(d, f) for d, _, fs in os.walk(os.path.join(edited, '.git', 'objects'))
+                             for f in fs)
+    before = objects()
+    edited_tree = artifacts.worktree_tree(esrc)
+    check('hashing a working tree writes no objects', objects(), before)
+    env = dict(os.environ, GIT_INDEX_FILE=os.path.join(root, 'drift-edited.index'))
+    subprocess.run(['git', '-C', edited, 'add', '--all', '--', 'src'], check=True, env=env)
+    committed = subprocess.run(['git', '-C', edited, 'write-tree', '--prefix=src/'], check=True, env=env,
+                               capture_output=True, text=True).stdout.strip()
+    check('a changed checkout hashes to the tree it would commit', edited_tree, committed)
+    artifacts.ArtifactCache().store(tree, os.path.join(work, 'gen', 'new'), ['sites-measured.json'])
+
+    def drift(name, drift_work):
+        out = os.path.join(work, name)
+        env = dict(os.environ, API_SRC=os.path.join(repo, 'src'), INVENTORY_WORK=drift_work,
+                   INVENTORY_REPO=repo, PYTHONPATH=HERE)
+        r = subprocess.run([sys.executable, os.path.join(HERE, 'apply_drift.py'), 'HEAD', 'load-sites.md', out],
+                           capture_output=True, text=True, env=env)
+        if r.returncode != 0:
+            print(f"  FAIL apply_drift.py exited {r.returncode}: {r.stderr.strip()[:400]}")
+            FAILURES.append('apply_drift.py')
+        return r.stdout, read_text(out) if os.path.exists(out) else None
+
+    bare = os.path.join(root, 'drift-bare')
+    os.makedirs(bare)
+    first, made = drift('drift-made.md', bare)
+    second, fetched = drift('drift-fetched.md', bare)
+    check('the old run is scanned when it is not cached', 'not cached - scanning it' in first, True)
+    check('and fetched after', 'old run: HEAD' in second and 'from the artifact cache' in second, True)
+    check('the new run is found by its tree', 'new run:' in first, True)
+    given = os.path.join(root, 'drift-given')
+    os.makedirs(os.path.join(given, 'gen', 'old'))
+    shutil.copytree(os.path.join(work, 'gen', 'new'), os.path.join(given, 'gen', 'new'))
+    run_step('sites.py', os.path.join(repo, 'src'), os.path.join(given, 'gen', 'old'))
+    _, by_hand = drift('drift-given.md', given)
+    check('cached runs give what runs given by hand give', made is not None and made == fetched == by_hand, True)
+
+
 def test_missing_ref_is_reported(src, work):
     """A bad git ref must say so, not fail on an empty string somewhere downstream."""
     print("apply_drift reports a bad ref instead of crashing")
@@ -561,16 +1649,42 @@ def test_missing_ref_is_reported(src, work):
 
 def main():
     root = tempfile.mkdtemp(prefix='inventory-selftest-')
+    # A cache of its own, so the run neither reuses nor leaves behind entries of a real tree.
+    os.environ['INVENTORY_CACHE'] = os.path.join(root, 'cache')
     try:
         src = build_fixture(root)
         work = os.path.join(root, 'work')
         os.makedirs(work)
         sites = test_select_categories(src, work)
+        test_source_index_is_reused(src, work)
+        test_index_parts_are_lazy(root)
+        test_index_is_pruned(root)
+        test_parallel_scan_matches_serial(src, work)
+        test_git_source_matches_worktree(src, root, work)
         test_write_classification(src, sites)
         test_route_table(src, work)
         test_endpoint_matches_site_classification(src, work)
+        test_cron_jobs(work)
+        test_cron_load(src, work)
+        test_store_answers_the_canned_questions(src, work)
+        test_index_coverage(src, root, work)
+        test_eager_impact(src, work)
+        test_columnar_matches_json(src, work)
+        test_incremental_run_matches_full_run(root)
+        test_orchestrator_matches_chain(root)
+        test_profile_changes_nothing_but_records_every_step(root)
+        test_bench_times_every_step(root)
+        test_watch_follows_edits(root)
+        test_condensed_graph_matches_fixpoint()
+        test_lexer()
+        test_per_item_regions()
+        test_file_cache()
+        test_scan_events()
+        test_interval_index()
         test_measure_reports_unresolvable_projection(work)
+        test_measure_cache_reuses_measurements(work)
         test_drift_excludes_writes(src, root, work)
+        test_drift_runs_come_from_the_artifact_cache(src, root, work)
         test_missing_ref_is_reported(src, work)
     finally:
         shutil.rmtree(root, ignore_errors=True)
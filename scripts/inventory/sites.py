@@ -5,10 +5,14 @@ A load site is a call that reads data from the database. Per site this records:
 enclosing class/method, target entity, loading mechanism. The column count is measured
 afterwards by TypeORM itself (measure.js).
 """
-import re, glob, os, json
+import re, os
 
 import classify
-from tsparse import read_text, rel_path
+import incremental
+import pool
+import workdir
+from srcindex import shared
+from tsparse import READ, IntervalIndex, injected, line_col, rel_path, src_path
 
 SP = os.environ.get("INVENTORY_WORK")
 if not SP:
@@ -17,31 +21,37 @@ SRC = os.environ.get("API_SRC")
 if not SRC:
     raise SystemExit("API_SRC is not set - run this through scripts/inventory/run.sh")
 
-# Reading calls. save/update/delete are write paths and deliberately absent.
-READ = re.compile(r'\.(find|findOne|findBy|findOneBy|findAndCount|findOneOrFail|'
-                  r'findCached|findCachedBy|findOneCached|findOneCachedBy|'
-                  r'createQueryBuilder|query)\s*\(')
-CLASSRE = re.compile(r'export\s+(?:abstract\s+)?class\s+(\w+)')
-SIG = re.compile(r'^\s{2,}(?:public|private|protected)?\s*(?:async\s+)?(\w+)\s*(?:<[^>]*>)?\s*\(', re.M)
+# What precedes a call, searched back from it: `this.<field>.`, `this.`, `<var>.`.
+THIS_FIELD = re.compile(r'this\.(\w+)\s*$')
+THIS = re.compile(r'this\s*$')
+RECEIVER = re.compile(r'(\w+)\s*$')
+RELATIONS = re.compile(r'relations\s*:\s*\{')
+KEY = re.compile(r'([A-Za-z_]\w*)\s*:\s*')
+BOOL = re.compile(r'(true|false)')
 
 
-def parse_obj(text, i):
+def parse_obj(text, i, end=None):
+    """The object literal whose `{` is at i, read no further than end: (tree, position after it).
+
+    Matched in place (`pattern.match(text, i, end)`) - slicing the remainder at every key
+    copied the rest of the window once per step."""
+    end = len(text) if end is None else end
     res, i = {}, i + 1
-    while i < len(text):
+    while i < end:
         c = text[i]
         if c == '}': return res, i + 1
         if c in ' \n\r\t,': i += 1; continue
-        m = re.match(r'([A-Za-z_]\w*)\s*:\s*', text[i:])
+        m = KEY.match(text, i, end)
         if not m: i += 1; continue
-        key = m.group(1); i += m.end()
-        if i < len(text) and text[i] == '{':
-            sub, i = parse_obj(text, i); res[key] = sub if sub else True
+        key = m.group(1); i = m.end()
+        if i < end and text[i] == '{':
+            sub, i = parse_obj(text, i, end); res[key] = sub if sub else True
         else:
-            m2 = re.match(r'(true|false)', text[i:])
-            if m2: res[key] = m2.group(1) == 'true'; i += m2.end()
+            m2 = BOOL.match(text, i, end)
+            if m2: res[key] = m2.group(1) == 'true'; i = m2.end()
             else:
                 j = i
-                while j < len(text) and text[j] not in ',}': j += 1
+                while j < end and text[j] not in ',}': j += 1
                 i = j; res[key] = True
     return res, i
 
@@ -51,66 +61,55 @@ def norm(d):
     return {k: norm(v) for k, v in d.items() if v is not False} or True
 
 
-ENTITIES = set()
-for f in glob.glob(os.path.join(SRC, '**', '*.ts'), recursive=True):
-    s = read_text(f)
-    if '@Entity(' in s or '@ChildEntity(' in s:
-        ENTITIES.update(m.group(1) for m in CLASSRE.finditer(s))
-if not ENTITIES:
-    raise SystemExit(f"no entities found under {SRC} - is API_SRC pointing at the source tree?")
+INDEX = shared(SRC)
+PLAN = incremental.load_plan()
 
-sites = []
-for f in sorted(glob.glob(os.path.join(SRC, '**', '*.ts'), recursive=True)):
-    if '__tests__' in f or '.spec.' in f: continue
+
+def scanned(f):
+    """Whether a file is scanned for load sites at all."""
     # Test infrastructure is not a load site of the application: it creates the schema and
     # builds fixtures, but never runs in the request path.
-    if f.endswith('projection-test.util.ts'): continue
-    raw = read_text(f)
-    if not READ.search(raw): continue
-    s = classify.strip_line_comments(raw)
+    return not ('__tests__' in f or '.spec.' in f or f.endswith('projection-test.util.ts'))
+
+
+def scan_file(f):
+    """Every load site in one file, in source order."""
+    e = INDEX.get(f)
+    s = e['text']
+    # The reading calls (`tsparse.READ_CALL`), found once per file by the index.
+    # save/update/delete are write paths and deliberately absent.
+    reads = [ev for ev in e['events'] if ev[1] == READ]
+    if not reads: return []
     rel = rel_path(SRC, f)
+    sites = []
 
-    classes = [(m.start(), m.group(1)) for m in CLASSRE.finditer(s)]
-    # Control structures look like method signatures - filter them out
-    KW = {'if','for','while','switch','catch','return','do','else','try','constructor'}
-    # All-caps identifiers are SQL keywords from template literals, not methods:
-    # `CASE WHEN ... THEN (` matched the signature rule and entered the inventory as a
-    # supposed method named `THEN`.
-    methods = [(m.start(), m.group(1)) for m in SIG.finditer(s)
-               if m.group(1) not in KW and not m.group(1).isupper()]
-    def enclosing(pos, lst):
-        cur = None
-        for p, n in lst:
-            if p < pos: cur = n
-            else: break
-        return cur
+    classes = IntervalIndex(e['classes'])
+    # Control structures are already out of the index's method list. All-caps identifiers are
+    # SQL keywords from template literals, not methods: `CASE WHEN ... THEN (` matched the
+    # signature rule and entered the inventory as a supposed method named `THEN`.
+    methods = IntervalIndex((p, n) for p, n, _ in e['signatures'] if not n.isupper())
 
     # field -> type (file-wide; collisions are harmless here, this is a local attribution)
-    inj = {}
-    for mm in re.finditer(r'(?:private|public|protected)\s+(?:readonly\s+)?(\w+)\s*:\s*(\w+)', s):
-        inj[mm.group(1)] = mm.group(2)
-    for mm in re.finditer(r'@InjectRepository\((\w+)\)\s*(?:private|public|protected)?\s*(?:readonly\s+)?(\w+)', s):
-        inj[mm.group(2)] = mm.group(1) + 'Repository'
-
-    for m in READ.finditer(s):
-        call = m.group(1)
-        pre = s[max(0, m.start() - 80):m.start()]
-        cls = enclosing(m.start(), classes)
-        meth = enclosing(m.start(), methods)
-        line = s[:m.start()].count('\n') + 1
+    inj = injected(e['events'])
+
+    for start, _, end, call in reads:
+        pre = max(0, start - 80)
+        cls = classes.at(start)
+        meth = methods.at(start)
+        line, col = line_col(e['lines'], start)
 
         # Resolve the target: this.<field>.<call>()  |  this.<call>()  |  <var>.<call>()
         entity, via = None, None
-        tm = re.search(r'this\.(\w+)\s*$', pre)
+        tm = THIS_FIELD.search(s, pre, start)
         if tm:
             t = inj.get(tm.group(1), '')
             via = tm.group(1)
             if t.endswith('Repository') and t[:-10] in ENTITIES: entity = t[:-10]
             elif t in ENTITIES: entity = t
-        elif re.search(r'this\s*$', pre) and cls and cls.endswith('Repository'):
+        elif THIS.search(s, pre, start) and cls and cls.endswith('Repository'):
             via, entity = 'this', cls[:-10] if cls[:-10] in ENTITIES else None
         else:
-            vm = re.search(r'(\w+)\s*$', pre)
+            vm = RECEIVER.search(s, pre, start)
             if vm: via = vm.group(1)
 
         # Mechanism: eager or projected
@@ -121,11 +120,11 @@ for f in sorted(glob.glob(os.path.join(SRC, '**', '*.ts'), recursive=True)):
 
         # relations tree, if written at the call site
         tree = None
-        tail = s[m.end():m.end() + 4000]
-        rm = re.search(r'relations\s*:\s*\{', tail)
-        if rm and rm.start() < 600:
+        window = min(end + 4000, len(s))
+        rm = RELATIONS.search(s, end, window)
+        if rm and rm.start() - end < 600:
             try:
-                t2, _ = parse_obj(tail, rm.end() - 1)
+                t2, _ = parse_obj(s, rm.end() - 1, window)
                 if t2: tree = norm(t2)
             except Exception as exc:
                 # An unreadable relations tree must not abort the scan - the load site still
@@ -137,26 +136,68 @@ for f in sorted(glob.glob(os.path.join(SRC, '**', '*.ts'), recursive=True)):
         # per-endpoint walk in endpoint_eff.py has to make, so it lives in classify.py.
         select, detail = None, {}
         if call == 'createQueryBuilder':
-            select = classify.select_kind(s, m.start(), m.end())
+            select = classify.select_kind(s, start, end, e['tokens'])
             # What it actually selects, where that is decidable - otherwise the measurement
             # reports the width the query was narrowed away from.
-            detail = classify.selected_columns(s, m.start(), m.end(), select)
+            detail = classify.selected_columns(s, start, end, select, e['tokens'])
 
-        # Offset of the call within its line, so a later stage can anchor on this call rather
-        # than on whichever one comes first on a line carrying several.
-        col = m.start() - (s.rfind('\n', 0, m.start()) + 1)
+        # `col` is the offset of the call within its line, so a later stage can anchor on this
+        # call rather than on whichever one comes first on a line carrying several.
         sites.append({'file': rel, 'line': line, 'col': col, 'cls': cls, 'method': meth,
                       'call': call, 'kind': kind, 'entity': entity, 'via': via,
                       'relations': tree, 'select': select, **detail})
+    return sites
+
+
+def entity_names(f):
+    e = INDEX.get(f)
+    return [name for _, name in e['classes']] if e['entity'] else None
+
+
+def entity_classes(rels):
+    """Entity class names by `src/...` file, for the files among rels that still exist."""
+    rels = [r for r in rels if INDEX.source.exists(src_path(SRC, r))]
+    found = pool.map_files(entity_names, [src_path(SRC, r) for r in rels], INDEX)
+    return {rel: names for rel, names in zip(rels, found) if names is not None}
+
+
+names = lambda by_file: {n for v in by_file.values() for n in v}
+if PLAN:
+    before = PLAN.previous('entities.json')
+    BY_FILE = {r: v for r, v in before.items() if not PLAN.touches(r)}
+    BY_FILE.update(entity_classes(PLAN.changed))
+    if names(BY_FILE) != names(before):
+        # Every site resolves its target against the whole set - one entity added or removed
+        # can change the resolution in files that did not change themselves.
+        print("the set of entity classes changed - scanning every file")
+        PLAN = None
+if not PLAN:
+    BY_FILE = entity_classes(rel_path(SRC, f) for f in INDEX.paths())
+ENTITIES = names(BY_FILE)
+if not ENTITIES:
+    raise SystemExit(f"no entities found under {SRC} - is API_SRC pointing at the source tree?")
+
+if PLAN:
+    # Merge: the previous run's sites of every untouched file, a fresh scan of the changed ones.
+    # A stable sort by file keeps each file's sites in source order, as a full scan emits them.
+    sites = [x for x in PLAN.previous('sites.json') if not PLAN.touches(x['file'])]
+    files = [f for f in map(lambda r: src_path(SRC, r), sorted(PLAN.changed))
+             if INDEX.source.exists(f) and scanned(f)]
+    sites += [x for found in pool.map_files(scan_file, files, INDEX) for x in found]
+    sites.sort(key=lambda x: x['file'])
+else:
+    files = [f for f in INDEX.paths() if scanned(f)]
+    sites = [x for found in pool.map_files(scan_file, files, INDEX) for x in found]
 
 if not sites:
     raise SystemExit(f"no load sites found under {SRC} - the scan produced nothing to measure")
 
-with open(SP + '/sites.json', 'w') as fh:
-    json.dump(sites, fh, indent=1)
+workdir.save('sites.json', sites)
+workdir.save('entities.json', BY_FILE)
 from collections import Counter
 print(f"load sites found: {len(sites)}")
 print("  by mechanism:", dict(Counter(s['kind'] for s in sites)))
 print(f"  with resolvable entity: {sum(1 for s in sites if s['entity'])}")
 print(f"  of those with relations tree: {sum(1 for s in sites if s['relations'])}")
 print(f"  files: {len({s['file'] for s in sites})}")
+print(INDEX.report())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Where the stages read `src/` from: the working tree, or any commit straight from git.
+
+Every stage finds its files through `paths()` and reads them through `read_text(path)`, so
+what lies under `$API_SRC` can come from a checkout or from the object database. With
+`INVENTORY_REF=<ref>` in the environment the `.ts` files are those of `src/` at that commit,
+listed by one `git ls-tree` and read through a single long-lived `git cat-file --batch`
+process. A historical or drift run then needs no worktree of 2,000+ files: `$API_SRC` only
+has to be the `src/` directory of some clone of the repository, whatever is checked out there.
+
+Paths keep the form `<API_SRC>/...` either way, so `rel_path`, `src_path` and everything that
+keys on a `src/...` path are the same for both.
+"""
+import glob, os, subprocess, threading
+
+import stageprof
+from tsparse import FILES, read_text
+
+
+class WorkTree:
+    """The `.ts` files on disk under src."""
+
+    def __init__(self, src):
+        self.src = src
+        self._paths = None
+
+    def paths(self):
+        """Every `.ts` file under the tree, sorted. Globbed once."""
+        if self._paths is None:
+            self._paths = sorted(glob.glob(os.path.join(self.src, '**', '*.ts'), recursive=True))
+        return self._paths
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def refresh(self):
+        """Glob again on the next `paths()`: files were added or removed."""
+        self._paths = None
+
+    def read_text(self, path):
+        text = read_text(path)
+        if stageprof.ACTIVE:
+            stageprof.read(os.path.getsize(path))
+        return text
+
+    def describe(self):
+        return self.src
+
+
+class GitTree:
+    """The `.ts` files under src as they are at ref, read from the object database."""
+
+    def __init__(self, src, ref):
+        self.src, self.ref = src.rstrip('/'), ref
+        r = subprocess.run(['git', '-C', src, 'rev-parse', '--show-toplevel'], capture_output=True, text=True)
+        if r.returncode != 0:
+            raise SystemExit(f"INVENTORY_REF is set, but {src} is not inside a git checkout")
+        self.top = r.stdout.strip()
+        prefix = os.path.relpath(os.path.realpath(src), os.path.realpath(self.top))
+        prefix = '' if prefix == '.' else prefix + '/'
+        r = subprocess.run(['git', '-C', self.top, 'ls-tree', '-r', '-z', '--full-tree', ref, '--', prefix or '.'],
+                           capture_output=True, text=True)
+        if r.returncode != 0:
+            raise SystemExit(f"git ls-tree {ref} failed in {self.top}: {r.stderr.strip() or 'unknown error'}")
+        self._blobs = {}
+        for entry in r.stdout.split('\0'):
+            if not entry: continue
+            meta, name = entry.split('\t', 1)
+            mode, kind, sha = meta.split()
+            # Regular files only: a symlink's blob is its target's name, not TypeScript.
+            if kind == 'blob' and mode in ('100644', '100755') and name.endswith('.ts'):
+                self._blobs[f'{self.src}/{name[len(prefix):]}'] = sha
+        if not self._blobs:
+            raise SystemExit(f"no .ts files under {prefix or '.'} at {ref} in {self.top}")
+        self._paths = sorted(self._blobs)
+        self._batch, self._pid = None, None
+        self._lock = threading.Lock()
+
+    def paths(self):
+        return self._paths
+
+    def exists(self, path):
+        return path in self._blobs
+
+    def read_text(self, path):
+        sha = self._blobs.get(path)
+        if sha is None:
+            raise FileNotFoundError(f"{path} is not a .ts file at {self.ref}")
+        with self._lock:
+            # A forked pool worker inherits the parent's pipe; sharing it would interleave
+            # requests, so every process talks to a `cat-file` of its own.
+            if self._pid != os.getpid():
+                self._batch = subprocess.Popen(['git', '-C', self.top, 'cat-file', '--batch'],
+                                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                self._pid = os.getpid()
+            self._batch.stdin.write(sha.encode() + b'\n')
+            self._batch.stdin.flush()
+            header = self._batch.stdout.readline().split()
+            if len(header) != 3:
+                raise SystemExit(f"git cat-file could not read {path} at {self.ref}: {b' '.join(header).decode()}")
+            data = self._batch.stdout.read(int(header[2]) + 1)[:-1]
+        if stageprof.ACTIVE:
+            stageprof.read(len(data))
+        # As `open()` in text mode reads it from disk: every line ending becomes `\n`.
+        return data.decode('utf-8', errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+
+    def describe(self):
+        return f"{self.src} at {self.ref}"
+
+
+_SHARED = {}
+
+
+def provider(src):
+    """The source of src for this process: the commit `INVENTORY_REF` names, else the disk."""
+    ref = os.environ.get('INVENTORY_REF') or None
+    key = (os.path.realpath(src), ref)
+    if key not in _SHARED:
+        _SHARED[key] = GitTree(src, ref) if ref else WorkTree(src)
+    return _SHARED[key]
+
+
+def release():
+    """Drop the shared providers, so the next run in this process lists the tree again, and
+    what was read through them."""
+    _SHARED.clear()
+    FILES.clear()
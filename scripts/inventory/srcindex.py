@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""Persistent source index shared by every stage.
+
+`sites.py`, `endpoint_eff.py` and the three controller readers each used to glob `src/`, read
+every file and strip its comments again - the same ~2,250 files parsed five times per run, and
+all of it again on the next run of an unchanged tree. The index parses a file once into what
+the stages need and keeps the result on disk under the hash of the file's content, so a stage
+that finds an entry reuses it, and a second run over an unchanged tree parses nothing.
+
+An entry is parsed in parts. `core` is parsed for every file read through the index:
+  comments     [(start, end)] of every line comment (`tsparse.line_comments`)
+  lines        offset of the start of every line in `text`
+  classes      [(pos, name)] of every `export class`
+  signatures   [(pos, name, end)] of every method signature, `end` where its match ends
+  events       `tsparse.scan_events` of `text`: every repository read and every typed field, in order
+  entity       whether the file declares an `@Entity`/`@ChildEntity`
+  decorated    whether the file names `@Controller` or `@DfxCron` at all
+
+Every other part is parsed when a stage first asks for one of its keys, and then kept like the
+core. A cold run pays only for what its stages read: the site scan wants method bodies of no
+file and tokens only of a file with a query builder, and the route tables want the decorators
+of the hundred-odd controllers, not of two thousand files.
+  tokens       the `tsparse.Tokens` stream of `text`
+  methods      [(pos, name, body_open, body_close)] of every signature; -1 without a body
+  chains       [(start, end, chain_end)] of every `.createQueryBuilder(`, to the end of its statement
+  controllers  [(pos, argument, class)] of every `@Controller(`, read from the unstripped source
+  routes       [(pos, verb, path, decorator block, handler)] of every route decorator, likewise
+  crons        [(line, class, handler, argument)] of every `@DfxCron(`, likewise
+  idents       every identifier in the unstripped source
+  calls        every identifier followed by `(` - a call, or a declaration that looks like one
+
+The entry also holds `text`, the source with those comments cut (`tsparse.strip_line_comments`).
+It is cut from the source again on every read rather than kept: it would double what the cache
+holds. Positions in `tokens`, `classes`, `signatures`, `methods`, `events` and `chains` refer to
+`text`; `controllers` and `routes` refer to the unstripped source, because that is what the
+route scan has always read. A file that is not `decorated` has no controllers, routes or crons
+and is not parsed for them. `idents` and `calls` feed the `IdentifierIndex`, which answers
+"which files name X" without a text search.
+
+The cache is `index.sqlite` in `$INVENTORY_CACHE` (default `~/.cache/dfx-inventory`), a row per
+part of an entry. It is keyed on content only, so it is safe to share between checkouts - bump
+INDEX_VERSION whenever what a part holds changes. Each process that opens it prunes it first:
+the parts of another INDEX_VERSION are dropped, and past INDEX_KEEP_BYTES those used longest
+ago. A row records the day it was last read, rewritten at most once a day.
+"""
+import hashlib, os, pickle, re, shutil, sqlite3, threading, time
+
+import source
+import stageprof
+from tsparse import (CLASS, CRON, CTRL_START, FILES, HTTP, READ, SIG, IntervalIndex, Tokens,
+                     block_and_handler, controller_arg, cut, in_literal, line_col, line_comments,
+                     line_starts, method_body, scan_events, scope_path, skip_args)
+
+INDEX_VERSION = 8
+# The layout of the cache database; another layout's is dropped and rebuilt.
+SCHEMA = 2
+# Bytes of parts kept. An index of all of `src/` holds about 12MB, and a branch adds only the
+# files it changed, so this keeps several trees; past it the parts used longest ago go first.
+INDEX_KEEP_BYTES = 64 << 20
+
+# The keys of each part of an entry.
+PARTS = {
+    'core': ('comments', 'lines', 'classes', 'signatures', 'events', 'entity', 'decorated'),
+    'tokens': ('tokens',),
+    'bodies': ('methods', 'chains'),
+    'decorators': ('controllers', 'routes', 'crons'),
+    'names': ('idents', 'calls'),
+}
+PART_OF = {key: part for part, keys in PARTS.items() for key in keys}
+UNDECORATED = {'controllers': [], 'routes': [], 'crons': []}
+
+# Signatures that are control structures, not methods. The constructor has a body but is never
+# a route handler or a load path of its own.
+NOT_METHODS = frozenset({'if', 'for', 'while', 'switch', 'catch', 'return', 'do', 'else', 'try',
+                         'constructor'})
+# `\w+` rather than a JavaScript identifier: a token then ends exactly where a `\b` would, so a
+# lookup of `name` in `calls` answers precisely what `\bname\s*\(` searched for.
+TOKEN = re.compile(r'(\w+)(\s*\()?')
+
+
+def cache_dir():
+    """Root of the on-disk caches, shared by every stage and every run."""
+    return os.environ.get('INVENTORY_CACHE') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'dfx-inventory')
+
+
+def parse(raw):
+    """The core of the index entry for one file's content. Pure: the same content always
+    yields the same entry."""
+    comments = line_comments(raw)
+    text = cut(raw, comments)
+    return {
+        'comments': comments,
+        'lines': line_starts(text),
+        'classes': [(m.start(), m.group(1)) for m in CLASS.finditer(text)],
+        'signatures': [(m.start(), m.group(1), m.end()) for m in SIG.finditer(text)
+                       if m.group(1) not in NOT_METHODS],
+        'events': scan_events(text),
+        'entity': '@Entity(' in raw or '@ChildEntity(' in raw,
+        'decorated': '@Controller' in raw or '@DfxCron' in raw,
+    }
+
+
+def parse_tokens(entry):
+    return {'tokens': Tokens(entry['text'])}
+
+
+def parse_bodies(entry):
+    chains = [(pos, end) for pos, kind, end, call, *_ in entry['events']
+              if kind == READ and call == 'createQueryBuilder']
+    if not entry['signatures'] and not chains:
+        return {'methods': [], 'chains': []}  # nothing to match: leave the file unlexed
+    text, tokens = entry['text'], entry['tokens']
+    return {
+        'methods': [(pos, name, *method_body(text, end, tokens)) for pos, name, end in entry['signatures']],
+        'chains': [(pos, end, tokens.statement_end(end)) for pos, end in chains],
+    }
+
+
+def parse_decorators(entry):
+    raw = entry.raw
+    tokens = Tokens(raw)
+    controllers, routes, crons = [], [], []
+    if '@Controller' in raw:
+        for m in CTRL_START.finditer(raw):
+            km = re.search(r'export\s+class\s+(\w+)', raw[m.end():m.end() + 400])
+            controllers.append((m.start(), controller_arg(raw, m.end() - 1, tokens),
+                                km.group(1) if km else None))
+        for m in HTTP.finditer(raw):
+            block, handler = block_and_handler(raw, m.end(), tokens)
+            routes.append((m.start(), m.group(1), m.group(2), block, handler))
+    if '@DfxCron' in raw:
+        classes = IntervalIndex((m.start(), m.group(1)) for m in CLASS.finditer(raw))
+        starts = line_starts(raw)
+        for m in CRON.finditer(raw):
+            if in_literal(tokens, m.start()): continue
+            end = skip_args(raw, m.end() - 1, tokens)
+            _, handler = block_and_handler(raw, end, tokens)
+            crons.append((line_col(starts, m.start())[0], classes.at(m.start()), handler,
+                          raw[m.end():end - 1].strip()))
+    return {'controllers': controllers, 'routes': routes, 'crons': crons}
+
+
+def parse_names(entry):
+    idents, calls = set(), set()
+    for m in TOKEN.finditer(entry.raw):
+        idents.add(m.group(1))
+        if m.group(2): calls.add(m.group(1))
+    return {'idents': frozenset(idents), 'calls': frozenset(calls)}
+
+
+PARSERS = {'core': lambda entry: parse(entry.raw), 'tokens': parse_tokens, 'bodies': parse_bodies,
+           'decorators': parse_decorators, 'names': parse_names}
+
+
+class Entry(dict):
+    """The index entry of one file: the parts read so far, by key. A key of a part not read yet
+    reads that part - from the cache, or parsed - on first use."""
+
+    def __init__(self, index, path, raw, digest):
+        super().__init__()
+        self.index, self.path, self.raw, self.digest = index, path, raw, digest
+
+    def __missing__(self, key):
+        if key not in PART_OF:
+            raise KeyError(key)
+        self.update(self.index.part(self, PART_OF[key]))
+        return dict.__getitem__(self, key)
+
+
+def controller_scopes(entry):
+    """`tsparse.controller_scopes` of an indexed file: an `IntervalIndex` of (base path, class
+    name)."""
+    return IntervalIndex((pos, (scope_path(arg), cls)) for pos, arg, cls in entry['controllers'])
+
+
+class SourceIndex:
+    """The parsed source tree under `src`, backed by the content-addressed cache.
+
+    Files are listed and read through `source.provider`, so the tree may be a checkout or a
+    commit read from git.
+    """
+
+    def __init__(self, src, cache=None):
+        self.src = src
+        self.source = source.provider(src)
+        self.db_path = os.path.join(cache or cache_dir(), 'index.sqlite')
+        self._db, self._db_pid = None, None
+        self._lock = threading.Lock()
+        self._today = int(time.time() // 86400)
+        self._entries = {}
+        self.parsed = 0
+        self.reused = 0
+
+    def paths(self):
+        """Every `.ts` file under the source tree, sorted. Listed once per index."""
+        return self.source.paths()
+
+    def get(self, path):
+        """Index entry of the file at path."""
+        entry = self._entries.get(path)
+        if entry is None:
+            raw = self.source.read_text(path)
+            digest = hashlib.sha1(f'{INDEX_VERSION}\0{raw}'.encode('utf-8', 'surrogatepass')).hexdigest()
+            entry = self._entries[path] = Entry(self, path, raw, digest)
+            entry.update(self.part(entry, 'core'))
+            entry['text'] = cut(raw, entry['comments'])
+            # The stripped text is what `tsparse.stripped` hands out, so a later stage of the
+            # process that wants only that finds it there.
+            FILES.put((self.source, path), (entry['text'], entry['lines']))
+        return entry
+
+    def refresh(self, paths):
+        """Forget what was read of paths, which changed on disk, and the listing of the tree.
+        For a working tree only: a commit does not change."""
+        for p in paths:
+            self._entries.pop(p, None)
+        FILES.discard((self.source, p) for p in paths)
+        self.source.refresh()
+
+    def part(self, entry, name):
+        """The part name of entry, from the cache or parsed and kept there."""
+        if name == 'decorators' and not entry['decorated']:
+            return UNDECORATED
+        data = self._fetch(entry.digest, name)
+        if data is not None:
+            try:
+                part = pickle.loads(data)
+                if name == 'core':
+                    self.reused += 1
+                return part
+            except (EOFError, pickle.UnpicklingError):
+                pass
+        t0 = time.perf_counter()
+        part = PARSERS[name](entry)
+        if stageprof.ACTIVE:
+            stageprof.took(time.perf_counter() - t0, entry.path, 'parse' if name == 'core' else f'parse {name}')
+        if name == 'core':
+            self.parsed += 1
+        self._keep(entry.digest, name, pickle.dumps(part, protocol=pickle.HIGHEST_PROTOCOL))
+        return part
+
+    def _connect(self):
+        """The cache database, opened once per process - a pool worker opens its own rather than
+        use the connection it forked with - or None if it cannot be opened."""
+        if self._db_pid != os.getpid():
+            self._db, self._db_pid = None, os.getpid()
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                db = sqlite3.connect(self.db_path, timeout=60, isolation_level=None, check_same_thread=False)
+                # One row per part, appended to the write-ahead log: creating a file per part
+                # cost more than parsing it. Unsynced - a lost write is parsed again.
+                db.execute('PRAGMA journal_mode=WAL')
+                db.execute('PRAGMA synchronous=OFF')
+                db.execute('BEGIN IMMEDIATE')
+                try:
+                    if db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA:
+                        db.execute('DROP TABLE IF EXISTS parts')
+                        db.execute('CREATE TABLE parts (digest TEXT, part TEXT, version INTEGER, '
+                                   'used INTEGER, data BLOB, PRIMARY KEY (digest, part)) WITHOUT ROWID')
+                        db.execute('CREATE INDEX parts_used ON parts (version, used)')
+                        db.execute(f'PRAGMA user_version = {SCHEMA}')
+                    self._prune(db)
+                    db.execute('COMMIT')
+                except sqlite3.Error:
+                    db.execute('ROLLBACK')
+                    raise
+                self._db = db
+            except sqlite3.Error:
+                pass
+            # The pickles of the index before it was a database.
+            shutil.rmtree(os.path.join(os.path.dirname(self.db_path), 'index'), ignore_errors=True)
+        return self._db
+
+    def _prune(self, db):
+        db.execute('DELETE FROM parts WHERE version != ?', (INDEX_VERSION,))
+        # What the parts hold, not the size of the file: freed pages are reused by later parts
+        # rather than returned, so the file stays as large as it once grew.
+        excess = db.execute('SELECT total(length(data)) FROM parts').fetchone()[0] - INDEX_KEEP_BYTES
+        if excess <= 0:
+            return
+        # A quarter below the limit, so the next run does not prune again.
+        excess += INDEX_KEEP_BYTES // 4
+        old = []
+        for digest, name, size in db.execute('SELECT digest, part, length(data) FROM parts '
+                                             'WHERE version = ? ORDER BY used', (INDEX_VERSION,)):
+            old.append((digest, name))
+            excess -= size
+            if excess <= 0:
+                break
+        db.executemany('DELETE FROM parts WHERE digest = ? AND part = ?', old)
+
+    def _fetch(self, digest, name):
+        with self._lock:
+            db = self._connect()
+            try:
+                row = db and db.execute('SELECT data, used FROM parts WHERE digest = ? AND part = ?',
+                                        (digest, name)).fetchone()
+                if row and row[1] < self._today:
+                    db.execute('UPDATE parts SET used = ? WHERE digest = ? AND part = ?',
+                               (self._today, digest, name))
+            except sqlite3.Error:
+                return None
+        return row[0] if row else None
+
+    def _keep(self, digest, name, data):
+        # A cache that cannot be written costs speed, never the run.
+        with self._lock:
+            db = self._connect()
+            try:
+                if db:
+                    db.execute('INSERT OR REPLACE INTO parts VALUES (?, ?, ?, ?, ?)',
+                               (digest, name, INDEX_VERSION, self._today, data))
+            except sqlite3.Error:
+                pass
+
+    def report(self):
+        return (f"source index of {self.source.describe()}: {self.parsed} files parsed, "
+                f"{self.reused} reused from {self.db_path}")
+
+
+_SHARED = {}
+
+
+def shared(src):
+    """The index of src for this process. Stages that run in one process (`inventory.py run`)
+    share it, so a file one of them read is not looked up on disk again by the next."""
+    key = (os.path.realpath(src), os.environ.get('INVENTORY_REF') or None, cache_dir())
+    if key not in _SHARED:
+        _SHARED[key] = SourceIndex(src)
+    return _SHARED[key]
+
+
+def release():
+    """Drop the shared indexes and sources, so the next run in this process sees the tree as
+    it is now."""
+    _SHARED.clear()
+    source.release()
+
+
+class IdentifierIndex:
+    """Inverted index from identifier to the files that contain it, over a set of files.
+
+    Built in one pass over entries the source index already holds, so a question such as
+    "which specs name this controller and call this handler" is a set intersection rather than
+    a regex compiled per question and run over every file's text.
+    """
+
+    def __init__(self, index, paths):
+        self.names, self.calls = {}, {}
+        for f in paths:
+            e = index.get(f)
+            for name in e['idents']:
+                self.names.setdefault(name, set()).add(f)
+            for name in e['calls']:
+                self.calls.setdefault(name, set()).add(f)
+
+    def naming(self, name):
+        """Files that contain the identifier name anywhere."""
+        return self.names.get(name, set())
+
+    def calling(self, name):
+        """Files in which name is followed by an opening parenthesis."""
+        return self.calls.get(name, set())
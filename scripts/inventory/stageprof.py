@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""Where a run spends its time, step by step: `inventory.py run --profile`.
+
+`done in 4.2s` per step says which step is slow, not why. With `--profile` every step that runs
+is measured and the run leaves `$INVENTORY_WORK/profile.json`:
+
+  wall_s, cpu_s         the step's own wall clock and CPU time; `cpu_children_s` is that of
+                        the processes it waited for (pool workers, git)
+  peak_rss_kb           the highest resident set the step reached - of this process for an
+                        in-process step (`peak_rss_scope: step`; `process` where the kernel
+                        does not let the mark be reset), of the child for `measure`
+  files_read, bytes_read  what the step read of `src/`, through `source.py`
+  regex_matches         matches per module-level pattern of the shared modules, by where it
+                        is defined (`tsparse.SIG`)
+  slowest_files         the files that took longest: `parse` in the source index, and the
+                        stage's own per-file function (`scan_file`, `file_facts`, ...)
+  phases                where a step marks them (`mark`), the time of each part of it -
+                        `endpoint_eff` reports its call-graph propagation this way
+  measure               how long `measure.js` spent in `buildMetadatas()` against building
+                        the per-site queries
+
+`--profile-dump` also writes a cProfile dump per in-process step to `$INVENTORY_WORK/profile/`
+(`python3 -m pstats profile/sites.prof`, or any viewer that reads pstats files).
+
+None of this costs anything without `--profile`: every hook checks `ACTIVE` first. With it,
+the patterns are wrapped to count their matches, which slows the lexer down noticeably - the
+timings are for comparing steps and runs, not for quoting as the chain's speed.
+"""
+import ast, cProfile, collections, importlib, json, os, re, resource, sys, threading, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Files listed per step under `slowest_files`.
+SLOWEST = 10
+
+ACTIVE = False
+_DUMP = None
+_PATTERNS = False
+_current = threading.local()
+_regex = collections.Counter()
+_read = [0, 0]          # files, bytes
+_times = []             # (seconds, path, what)
+_child_cpu = [0.0]      # CPU of the children `child` was told about, reaped by `node`
+_records = []
+
+
+class CountingPattern:
+    """A compiled pattern that counts its matches under a name."""
+
+    __slots__ = ('pattern', 'name')
+
+    def __init__(self, pattern, name):
+        self.pattern, self.name = pattern, name
+
+    def __getattr__(self, attr):
+        return getattr(self.pattern, attr)
+
+    def search(self, *args):
+        m = self.pattern.search(*args)
+        if m is not None: _regex[self.name] += 1
+        return m
+
+    def match(self, *args):
+        m = self.pattern.match(*args)
+        if m is not None: _regex[self.name] += 1
+        return m
+
+    def fullmatch(self, *args):
+        m = self.pattern.fullmatch(*args)
+        if m is not None: _regex[self.name] += 1
+        return m
+
+    def finditer(self, *args):
+        for m in self.pattern.finditer(*args):
+            _regex[self.name] += 1
+            yield m
+
+    def findall(self, *args):
+        found = self.pattern.findall(*args)
+        _regex[self.name] += len(found)
+        return found
+
+    def sub(self, repl, string, count=0):
+        out, n = self.pattern.subn(repl, string, count)
+        _regex[self.name] += n
+        return out
+
+    def subn(self, repl, string, count=0):
+        out, n = self.pattern.subn(repl, string, count)
+        _regex[self.name] += n
+        return out, n
+
+
+def _instrument():
+    """Wrap every module-level pattern the loaded inventory modules hold.
+
+    Only those: the `re` module itself is left alone, so nothing outside the inventory - nor a
+    pattern a stage script compiles at its own top level, or passes to `re.search` as a string -
+    is rerouted or counted."""
+    wrapped = {}
+    for mod in list(sys.modules.values()):
+        if not _ours(mod):
+            continue
+        with open(mod.__file__) as fh:
+            defined = set(re.findall(r'^([A-Za-z_]\w*)\s*=', fh.read(), re.M))
+        for name, v in list(vars(mod).items()):
+            if isinstance(v, re.Pattern):
+                proxy = wrapped.setdefault(id(v), CountingPattern(v, f'{mod.__name__}.{name}'))
+                if name in defined:     # named where it is defined, not where it is imported
+                    proxy.name = f'{mod.__name__}.{name}'
+                setattr(mod, name, proxy)
+            elif isinstance(v, dict) and v and all(isinstance(p, re.Pattern) for p in v.values()):
+                setattr(mod, name, {k: CountingPattern(p, f'{mod.__name__}.{name}[{k}]') for k, p in v.items()})
+
+
+def preload(script):
+    """Import the inventory modules script imports, anywhere in it, and wrap their patterns -
+    before it runs, since a module it loads itself comes in unwrapped."""
+    if not (ACTIVE and _PATTERNS):
+        return
+    with open(script) as fh:
+        tree = ast.parse(fh.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [a.name for a in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [node.module]
+        else:
+            continue
+        for name in (n.split('.')[0] for n in names):
+            if os.path.exists(os.path.join(HERE, name + '.py')):
+                importlib.import_module(name)
+    _instrument()
+
+
+def _ours(mod):
+    return (mod is not sys.modules[__name__] and
+            os.path.dirname(os.path.abspath(getattr(mod, '__file__', None) or '/')) == HERE)
+
+
+def start(dump=None, patterns=True):
+    """Profile every step from now on; with dump, leave a cProfile file per step there.
+
+    `patterns=False` leaves the regular expressions alone: no match counts, and timings that
+    are those of an unprofiled run - what `bench.py` wants.
+    """
+    global ACTIVE, _DUMP, _PATTERNS
+    if ACTIVE:
+        return
+    _records.clear()
+    _DUMP, _PATTERNS = dump, patterns
+    if dump:
+        os.makedirs(dump, exist_ok=True)
+    if patterns:
+        _instrument()
+    ACTIVE = True
+
+
+def stop():
+    """Stop profiling and put the patterns back as they were."""
+    global ACTIVE
+    if not ACTIVE:
+        return
+    ACTIVE = False
+    for mod in [m for m in list(sys.modules.values()) if _ours(m)]:
+        for name, v in list(vars(mod).items()):
+            if isinstance(v, CountingPattern):
+                setattr(mod, name, v.pattern)
+            elif isinstance(v, dict) and v and all(isinstance(p, CountingPattern) for p in v.values()):
+                setattr(mod, name, {k: p.pattern for k, p in v.items()})
+
+
+# -- what the stages report ---------------------------------------------------------------
+
+def read(nbytes):
+    """A file of src was read."""
+    _read[0] += 1
+    _read[1] += nbytes
+
+
+def took(seconds, path, what):
+    """One file took seconds in what."""
+    _times.append((seconds, path, what))
+
+
+def timed(fn):
+    """fn(path), recording how long each path took under fn's name."""
+    def run(path):
+        t0 = time.perf_counter()
+        out = fn(path)
+        _times.append((time.perf_counter() - t0, path, fn.__name__))
+        return out
+    return run
+
+
+def snapshot():
+    return _read[0], _read[1], collections.Counter(_regex), len(_times)
+
+
+def since(snap):
+    """What was counted after snap, as `merge` takes it - how a pool worker hands its share back."""
+    files, nbytes, regex, n = snap
+    return _read[0] - files, _read[1] - nbytes, _regex - regex, _times[n:]
+
+
+def merge(delta):
+    files, nbytes, regex, times = delta
+    _read[0] += files
+    _read[1] += nbytes
+    _regex.update(regex)
+    _times.extend(times)
+
+
+def mark(phase):
+    """The step this thread is running finished phase: the time since its previous mark (or
+    its start) is recorded under `phases`."""
+    record = getattr(_current, 'record', None)
+    if record is not None:
+        now = time.perf_counter()
+        record.setdefault('phases', {})[phase] = round(now - _current.mark, 3)
+        _current.mark = now
+
+
+def note(**values):
+    """Attach values to the record of the step this thread is running."""
+    record = getattr(_current, 'record', None)
+    if record is not None:
+        record.update(values)
+
+
+def child(usage):
+    """The step this thread is running waited for a child process; usage is its rusage."""
+    cpu = usage.ru_utime + usage.ru_stime
+    _child_cpu[0] += cpu
+    note(cpu_s=round(cpu, 3))
+    # A child's own `ru_maxrss` starts from the size of the process that forked it, so the
+    # peak is what the child reports of itself, where it does.
+    record = getattr(_current, 'record', None)
+    if record is not None and 'peak_rss_kb' not in record:
+        note(peak_rss_kb=usage.ru_maxrss, peak_rss_scope='process')
+
+
+# -- per step -------------------------------------------------------------------------------
+
+def _reset_peak():
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_kb():
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class step:
+    """`with step(name):` around a step's work. `in_process=False` for a child-process step,
+    which reports its own usage through `child`."""
+
+    def __init__(self, name, in_process=True):
+        self.name, self.in_process = name, in_process
+
+    def __enter__(self):
+        if not ACTIVE:
+            return self
+        self.record = {'step': self.name, 'status': 'ran'}
+        _current.record = self.record
+        if self.in_process:
+            self.scope = 'step' if _reset_peak() else 'process'
+            self.snap = snapshot()
+            self.cpu = time.process_time()
+            ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+            self.children = ru.ru_utime + ru.ru_stime - _child_cpu[0]
+            self.profiler = cProfile.Profile() if _DUMP else None
+            if self.profiler:
+                self.profiler.enable()
+        self.t0 = _current.mark = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if not ACTIVE:
+            return False
+        r = self.record
+        r['wall_s'] = round(time.perf_counter() - self.t0, 3)
+        if self.in_process:
+            if self.profiler:
+                self.profiler.disable()
+                r['cprofile'] = os.path.join(_DUMP, f'{self.name}.prof')
+                self.profiler.dump_stats(r['cprofile'])
+            ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+            r['cpu_s'] = round(time.process_time() - self.cpu, 3)
+            r['cpu_children_s'] = round(ru.ru_utime + ru.ru_stime - _child_cpu[0] - self.children, 3)
+            r['peak_rss_kb'], r['peak_rss_scope'] = _peak_kb(), self.scope
+            files, nbytes, regex, times = since(self.snap)
+            src = os.environ.get('API_SRC', '')
+            r.update(files_read=files, bytes_read=nbytes,
+                     regex_matches=dict(sorted(regex.items(), key=lambda kv: (-kv[1], kv[0]))),
+                     slowest_files=[{'file': os.path.relpath(p, os.path.dirname(src)) if src else p,
+                                     'work': what, 'seconds': round(s, 4)}
+                                    for s, p, what in sorted(times, key=lambda t: -t[0])[:SLOWEST]])
+        _current.record = None
+        _records.append(r)
+        return False
+
+
+def cached(name):
+    """A step whose output came from the step cache: listed, with nothing measured."""
+    if ACTIVE:
+        _records.append({'step': name, 'status': 'cached'})
+
+
+def child_command(script, record):
+    """The command that runs the stage script in a process of its own, profiled as this process
+    is, leaving its step record at record."""
+    if not ACTIVE:
+        return [sys.executable, script]
+    return [sys.executable, os.path.abspath(__file__), record, script, '1' if _PATTERNS else '0', _DUMP or '']
+
+
+def child_record(record):
+    """Attach what the stage measured in its own process, as `child_command` left it, to the
+    record of the step this thread is running."""
+    if ACTIVE and os.path.exists(record):
+        with open(record) as fh:
+            r = json.load(fh)
+        note(**{k: v for k, v in r.items() if k not in ('step', 'status', 'wall_s')})
+
+
+def write(path, **run):
+    """Write what was recorded, steps in the order they finished, to path."""
+    with open(path, 'w') as fh:
+        json.dump({'run': run, 'steps': _records}, fh, indent=1)
+    return list(_records)
+
+
+if __name__ == '__main__':
+    # `child_command`: one stage, profiled in this process, its record written out. Through the
+    # module the stages import, not this `__main__` copy of it.
+    import runpy
+    import stageprof
+    out, script, patterns, dump = sys.argv[1:5]
+    sys.argv = [script]
+    stageprof.start(dump or None, patterns=patterns == '1')
+    stageprof.preload(script)
+    with stageprof.step(os.path.splitext(os.path.basename(script))[0]):
+        runpy.run_path(script, run_name='__main__')
+    with open(out, 'w') as fh:
+        json.dump(stageprof._records[-1], fh)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""The inventory as a SQLite database, for questions the documents do not answer directly.
+
+"All load sites on `UserData` wider than 200 columns" or "which endpoints reach
+`LimitRequest`" used to mean grepping `docs/load-sites.md` or writing a script against
+`sites-measured.json`. This step writes `$INVENTORY_WORK/inventory.sqlite` with the run's
+tables, indexed for exactly those lookups, and `inventory.py query` asks it:
+
+  sites         every measured load site; `select_kind` is the `select` category of the JSON
+  endpoints     every route, as `endpoint_eff.py` summarised it; `kinds` is comma-separated,
+                `per_item` the call path to a query the handler runs once per element
+  methods       every method of the call graph, `complete` if each of its calls resolved
+  calls         the call graph's edges, method to method
+  method_sites  the load sites each method contains itself, by (file, line, col)
+  reach         per endpoint, every method its handler reaches - itself included
+  tables        per database table, the widest entity's column count
+  table_entities  the entities mapped onto each table
+
+`reach` is the transitive closure, computed here once from the condensed graph, so "which
+endpoints reach X" is a join rather than a recursive walk per question.
+
+    python3 inventory.py query <question> [arguments]     see `inventory.py query --help`
+"""
+import json, os, sqlite3, time
+
+import workdir
+from callgraph import CallGraph
+
+SCHEMA = '''
+CREATE TABLE sites (id INTEGER PRIMARY KEY, file TEXT, line INTEGER, col INTEGER, cls TEXT,
+                    method TEXT, call TEXT, kind TEXT, entity TEXT, via TEXT, select_kind TEXT,
+                    relations TEXT, projection TEXT, select_count INTEGER, cols INTEGER,
+                    joins INTEGER, error TEXT);
+CREATE TABLE endpoints (id INTEGER PRIMARY KEY, verb TEXT, path TEXT, controller TEXT,
+                        handler TEXT, file TEXT, version TEXT, internal INTEGER,
+                        deprecated INTEGER, kinds TEXT, complete INTEGER, manual TEXT,
+                        maxcol INTEGER, spec INTEGER, per_item TEXT);
+CREATE TABLE methods (id INTEGER PRIMARY KEY, cls TEXT, method TEXT, complete INTEGER);
+CREATE TABLE calls (caller INTEGER, callee INTEGER);
+CREATE TABLE method_sites (method INTEGER, file TEXT, line INTEGER, col INTEGER);
+CREATE TABLE reach (endpoint INTEGER, method INTEGER);
+CREATE TABLE tables (name TEXT PRIMARY KEY, cols INTEGER);
+CREATE TABLE table_entities (name TEXT, entity TEXT);
+
+CREATE INDEX sites_entity ON sites (entity, cols);
+CREATE INDEX sites_at ON sites (file, line, col);
+CREATE INDEX sites_owner ON sites (cls, method);
+CREATE INDEX endpoints_route ON endpoints (verb, path);
+CREATE INDEX endpoints_handler ON endpoints (controller, handler);
+CREATE UNIQUE INDEX methods_name ON methods (cls, method);
+CREATE INDEX calls_caller ON calls (caller);
+CREATE INDEX calls_callee ON calls (callee);
+CREATE INDEX method_sites_method ON method_sites (method);
+CREATE INDEX method_sites_at ON method_sites (file, line, col);
+CREATE INDEX reach_endpoint ON reach (endpoint);
+CREATE INDEX reach_method ON reach (method);
+CREATE INDEX table_entities_entity ON table_entities (entity);
+'''
+
+# The canned questions: (arguments, help, SQL). Arguments bind in order.
+_ENDPOINT = 'e.verb, e.path, e.controller, e.handler, e.maxcol, e.kinds'
+_SITE = 's.file, s.line, s.cls, s.method, s.call, s.entity, s.cols, s.joins'
+QUERIES = {
+    'wide': (('entity', 'min_cols'), 'load sites on an entity wider than min_cols columns',
+             f'SELECT {_SITE} FROM sites s WHERE s.entity = ? AND s.cols > ? '
+             'ORDER BY s.cols DESC, s.file, s.line'),
+    'widest': (('min_cols',), 'load sites on any entity wider than min_cols columns',
+               f'SELECT {_SITE} FROM sites s WHERE s.cols > ? ORDER BY s.cols DESC, s.file, s.line'),
+    'reaching': (('entity',), 'endpoints that reach a load site on an entity',
+                 f'SELECT DISTINCT {_ENDPOINT} FROM sites s '
+                 'JOIN method_sites ms ON ms.file = s.file AND ms.line = s.line AND ms.col = s.col '
+                 'JOIN reach r ON r.method = ms.method JOIN endpoints e ON e.id = r.endpoint '
+                 'WHERE s.entity = ? ORDER BY e.path, e.verb'),
+    'callers': (('cls', 'method'), 'endpoints whose handler reaches a method',
+                f'SELECT DISTINCT {_ENDPOINT} FROM methods m JOIN reach r ON r.method = m.id '
+                'JOIN endpoints e ON e.id = r.endpoint WHERE m.cls = ? AND m.method = ? '
+                'ORDER BY e.path, e.verb'),
+    'sites-of': (('verb', 'path'), 'the load sites an endpoint reaches',
+                 f'SELECT DISTINCT {_SITE} FROM endpoints e JOIN reach r ON r.endpoint = e.id '
+                 'JOIN method_sites ms ON ms.method = r.method '
+                 'JOIN sites s ON s.file = ms.file AND s.line = ms.line AND s.col = ms.col '
+                 'WHERE e.verb = ? AND e.path = ? ORDER BY s.cols DESC, s.file, s.line'),
+    'table': (('table',), 'the entities mapped onto a table, with the load sites on each',
+              'SELECT te.entity, t.cols, COUNT(s.id) AS sites, MAX(s.cols) AS widest '
+              'FROM tables t JOIN table_entities te ON te.name = t.name '
+              'LEFT JOIN sites s ON s.entity = te.entity WHERE t.name = ? '
+              'GROUP BY te.entity ORDER BY te.entity'),
+    'per-item': ((), 'endpoints that run a query once per element of a collection (N+1)',
+                 f'SELECT {_ENDPOINT}, e.per_item FROM endpoints e WHERE e.per_item IS NOT NULL '
+                 'ORDER BY e.path, e.verb'),
+}
+
+
+def _flag(v):
+    return None if v is None else int(bool(v))
+
+
+def write(path, sites, endpoints, graph, tables):
+    """Write the database to path, replacing any file there."""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    db = sqlite3.connect(tmp)
+    db.executescript(SCHEMA)
+    db.executemany('INSERT INTO sites VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+        (s['file'], s['line'], s.get('col'), s.get('cls'), s.get('method'), s.get('call'),
+         s.get('kind'), s.get('entity'), s.get('via'), s.get('select'),
+         None if s.get('relations') is None else json.dumps(s['relations'], sort_keys=True),
+         s.get('projection'), s.get('select_count'), s.get('cols'), s.get('joins'), s.get('error'))
+        for s in sites])
+    db.executemany('INSERT INTO endpoints VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+        (e['verb'], e['path'], e['controller'], e['handler'], e.get('file'), e.get('version'),
+         _flag(e.get('internal')), _flag(e.get('deprecated')), ','.join(e.get('kinds', ())),
+         _flag(e.get('complete')), e.get('manual'), e.get('maxcol'), _flag(e.get('spec')),
+         e.get('per_item'))
+        for e in endpoints])
+    ids = {(m['cls'], m['method']): i for i, m in enumerate(graph, 1)}
+    db.executemany('INSERT INTO methods VALUES (?, ?, ?, ?)',
+                   [(ids[m['cls'], m['method']], m['cls'], m['method'], _flag(m['complete']))
+                    for m in graph])
+    db.executemany('INSERT INTO calls VALUES (?, ?)',
+                   [(ids[m['cls'], m['method']], ids[tuple(t)]) for m in graph for t in m['calls']])
+    db.executemany('INSERT INTO method_sites VALUES (?, ?, ?, ?)',
+                   [(ids[m['cls'], m['method']], *at) for m in graph for at in m['sites']])
+    cg = CallGraph(ids, {(m['cls'], m['method']): [tuple(t) for t in m['calls']] for m in graph})
+    reach = []
+    for i, e in enumerate(endpoints, 1):
+        key = (e['controller'], e['handler'])
+        if key in ids:
+            reach.extend((i, ids[n]) for n in cg.reachable(key))
+    db.executemany('INSERT INTO reach VALUES (?, ?)', reach)
+    db.executemany('INSERT INTO tables VALUES (?, ?)', [(n, t['cols']) for n, t in tables.items()])
+    db.executemany('INSERT INTO table_entities VALUES (?, ?)',
+                   [(n, ent) for n, t in tables.items() for ent in t['entities']])
+    db.commit()
+    db.close()
+    os.replace(tmp, path)
+    return len(reach)
+
+
+def query(path, name, args):
+    """(columns, rows, seconds) of a canned question against the database at path."""
+    if not os.path.exists(path):
+        raise SystemExit(f"{path} is missing - run `inventory.py run` first, or pass --db")
+    db = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        t0 = time.perf_counter()
+        if name == 'sql':
+            if not args:
+                raise SystemExit("sql takes a statement: sql <statement> [<parameter> ...]")
+            cur = db.execute(args[0], args[1:])
+        else:
+            params, _, sql = QUERIES[name]
+            if len(args) != len(params):
+                raise SystemExit(f"{name} takes {len(params)} argument(s): {' '.join(params)}")
+            try:
+                args = [int(a) if p == 'min_cols' else a for p, a in zip(params, args)]
+            except ValueError:
+                raise SystemExit(f"min_cols must be a number, not {args[params.index('min_cols')]!r}")
+            cur = db.execute(sql, args)
+        rows = cur.fetchall()
+        return [d[0] for d in cur.description or ()], rows, time.perf_counter() - t0
+    except sqlite3.Error as exc:
+        raise SystemExit(f"query failed: {exc}")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    t0 = time.time()
+    sites = workdir.load('sites-measured.json')
+    endpoints = workdir.load('endpoint-eff.json')
+    graph = workdir.load('call-graph.json')
+    tables = workdir.load('meta-tables.json')
+    reached = write(workdir.path('inventory.sqlite'), sites, endpoints, graph, tables)
+    print(f"inventory.sqlite: {len(sites)} sites, {len(endpoints)} endpoints, {len(graph)} methods, "
+          f"{reached} endpoint-method pairs reached ({time.time() - t0:.1f}s)")
@@ -5,13 +5,78 @@
 route decorator to the method that follows it, skipping any decorators in between. Each used
 to carry its own copy; a copy that drifts is how the handler column silently picks up a guard
 name instead of the method. One implementation, three callers.
+
+Underneath it, the lexer every stage navigates source by. Brace and parenthesis matching,
+comment stripping and the decorator walk used to be separate character loops, each with its own
+partial idea of strings and comments - none knew `${...}` nesting or regex literals. `Tokens`
+lexes a file once; matching a bracket or finding the end of a statement is then a lookup.
 """
 import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 
 DEC = re.compile(r'@(\w+)')
 METH = re.compile(r'(?:public\s+|private\s+|protected\s+)?(?:async\s+)?(\w+)\s*(?:<[^>]*>)?\s*\(')
 CTRL_START = re.compile(r'@Controller\s*\(')
 HTTP = re.compile(r"@(Get|Post|Put|Delete|Patch)\(\s*(?:['\"]([^'\"]*)['\"])?\s*\)")
+CRON = re.compile(r'@DfxCron\s*\(')
+# A class declaration and a method signature at class-body indentation. The site scan and the
+# call-graph walk both split a file along these; a separate copy each was free to disagree on
+# which method a load site belongs to.
+CLASS = re.compile(r'export\s+(?:abstract\s+)?class\s+(\w+)')
+# Possessive whitespace: what follows it cannot start with a space, and backtracking through
+# the indentation of every line made this the costliest pattern of a cold run.
+SIG = re.compile(r'^\s{2,}+(?:public|private|protected)?\s*+(?:async\s+)?(\w+)\s*(?:<[^>]*>)?\s*\(', re.M)
+
+# The anchors the site scan and the call-graph walk read a file by, scanned once per file into
+# the source index's `events` (`scan_events`): every repository read, and every field whose
+# type names what it holds. Both stages used to run them over the file - and the call-graph
+# walk over each method body again - on every run.
+READ_CALL = re.compile(r'\.(find|findOne|findBy|findOneBy|findAndCount|findOneOrFail|'
+                       r'findCached|findCachedBy|findOneCached|findOneCachedBy|'
+                       r'createQueryBuilder|query)\s*\(')
+FIELD = re.compile(r'(?:private|public|protected)\s+(?:readonly\s+)?(\w+)\s*:\s*(\w+)')
+INJECT_REPO = re.compile(r'@InjectRepository\((\w+)\)\s*(?:private|public|protected)?\s*'
+                         r'(?:readonly\s+)?(\w+)')
+# Event kinds. A read is (pos, READ, end, call); a field (pos, FIELD_TYPE, end, name, type); an
+# injected repository (pos, REPO, end, name, entity).
+READ, FIELD_TYPE, REPO = 'read', 'field', 'repo'
+
+
+def scan_events(text):
+    """Every anchor of `READ_CALL`, `FIELD` and `INJECT_REPO` in text, as typed events in
+    source order.
+
+    One pass per pattern rather than one alternation: under Python's `re` a combined pattern
+    measured slower than the three together, and it could not report a match inside another
+    (`this.repo.find(` is a field access and a read). A file without the literal anchor of a
+    pattern is not scanned for it at all.
+    """
+    events = [(m.start(), READ, m.end(), m.group(1)) for m in READ_CALL.finditer(text)]
+    if 'private' in text or 'public' in text or 'protected' in text:
+        events += [(m.start(), FIELD_TYPE, m.end(), m.group(1), m.group(2)) for m in FIELD.finditer(text)]
+    if '@InjectRepository' in text:
+        events += [(m.start(), REPO, m.end(), m.group(2), m.group(1)) for m in INJECT_REPO.finditer(text)]
+    events.sort()
+    return events
+
+
+def injected(events, owner=None):
+    """{field: type} of the fields among events; per class, {class: {field: type}}, when owner
+    maps a position to its class. A repository injected with `@InjectRepository(Entity)` is typed
+    `EntityRepository` - over whatever its declaration says, as the scans always read it."""
+    out = {}
+    for kind in (FIELD_TYPE, REPO):
+        for ev in events:
+            if ev[1] != kind: continue
+            t = ev[4] if kind == FIELD_TYPE else ev[4] + 'Repository'
+            if owner is None:
+                out[ev[3]] = t
+            else:
+                c = owner(ev[0])
+                if c: out.setdefault(c, {})[ev[3]] = t
+    return out
 
 
 def read_text(path):
@@ -20,48 +85,479 @@ def read_text(path):
         return fh.read()
 
 
-def skip_trivia(s, i):
-    """Skip whitespace and comments."""
-    while i < len(s):
-        if s[i] in ' \t\r\n':
+def line_starts(s):
+    """Offset of the first character of every line - the table `line_col` looks positions up in.
+
+    Built once per file. Counting the newlines before every match instead copies a prefix of
+    the file per site and makes a scan quadratic in file length.
+    """
+    starts = [0]
+    i = s.find('\n')
+    while i >= 0:
+        starts.append(i + 1)
+        i = s.find('\n', i + 1)
+    return starts
+
+
+def line_col(starts, pos):
+    """(1-based line, 0-based column) of position pos, from a `line_starts` table."""
+    line = bisect_right(starts, pos)
+    return line, pos - starts[line - 1]
+
+
+# ---- Lexer ----
+# Token kinds. An opening bracket is positive and its close the same number negated, so a
+# bracket's depth bookkeeping is a sign test. INTERP is the `${` ... `}` of a template literal.
+PAREN, BRACKET, BRACE, INTERP = 1, 2, 3, 4
+SEMI, STRING, TEMPLATE, REGEX, LINE_COMMENT, BLOCK_COMMENT = 5, 6, 7, 8, 9, 10
+LITERALS = (STRING, TEMPLATE, REGEX, LINE_COMMENT, BLOCK_COMMENT)
+_OPEN = {'(': PAREN, '[': BRACKET, '{': BRACE}
+_CLOSE = {')': PAREN, ']': BRACKET, '}': BRACE}
+# Everything else - identifiers, operators, whitespace - is skipped in one regex search.
+_NEXT = re.compile(r"//|/\*|[`'\"/(){}\[\];]")
+# The same without the brackets and `;`, for a scan after the literals and comments alone.
+_NEXT_LITERAL = re.compile(r"//|/\*|[`'\"/]")
+# An unterminated quote ends at the line end, as it does for the compiler.
+_QUOTED = {q: re.compile(q + r'(?:[^' + q + r'\\\n]|\\.)*' + q + '?', re.S) for q in '\'"'}
+_TEMPLATE_TEXT = re.compile(r'(?:[^`\\$]|\\.|\$(?!\{))*', re.S)
+_REGEX_LITERAL = re.compile(r'/(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/[A-Za-z]*')
+# After these words a `/` starts a regex literal; after any other identifier it divides.
+_BEFORE_EXPRESSION = frozenset({'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete',
+                                'void', 'throw', 'case', 'do', 'else', 'yield', 'await'})
+
+
+def _regex_allowed(s, i):
+    """Whether a `/` at i starts a regex literal rather than dividing what precedes it."""
+    j = i - 1
+    while j >= 0 and s[j] in ' \t\r\n':
+        j -= 1
+    if j < 0:
+        return True
+    c = s[j]
+    if c in ')]}\'"`':
+        return False
+    if c.isalnum() or c in '_$':
+        k = j
+        while k >= 0 and (s[k].isalnum() or s[k] in '_$'):
+            k -= 1
+        return s[k + 1:j + 1] in _BEFORE_EXPRESSION
+    return True
+
+
+def lex(s, pos=0, brackets=True):
+    """Tokens of s from pos on, as (kind, start, end, depth).
+
+    Only what the stages navigate by is emitted: brackets, `;`, and the literals and comments
+    whose contents must not be mistaken for code - strings, template text, regex literals.
+    `depth` is the bracket depth relative to pos: an opening bracket carries the depth outside
+    it, its close the same depth again. A template literal is split at every `${`, so the
+    code inside an interpolation is lexed like any other and its braces count.
+
+    With brackets false, brackets and `;` are emitted only inside an interpolation, where the
+    `}` closing it has to be found: the literals and comments come out the same, and a scan
+    that wants only those skips the bulk of the tokens.
+    """
+    n, depth, stack, i = len(s), 0, [], pos
+
+    def template(i):
+        # Template text from i - an opening backtick or the `}` of an interpolation - up to
+        # the closing backtick or the next `${`.
+        start = i if s[i] == '`' else i + 1
+        j = _TEMPLATE_TEXT.match(s, i + 1).end()
+        if j < n and s[j] == '`':
+            return (TEMPLATE, start, j + 1, depth), None, j + 1
+        if j < n:
+            return (TEMPLATE, start, j, depth), (INTERP, j, j + 2, depth), j + 2
+        return (TEMPLATE, start, n, depth), None, n
+
+    while True:
+        m = (_NEXT if brackets or stack else _NEXT_LITERAL).search(s, i)
+        if not m:
+            return
+        i, c = m.start(), m.group()
+        if c == '//':
+            e = s.find('\n', i)
+            e = n if e < 0 else e
+            yield LINE_COMMENT, i, e, depth
+            i = e
+        elif c == '/*':
+            e = s.find('*/', i + 2)
+            e = n if e < 0 else e + 2
+            yield BLOCK_COMMENT, i, e, depth
+            i = e
+        elif c in '\'"':
+            e = _QUOTED[c].match(s, i).end()
+            yield STRING, i, e, depth
+            i = e
+        elif c == '/':
+            r = _REGEX_LITERAL.match(s, i) if _regex_allowed(s, i) else None
+            if r:
+                yield REGEX, i, r.end(), depth
+                i = r.end()
+            else:
+                i += 1
+        elif c == '`' or (c == '}' and stack and stack[-1] == INTERP):
+            if c == '}':
+                stack.pop(); depth -= 1
+                yield -INTERP, i, i + 1, depth
+            text, interp, i = template(i)
+            yield text
+            if interp:
+                yield interp
+                stack.append(INTERP); depth += 1
+        elif c == ';':
+            yield SEMI, i, i + 1, depth
+            i += 1
+        elif c in _OPEN:
+            yield _OPEN[c], i, i + 1, depth
+            stack.append(_OPEN[c]); depth += 1
             i += 1
-        elif s.startswith('//', i):
-            nl = s.find('\n', i)
-            i = len(s) if nl < 0 else nl + 1
-        elif s.startswith('/*', i):
-            e = s.find('*/', i)
-            i = len(s) if e < 0 else e + 2
         else:
+            # A close without its open - the scan started inside the group - still counts, and
+            # takes the depth below zero, which is how a caller sees it leave the group.
+            if stack: stack.pop()
+            depth -= 1
+            yield -_CLOSE[c], i, i + 1, depth
+            i += 1
+
+
+class Tokens:
+    """The token stream of one file, in flat arrays, with every bracket paired to its partner.
+
+    Built once per file and kept in the source index. Finding where a bracket closes or a
+    statement ends is then a bisect and an array read rather than a rescan of the characters.
+    """
+
+    def __init__(self, s, stream=None):
+        self.length = len(s)
+        kind, start, end, depth = list(zip(*(lex(s) if stream is None else stream))) or ((),) * 4
+        partner, opens = [-1] * len(kind), []
+        for t, k in enumerate(kind):
+            if 0 < k <= INTERP:
+                opens.append(t)
+            elif k < 0 and opens:
+                o = opens.pop()
+                partner[o], partner[t] = t, o
+        # Four bytes an offset: the stream is pickled into the source index as these buffers.
+        self.kind, self.start, self.end = array('b', kind), array('i', start), array('i', end)
+        self.depth, self.partner = array('i', depth), array('i', partner)
+
+    def __len__(self):
+        return len(self.kind)
+
+    def __getitem__(self, t):
+        return self.kind[t], self.start[t], self.end[t], self.depth[t]
+
+    def __iter__(self):
+        return self.stream(0)
+
+    def stream(self, t):
+        """(kind, start, end, depth) of every token from index t on, as `lex` yields them."""
+        kind, start, end, depth = self.kind, self.start, self.end, self.depth
+        for t in range(t, len(kind)):
+            yield kind[t], start[t], end[t], depth[t]
+
+    def at(self, pos):
+        """Index of the first token that starts at or after pos."""
+        return bisect_left(self.start, pos)
+
+    def matching(self, pos):
+        """Position of the bracket closing the one that opens at pos; the length if none does."""
+        t = self.at(pos)
+        if t < len(self.kind) and self.start[t] == pos and self.partner[t] >= 0:
+            return self.start[self.partner[t]]
+        return self.length
+
+    def statement_end(self, pos):
+        """`statement_end` of position pos."""
+        return _statement_end(self.stream(self.at(pos)), self.length)
+
+def strip_line_comments(s):
+    """Strip line comments only.
+
+    Block comments are kept: what the stages search for never sits in one, and removing them
+    would move line numbers. A line comment stops short of its newline, so line numbers stay
+    identical to the source — every stage keys on the position of a site, by line and column,
+    and the whole join depends on all of them stripping identically. Hence one implementation
+    rather than a copy per stage. The lexer decides what a comment is, so `//` inside a string,
+    a template literal or a regex literal - a URL, a path pattern - is never cut.
+    """
+    return cut(s, line_comments(s))
+
+
+def line_comments(s):
+    """(start, end) of every line comment in s, in order: what `strip_line_comments` cuts."""
+    if '//' not in s:
+        return []
+    spans, last = [], s.rfind('//')
+    for kind, start, end, _ in lex(s, brackets=False):
+        if start > last:
             break
-    return i
+        if kind == LINE_COMMENT:
+            spans.append((start, end))
+    return spans
+
+
+def cut(s, spans):
+    """s without the spans, which are in order and do not overlap."""
+    if not spans:
+        return s
+    parts, i = [], 0
+    for start, end in spans:
+        parts.append(s[i:start])
+        i = end
+    parts.append(s[i:])
+    return ''.join(parts)
+
+
+# What the file cache may hold, in characters of stripped text. More than the whole of `src/`
+# today, so a run never reads a file twice; the bound is for a tree that outgrows it.
+FILE_CACHE_CHARS = 32 << 20
+
+
+class FileCache:
+    """The stripped text and `line_starts` table of recently read files, for every stage of the
+    process.
+
+    `classify.annotate` used to keep every file it touched in a module dict of its own, never
+    evicted and invisible to the stages that had just stripped the same files. Entries are
+    keyed on (source, path), so a file of one commit never answers for another. Past `limit`
+    characters the least recently used go first.
+    """
+
+    def __init__(self, limit=FILE_CACHE_CHARS):
+        self.limit = limit
+        self._entries = OrderedDict()     # (source, path) -> (text, starts)
+        self.size = self.hits = self.misses = self.evicted = 0
+
+    def get(self, key, load):
+        """The entry of key, from load() if it is not held."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = load()
+        self.put(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        """Hold entry, a (text, starts) pair, under key - a stage that stripped a file anyway."""
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old[0])
+        self._entries[key] = entry
+        self.size += len(entry[0])
+        while self.size > self.limit and len(self._entries) > 1:
+            _, (text, _) = self._entries.popitem(last=False)
+            self.size -= len(text)
+            self.evicted += 1
+
+    def discard(self, keys):
+        """Forget keys, whose files changed."""
+        for key in keys:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
 
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
 
-def skip_args(s, i):
+    def report(self):
+        return (f"file cache: {self.hits} hits, {self.misses} misses, {self.evicted} evicted, "
+                f"{len(self._entries)} files held ({self.size / 2**20:.1f} MiB of text)")
+
+
+FILES = FileCache()
+
+
+def stripped(source, path):
+    """(text, line starts) of the file at path as source reads it, line comments stripped -
+    through `FILES`."""
+    def load():
+        text = strip_line_comments(source.read_text(path))
+        return text, line_starts(text)
+    return FILES.get((source, path), load)
+
+
+_SPACE = re.compile(r'[ \t\r\n]*')
+_TRIVIA = re.compile(r'(?:[ \t\r\n]+|//[^\n]*|/\*(?:.*?\*/|.*))*', re.S)
+
+
+def skip_trivia(s, i, tokens=None):
+    """Skip whitespace and comments.
+
+    With the file's `Tokens`, a comment is the token that starts where the whitespace ends, so
+    a `//` the lexer took for part of a string or regex literal is never skipped as one.
+    """
+    if tokens is None:
+        return _TRIVIA.match(s, i).end()
+    while True:
+        i = _SPACE.match(s, i).end()
+        t = tokens.at(i)
+        if t < len(tokens) and tokens.start[t] == i and tokens.kind[t] in (LINE_COMMENT, BLOCK_COMMENT):
+            i = tokens.end[t]
+        else:
+            return i
+
+
+def matching(s, i, tokens=None):
+    """Position of the bracket that closes the one opening at i; len(s) if it never closes.
+
+    With the file's `Tokens` this is a lookup; without, the lexer runs from i to the close.
+    """
+    if tokens is not None:
+        return tokens.matching(i)
+    for kind, start, _, depth in lex(s, i):
+        if kind < 0 and depth <= 0:
+            return start
+    return len(s)
+
+
+def skip_args(s, i, tokens=None):
     """From an opening parenthesis to just past its matching close.
 
     String literals are skipped whole: description texts contain parentheses such as
     "1) Permit signature (ERC-2612)" whose ')' would otherwise unbalance the count.
     """
-    depth = 0
-    while i < len(s):
-        c = s[i]
-        if c in '\'"`':
-            q, i = c, i + 1
-            while i < len(s) and s[i] != q:
-                i += 2 if s[i] == '\\' else 1
-            i += 1
-            continue
-        if c == '(':
-            depth += 1
-        elif c == ')':
-            depth -= 1
-            if depth == 0:
-                return i + 1
-        i += 1
-    return i
+    j = matching(s, i, tokens)
+    return j + 1 if j < len(s) else len(s)
+
+
+def brace(s, i, tokens=None):
+    """Body of the brace group opening at i, and the position of its closing brace."""
+    j = matching(s, i, tokens)
+    return s[i + 1:j], j
+
+
+# The angle brackets of a type argument list, in the code between two tokens. `=>` is an
+# arrow, not a close.
+_ANGLE = re.compile(r'=>|[<>]')
+
+
+def body_start(s, i, tokens=None):
+    """First '{' AFTER the return type annotation, from position i (past the parameter list).
+
+    Read off the token stream: the first `;` (a declaration without a body) or `{` outside any
+    bracket. `Promise<{ data: X; capReached: boolean }>` contains a brace that looks like a
+    method body. Detection rule, exact rather than heuristic: a brace inside an unclosed `<` is
+    part of the type, and so is one whose group is followed immediately by another '{' - a real
+    body never is. The `<` and `>` are counted only in the code between tokens, so none in a
+    string literal of the return type counts. A bracket closing one opened before i ends the
+    search: what looked like a signature was a call inside an argument list. Without tokens,
+    the rest of s is lexed from i.
+    """
+    if tokens is None:
+        tokens = Tokens(s, lex(s, i))
+    kind, start, partner, n = tokens.kind, tokens.start, tokens.partner, len(tokens)
+    lt, t, gap = 0, tokens.at(i), i
+    while t < n:
+        for m in _ANGLE.finditer(s, gap, start[t]):
+            if m.group() == '<': lt += 1
+            elif m.group() == '>' and lt: lt -= 1
+        k = kind[t]
+        if k == SEMI and lt == 0:
+            return -1                          # abstract declaration, no body
+        if k < 0:
+            return -1                          # the group i lies in closes: a call, not a signature
+        if 0 < k <= INTERP:
+            close = partner[t]
+            if close < 0:                      # never closes
+                return start[t] if k == BRACE and lt == 0 else -1
+            if k == BRACE and lt == 0:
+                follows = close + 1
+                if not (follows < n and kind[follows] == BRACE and not s[start[close] + 1:start[follows]].strip()):
+                    return start[t]
+                # a plain object return type: the body is the group that follows
+            t = close                          # a group inside the type is skipped whole
+        gap, t = tokens.end[t], t + 1
+    return -1
 
 
-def decorator_block(s, i):
+def method_body(s, sig_end, tokens=None):
+    """(open, close) of the body of a method whose signature match ends at sig_end.
+
+    The parameter list is skipped first - destructured parameters would otherwise be taken for
+    the body. (-1, -1) for a declaration without one.
+    """
+    ob = body_start(s, skip_args(s, sig_end - 1, tokens), tokens)
+    if ob < 0:
+        return -1, -1
+    return ob, matching(s, ob, tokens)
+
+
+def statement_end(s, i, tokens=None):
+    """End of the statement that position i lies in: its `;`, or the `}` of the enclosing block.
+
+    What a query-builder chain is read to. Brackets opened after i are skipped whole, so a
+    `;` inside a `new Brackets((qb) => { ...; })` callback or a string does not cut the chain
+    short, and nothing bounds its length. Closing a parenthesis opened before i does not end
+    it either: `PROJECTION.apply(this.createQueryBuilder('x'), f).getCount()` is one chain.
+    """
+    if tokens is not None:
+        return tokens.statement_end(i)
+    return _statement_end(lex(s, i), len(s))
+
+
+def _statement_end(stream, limit):
+    # `level` counts the brackets opened since the start; a close with no open of its own
+    # belongs to a bracket around the start.
+    level = 0
+    for kind, start, _, _ in stream:
+        if kind == SEMI:
+            if level == 0: return start
+        elif kind > 0:
+            if kind <= INTERP: level += 1
+        elif level:
+            level -= 1
+        elif kind in (-BRACE, -INTERP):
+            return start
+    return limit
+
+
+# What runs once per element of a collection: a loop, and a callback handed to an array method
+# or to `Util.asyncMap`/`asyncFilter`. `.find(` counts only with a callback - with an object
+# it is the repository read itself.
+LOOP = re.compile(r'\b(for|while)\s*(?:await\s*)?\(|\bdo\s*\{')
+PER_ELEMENT = re.compile(
+    r'\.(?:map|flatMap|forEach|filter|reduce|some|every|find|findIndex)\s*(\()\s*'
+    r'(?:async\s*)?(?:\([^()]*\)\s*(?::\s*[^=]+?)?=>|[\w$]+\s*=>|function\b)'
+    r'|\b(?:asyncMap|asyncFilter)\s*(\()')
+
+
+def in_literal(tokens, pos):
+    """Whether pos lies inside a string, template text, regex literal or comment."""
+    t = bisect_right(tokens.start, pos) - 1
+    return t >= 0 and tokens.kind[t] in LITERALS and pos < tokens.end[t]
+
+
+def per_item_regions(s, lo, hi, tokens=None):
+    """[(start, end)] of the parts of s[lo:hi] that run once per element, in order.
+
+    A `for` loop's body - its header runs once, so `for (const x of await this.repo.find())`
+    reads once - a `while` loop's condition and body, a `do` block, and the argument list of
+    a per-element callback. A load site or a call inside one of them runs once per row.
+    """
+    out = []
+    for m in LOOP.finditer(s, lo, hi):
+        if tokens is not None and in_literal(tokens, m.start()): continue
+        if m.group(1):
+            close = matching(s, m.end() - 1, tokens)
+            body = skip_trivia(s, close + 1, tokens)
+            end = matching(s, body, tokens) if s.startswith('{', body) else statement_end(s, body, tokens)
+            out.append((m.start() if m.group(1) == 'while' else close, min(end, hi)))
+        else:
+            out.append((m.end() - 1, min(matching(s, m.end() - 1, tokens), hi)))
+    for m in PER_ELEMENT.finditer(s, lo, hi):
+        if tokens is not None and in_literal(tokens, m.start()): continue
+        paren = m.start(1) if m.group(1) else m.start(2)
+        out.append((paren, min(matching(s, paren, tokens), hi)))
+    return sorted(out)
+
+
+def decorator_block(s, i, tokens=None):
     """Text of every decorator between a route decorator and the method signature.
 
     Returns (block_text, position_after_block). Bracket counting rather than a fixed line
@@ -70,29 +566,29 @@ def decorator_block(s, i):
     """
     start = i
     while True:
-        i = skip_trivia(s, i)
+        i = skip_trivia(s, i, tokens)
         d = DEC.match(s, i)
         if not d:
             break
-        j = skip_trivia(s, d.end())
-        i = skip_args(s, j) if j < len(s) and s[j] == '(' else d.end()
+        j = skip_trivia(s, d.end(), tokens)
+        i = skip_args(s, j, tokens) if j < len(s) and s[j] == '(' else d.end()
     return s[start:i], i
 
 
-def block_and_handler(s, i):
+def block_and_handler(s, i, tokens=None):
     """(decorator block, handler name) starting at the end of a route decorator.
 
     The handler is `None` when no method signature follows — callers decide whether that is
     a hard error or a placeholder.
     """
-    block, i = decorator_block(s, i)
+    block, i = decorator_block(s, i, tokens)
     m = METH.match(s, i)
     return block, (m.group(1) if m else None)
 
 
-def controller_arg(s, i):
+def controller_arg(s, i, tokens=None):
     """Argument text of an `@Controller(` whose opening parenthesis is at i."""
-    return s[i + 1:skip_args(s, i) - 1].strip()
+    return s[i + 1:skip_args(s, i, tokens) - 1].strip()
 
 
 def scope_path(arg):
@@ -105,8 +601,32 @@ def scope_path(arg):
     return arg.strip('\'"')
 
 
+class IntervalIndex:
+    """Which of a file's declarations a position lies under, by bisection.
+
+    Built from (position, value) pairs in source order. Each pair opens an interval that runs
+    to the next one's position: the value at pos is that of the last pair *before* pos - the
+    class a load site sits in, the method, the `@Controller` scope of a route. Every caller
+    used to walk its list from the start for every position it asked about, which is
+    declarations times lookups per file.
+    """
+
+    def __init__(self, pairs):
+        pairs = list(pairs)
+        self.starts = [p for p, _ in pairs]
+        self.values = [v for _, v in pairs]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def at(self, pos, default=None):
+        """The value in effect at pos, or default before the first pair."""
+        i = bisect_left(self.starts, pos)
+        return self.values[i - 1] if i else default
+
+
 def controller_scopes(s):
-    """Every `@Controller` in a file as (position, base path, class name).
+    """Every `@Controller` in a file, as an `IntervalIndex` of (base path, class name).
 
     A file may declare more than one controller class, and a route belongs to the scope that
     *precedes* it — `custody.controller.ts` declares both `custody` and `custody/admin`.
@@ -115,19 +635,13 @@ def controller_scopes(s):
     for m in CTRL_START.finditer(s):
         arg = controller_arg(s, m.end() - 1)
         km = re.search(r'export\s+class\s+(\w+)', s[m.end():m.end() + 400])
-        scopes.append((m.start(), scope_path(arg), km.group(1) if km else None))
-    return scopes
+        scopes.append((m.start(), (scope_path(arg), km.group(1) if km else None)))
+    return IntervalIndex(scopes)
 
 
 def scope_at(scopes, pos):
-    """The (base path, class name) in effect at position pos."""
-    base, cls = '', None
-    for spos, b, c in scopes:
-        if spos < pos:
-            base, cls = b, c
-        else:
-            break
-    return base, cls
+    """The (base path, class name) in effect at position pos, from `controller_scopes`."""
+    return scopes.at(pos, ('', None))
 
 
 def full_path(base, path):
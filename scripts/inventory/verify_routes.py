@@ -10,17 +10,18 @@ script carried its own copy of the route scan, with the handler detection bug th
 into the *previous* handler's decorators. A verifier that re-derives what it verifies with
 weaker rules cannot confirm anything.
 """
-import json, os, sys
+import os, sys
+
+import workdir
 
 SP = os.environ.get("INVENTORY_WORK")
 if not SP:
     raise SystemExit("INVENTORY_WORK is not set - run the pipeline through scripts/inventory/run.sh first")
 
-table = SP + '/table.json'
-if not os.path.exists(table):
-    raise SystemExit(f"{table} is missing - run scripts/inventory/run.sh first")
-with open(table) as fh:
-    rows = json.load(fh)
+table = workdir.locate(SP, 'table.json')
+if not table:
+    raise SystemExit(f"{SP}/table.json is missing - run scripts/inventory/run.sh first")
+rows = workdir.read(table, ('verb', 'path'))
 
 mine = {(r['verb'], r['path']) for r in rows}
 print(f"routes from the code:            {len(rows)} ({len(mine)} distinct verb/path pairs)")
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""`inventory.py watch`: the inventory kept in memory while `src/` is being edited.
+
+Converting a read path to a projection used to end with a full chain run to learn whether the
+conversion registered. Here the chain runs once, and what it built stays in this process: the
+source index, the call-graph facts of every file, the graph and its summaries, the measured
+sites. Every save then costs only what it touches:
+
+  - the changed files are dropped from the index and parsed again;
+  - `sites.py` rescans them and, for a controller, the route-table steps reread it - both
+    through an incremental plan against this session's own work directory (`incremental.py`);
+  - a site whose file changed but that is otherwise the same keeps its measurement; the new
+    ones go to `measure.js`, against `dist/` as it is (`npm run start:dev` keeps it current);
+  - the call-graph facts of the changed files are taken again, and the edges of every method
+    that was defined there or resolved a call through one of its classes;
+  - if no edge changed, `Summary.update` re-propagates from the changed methods upward and stops
+    where a summary comes out the same. A changed edge builds the graph anew (`callgraph.py`).
+
+After each save it prints every endpoint whose `Data access` or `Max cols` moved, and how many
+more reach the change without either moving:
+
+    [watch] src/subdomains/core/buy-crypto/process/services/buy-crypto.service.ts
+      GET    /buy/:id/history                      Data access whole rows -> projected, Max cols 497 -> 12
+    [watch] 1 file in 0.3s: 41 methods re-analysed, 6 endpoints reach them, 1 changed
+
+`src/` is watched through inotify where the kernel has it. Elsewhere - macOS, or a mount that
+does not pass inotify events on - it is polled once a second; `--poll` asks for that outright.
+Nothing is written to `docs/`, and the `Spec` column is not followed.
+"""
+import contextlib, ctypes, ctypes.util, importlib, io, json, operator, os, pickle, select, struct, subprocess, \
+    sys, tempfile, time, traceback
+
+import classify
+import inventory
+import workdir
+from callgraph import CallGraph, Summary
+from srcindex import cache_dir, shared
+from tsparse import rel_path, src_path
+
+# Quiet time after an event before a change is analysed: an editor's save is several events.
+SETTLE_S = 0.15
+# How often `Poller` looks at the tree.
+POLL_S = 1.0
+# Endpoints listed per save; the count is always printed.
+SHOWN = 40
+
+IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x8, 0x40, 0x80, 0x100, 0x200
+IN_Q_OVERFLOW, IN_ISDIR = 0x4000, 0x40000000
+IN_NONBLOCK, IN_CLOEXEC = 0o4000, 0o2000000
+EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """Every directory under root watched through inotify, read through ctypes.
+
+    `changes` returns the paths that changed: `.ts` files, and directories that appeared or went
+    away whole. After an overflow of the kernel's queue it returns root itself.
+    """
+
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, root):
+        self.root = root
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("no inotify in this C library")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        try:
+            self._add_tree(root)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _add_tree(self, top):
+        for d, _, _ in os.walk(top):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), self.MASK)
+            if wd < 0:
+                # ENOSPC: the user's watch limit (fs.inotify.max_user_watches) is reached.
+                raise OSError(ctypes.get_errno(), f"cannot watch {d}: {os.strerror(ctypes.get_errno())}")
+            self.dirs[wd] = d
+
+    def changes(self, timeout=None):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        out = set()
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return out
+            i = 0
+            while i < len(data):
+                wd, mask, _, n = EVENT.unpack_from(data, i)
+                name = data[i + EVENT.size:i + EVENT.size + n].rstrip(b'\0')
+                i += EVENT.size + n
+                if mask & IN_Q_OVERFLOW:
+                    out.add(self.root)
+                    continue
+                if wd not in self.dirs:
+                    continue
+                p = os.path.join(self.dirs[wd], os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(p):
+                        self._add_tree(p)
+                    out.add(p)
+                elif p.endswith('.ts'):
+                    out.add(p)
+
+    def close(self):
+        os.close(self.fd)
+
+    def describe(self):
+        return f"inotify, {len(self.dirs)} directories"
+
+
+class Poller:
+    """The same, by comparing the size and modification time of every `.ts` file."""
+
+    def __init__(self, root, interval=POLL_S):
+        self.root, self.interval = root, interval
+        self.seen = self._scan()
+
+    def _scan(self):
+        out = {}
+        for d, _, names in os.walk(self.root):
+            for n in names:
+                if n.endswith('.ts'):
+                    p = os.path.join(d, n)
+                    try:
+                        st = os.stat(p)
+                    except OSError:
+                        continue
+                    out[p] = (st.st_mtime_ns, st.st_size)
+        return out
+
+    def changes(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(self.interval if deadline is None else max(0.0, min(self.interval, deadline - time.monotonic())))
+            now = self._scan()
+            out = {p for p in now.keys() | self.seen.keys() if now.get(p) != self.seen.get(p)}
+            self.seen = now
+            if out or (deadline is not None and time.monotonic() >= deadline):
+                return out
+
+    def close(self):
+        pass
+
+    def describe(self):
+        return f"polling every {self.interval:g}s"
+
+
+def watcher(root, poll=False):
+    """Inotify over root where it can be had, polling otherwise."""
+    if not poll:
+        try:
+            return Inotify(root)
+        except (OSError, AttributeError) as exc:
+            print(f"[watch] inotify not available ({exc}) - polling instead")
+    return Poller(root)
+
+
+def _signature(site):
+    """What a site is, apart from where: a site that keeps it keeps its measurement."""
+    return json.dumps({k: v for k, v in site.items() if k not in ('line', 'col')}, sort_keys=True)
+
+
+def _fmt(cols):
+    return cols or '—'
+
+
+class Session:
+    """One chain run over src into work, kept up to date file by file.
+
+    `steps` and `measure` stand in for the chain and for `measure.js` - the self-test passes its
+    own; `measure(sites)` returns the sites with their measurement, in order.
+    """
+
+    def __init__(self, src, work, dist=None, steps=None, measure=None, cache=None):
+        self.src, self.work, self.dist = src, work, dist
+        self.measure = measure or self._measure_js
+        steps = steps or [s for s in inventory.STEPS
+                          if s.name not in ('index_coverage', 'eager_impact', 'cron_load', 'store', 'build_docs')]
+        inventory.execute(steps, src, work, dist, cache)
+        self.pending = set()
+        with self._environment():
+            self.index = shared(src)
+            # Imported, not run: the stage's functions over this session's index.
+            ee = sys.modules.get('endpoint_eff')
+            self.ee = importlib.reload(ee) if ee else importlib.import_module('endpoint_eff')
+            with open(os.path.join(work, 'endpoint-facts.pickle'), 'rb') as fh:
+                self.facts = pickle.load(fh)
+            self.sites = workdir.load('sites.json')
+            self.measured = workdir.load('sites-measured.json')
+            self.routes = workdir.load('table.json')
+        (self.inject, self.methods, self.direct, self.sites_of, self.regions,
+         self.looped) = self.ee.merge_facts(self.facts)
+        self.edges, self.local_ok, self.through, self.per_row = self.ee.call_edges(
+            self.methods, self.inject, self.regions)
+        self.meas = self.ee.measurements(self.measured)
+        self._propagate()
+
+    @contextlib.contextmanager
+    def _environment(self):
+        env = {'API_SRC': self.src, 'INVENTORY_WORK': self.work, **({'DIST': self.dist} if self.dist else {})}
+        saved = {k: os.environ.get(k) for k in (*env, 'INVENTORY_PLAN')}
+        os.environ.update(env)
+        try:
+            yield
+        finally:
+            for k, v in saved.items():
+                if v is None: os.environ.pop(k, None)
+                else: os.environ[k] = v
+
+    def _propagate(self):
+        """The graph and its four summaries, from scratch."""
+        self.graph = CallGraph(self.local_ok, self.edges)
+        kinds, maxcol = self.ee.local_values(self.local_ok, self.direct, self.sites_of, self.meas)
+        self.kinds = Summary(self.graph, kinds, operator.or_)
+        self.ok = Summary(self.graph, self.local_ok, operator.and_)
+        self.maxcol = Summary(self.graph, maxcol, max)
+        self.per_item = self.ee.PerItem(self.graph, self.kinds, self.looped, self.per_row, self.sites_of)
+
+    def endpoints(self):
+        """The rows `endpoint-eff.json` would hold now, without `spec`."""
+        return [self.ee.endpoint_row(r, self.kinds, self.ok, self.maxcol, self.per_item) for r in self.routes]
+
+    def _view(self):
+        return {(e['verb'], e['path'], e['version']): (classify.access(e), e['maxcol']) for e in self.endpoints()}
+
+    # -- one save ---------------------------------------------------------------------------
+
+    def apply(self, paths):
+        """Bring the session up to date with the changed paths (files or directories) and print
+        what moved. Returns the changed endpoints as {(verb, path, version): (before, after)}."""
+        t0 = time.perf_counter()
+        rels = self._expand(paths) | self.pending
+        if not rels:
+            return {}
+        try:
+            changed, counts = self._apply(rels)
+        except (SystemExit, Exception) as exc:
+            # The state stays that of the last analysis that went through; the files are taken
+            # again with the next save.
+            self.pending = rels
+            if not isinstance(exc, SystemExit):
+                traceback.print_exc()
+            print(f"[watch] analysis failed: {exc} - save again to retry")
+            return {}
+        self.pending = set()
+        for r in sorted(rels)[:5]:
+            print(f"[watch] {r}")
+        if len(rels) > 5:
+            print(f"[watch] ... and {len(rels) - 5} more")
+        for (verb, path, version), (before, after) in sorted(changed.items())[:SHOWN]:
+            label = f"{verb:6s} {path}" + (f" (v{version})" if version not in ('1', None) else '')
+            if before is None:
+                print(f"  {label:44s} new: Data access {after[0]}, Max cols {_fmt(after[1])}")
+            elif after is None:
+                print(f"  {label:44s} gone")
+            else:
+                moves = [f"{what} {_fmt(a)} -> {_fmt(b)}"
+                         for what, a, b in (('Data access', before[0], after[0]), ('Max cols', before[1], after[1]))
+                         if a != b]
+                print(f"  {label:44s} {', '.join(moves)}")
+        if len(changed) > SHOWN:
+            print(f"  ... and {len(changed) - SHOWN} more")
+        methods, reaching = counts
+        print(f"[watch] {len(rels)} file{'s' if len(rels) != 1 else ''} in {time.perf_counter() - t0:.1f}s: "
+              f"{methods} methods re-analysed, {reaching} endpoints reach them, {len(changed)} changed")
+        return changed
+
+    def _expand(self, paths):
+        """`src/...` paths of the `.ts` files among paths, and of those in or once in a directory
+        among them."""
+        known = self.index.paths()
+        out = set()
+        for p in paths:
+            if p.endswith('.ts'):
+                out.add(p)
+                continue
+            prefix = p.rstrip('/') + '/'
+            out.update(f for f in known if f.startswith(prefix))
+            out.update(os.path.join(d, n) for d, _, names in os.walk(p) for n in names if n.endswith('.ts'))
+        return {rel_path(self.src, p) for p in out}
+
+    def _apply(self, rels):
+        ee = self.ee
+        files = [src_path(self.src, r) for r in sorted(rels)]
+        before = self._view()
+        # The stages read through the process's shared index. A chain run in this process since
+        # (`execute`) releases it, so whichever is current now is the one to refresh.
+        with self._environment():
+            self.index = self.ee.INDEX = shared(self.src)
+        self.index.refresh(files)
+        routes_changed = any(r.endswith('.controller.ts') for r in rels)
+        with self._environment():
+            with open(os.path.join(self.work, 'plan.json'), 'w') as fh:
+                json.dump({'prev': self.work, 'changed': sorted(rels)}, fh)
+            os.environ['INVENTORY_PLAN'] = os.path.join(self.work, 'plan.json')
+            log = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(log):
+                    scripts = ['sites.py'] + (['make_table.py', 'fix_handlers.py', 'add_version_deprecated.py']
+                                              if routes_changed else [])
+                    for script in scripts:
+                        inventory.stage(script)()
+            except SystemExit:
+                print(log.getvalue()[-2000:], end='')
+                raise
+            sites = workdir.load('sites.json')
+            routes = workdir.load('table.json') if routes_changed else self.routes
+            measured = self._remeasure(sites)
+            workdir.save('sites-measured.json', measured)
+            scanned = [f for f in files if self.index.source.exists(f) and '__tests__' not in f and '.spec.' not in f]
+            fresh = {rel_path(self.src, f): ee.file_facts(f) for f in scanned}
+
+        # What the changed files defined, before and after.
+        old = [self.facts[r] for r in rels if r in self.facts]
+        facts = {r: v for r, v in self.facts.items() if r not in rels}
+        facts.update(fresh)
+        inject, methods, direct, sites_of, regions, looped = ee.merge_facts(facts)
+        defined = {(c, m) for f in (*old, *fresh.values()) for c, ms in f['methods'].items() for m in ms}
+        classes = {c for f in (*old, *fresh.values()) for part in ('methods', 'inject') for c in f[part]}
+        moved = {c for c in classes
+                 if set(methods.get(c, {})) != set(self.methods.get(c, {})) or inject.get(c) != self.inject.get(c)}
+        # Methods whose edges can have changed: those defined in the changed files, and those that
+        # resolved a call through a class whose fields or methods changed.
+        again = defined | {k for k, through in self.through.items() if through & moved}
+        alive = {k for k in again if k[1] in methods.get(k[0], {})}
+        edges, local_ok, through, per_row = ee.call_edges(methods, inject, regions, alive)
+        structural = alive != {k for k in again if k in self.local_ok} or any(
+            edges.get(k, set()) != self.edges.get(k, set()) for k in alive)
+        meas = ee.measurements(measured)
+        moved_sites = {s for s in meas.keys() | self.meas.keys() if meas.get(s) != self.meas.get(s)}
+        touched = again | {k for k, ss in sites_of.items() if ss & moved_sites}
+
+        # Committed only now: a failure above leaves the session as it was.
+        for k in again:
+            self.edges.pop(k, None)
+            self.local_ok.pop(k, None)
+            self.through.pop(k, None)
+            self.per_row.pop(k, None)
+        self.edges.update(edges)
+        self.local_ok.update(local_ok)
+        self.through.update(through)
+        self.per_row.update(per_row)
+        self.facts, self.sites, self.measured, self.routes, self.meas = facts, sites, measured, routes, meas
+        self.inject, self.methods, self.direct, self.sites_of = inject, methods, direct, sites_of
+        self.regions, self.looped = regions, looped
+        if structural:
+            self._propagate()
+        else:
+            alive = {k for k in touched if k in self.local_ok}
+            kinds, maxcol = ee.local_values(alive, direct, sites_of, meas)
+            self.kinds.update(kinds)
+            self.ok.update({k: self.local_ok[k] for k in alive})
+            self.maxcol.update(maxcol)
+            # Which calls run per row moves with the edges; what they reach, with the kinds.
+            # Rebuilt whole: one pass over the condensation, cheaper than tracking both.
+            self.per_item = ee.PerItem(self.graph, self.kinds, looped, self.per_row, sites_of)
+
+        after = self._view()
+        changed = {k: (before.get(k), after.get(k)) for k in before.keys() | after.keys()
+                   if before.get(k) != after.get(k)}
+        upstream = self.graph.reaching(touched)
+        reaching = sum(1 for r in self.routes if (r['controller'], r['handler']) in upstream)
+        return changed, (len(touched), reaching)
+
+    def _remeasure(self, sites):
+        """The sites with their measurements: the one each had where it is the same site, a fresh
+        one for the others."""
+        kept = {}
+        for s, m in zip(self.sites, self.measured):
+            kept.setdefault((s['file'], _signature(s)), []).append(m)
+        out, new = [], []
+        for s in sites:
+            same = kept.get((s['file'], _signature(s)))
+            if same:
+                m = same.pop(0)
+                out.append({**m, 'line': s['line'], 'col': s['col']})
+            else:
+                out.append(None)
+                new.append(s)
+        if new:
+            print(f"[watch] measuring {len(new)} new site(s)")
+            fresh = iter(self.measure(new))
+            out = [m if m is not None else next(fresh) for m in out]
+        return out
+
+    def _measure_js(self, sites):
+        """`measure.js` over sites. Where it fails they stay unmeasured, and say why."""
+        with tempfile.TemporaryDirectory() as tmp:
+            names = [os.path.join(tmp, n) for n in ('sites.json', 'measured.json', 'tables.json')]
+            with open(names[0], 'w') as fh:
+                json.dump(sites, fh)
+            r = subprocess.run(['node', os.path.join(inventory.HERE, 'measure.js'), *names], capture_output=True,
+                               text=True, env=dict(os.environ, DIST=self.dist or '', INVENTORY_CACHE=cache_dir()))
+            if r.returncode == 0:
+                with open(names[1]) as fh:
+                    return json.load(fh)
+        why = (r.stderr.strip().splitlines() or [f'exit {r.returncode}'])[-1]
+        print(f"[watch] measure.js: {why} - {len(sites)} site(s) left unmeasured")
+        return [dict(s, error=f'not measured: {why}') for s in sites]
+
+    # -- the loop ---------------------------------------------------------------------------
+
+    def run(self, source):
+        """Apply every change source reports, until interrupted."""
+        print(f"[watch] watching {self.src} ({source.describe()}) - Ctrl-C to stop")
+        try:
+            while True:
+                changed = source.changes()
+                while True:
+                    more = source.changes(SETTLE_S)
+                    if not more: break
+                    changed |= more
+                self.apply(changed)
+        except KeyboardInterrupt:
+            print()
+        finally:
+            source.close()
+
+
+def main(args):
+    src, dist = os.path.join(inventory.ROOT, 'src'), os.path.join(inventory.ROOT, 'dist')
+    if not os.path.isdir(dist):
+        raise SystemExit("dist/ not found - run `npm run build` first")
+    if os.environ.get('INVENTORY_REF'):
+        raise SystemExit("watch follows the working tree - unset INVENTORY_REF")
+    work = tempfile.mkdtemp()
+    print(f"work directory: {work} (kept after the session; remove it when you are done)")
+    if args.jobs:
+        os.environ['INVENTORY_JOBS'] = args.jobs
+    os.environ.pop('INVENTORY_PLAN', None)
+    t0 = time.time()
+    session = Session(src, work, dist, cache=None if args.no_cache else inventory.StepCache())
+    print(f"[watch] {len(session.routes)} endpoints, {len(session.local_ok)} methods in memory "
+          f"after {time.time() - t0:.1f}s")
+    session.run(watcher(src, poll=args.poll))
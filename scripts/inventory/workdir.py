@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""The work directory the stages hand their results over in.
+
+Every stage writes what it produces to `$INVENTORY_WORK` as indented JSON, and that stays the
+record of a run: `measure.js` reads it, the incremental runs save it, and it is what anyone
+inspecting a run looks at. When the stages run in one process (`inventory.py run`), what a
+stage saves is also kept in memory, and the next stage that loads it gets the object itself
+rather than parsing the file again.
+
+`INVENTORY_FORMAT=columnar` (`inventory.py run --format columnar`) writes the four tables -
+sites, measured sites, routes, endpoints - in the columnar layout of `colstore.py` instead, as
+`<name>.col`; the stages ask for a table by its `.json` name either way, and a reader that
+names its `columns` decompresses only those.
+
+Whoever loads an object owns it from then on: `fix_handlers.py` edits the rows it loaded and
+saves them under the same name. Anything that changes a file behind the stages' back - a child
+process, a restore from the step cache - must `forget` it.
+"""
+import json, os
+
+import colstore
+
+# The tables the columnar format applies to. Everything else stays JSON.
+TABLES = frozenset({'sites.json', 'sites-measured.json', 'table.json', 'endpoint-eff.json'})
+FORMATS = ('json', 'columnar')
+
+_LIVE = {}
+
+
+def work():
+    """The work directory of this run."""
+    sp = os.environ.get("INVENTORY_WORK")
+    if not sp:
+        raise SystemExit("INVENTORY_WORK is not set - run this through scripts/inventory/run.sh")
+    return sp
+
+
+def current_format():
+    f = os.environ.get('INVENTORY_FORMAT') or 'json'
+    if f not in FORMATS:
+        raise SystemExit(f"INVENTORY_FORMAT must be one of {', '.join(FORMATS)}, not {f!r}")
+    return f
+
+
+def filename(name):
+    """The file a result is stored in, in the format of this run."""
+    return name[:-len('.json')] + '.col' if name in TABLES and current_format() == 'columnar' else name
+
+
+def path(name):
+    return os.path.join(work(), filename(name))
+
+
+def locate(directory, name):
+    """The file of name in a directory written by any run, whatever its format; None if absent."""
+    for candidate in (name, name[:-len('.json')] + '.col') if name in TABLES else (name,):
+        p = os.path.join(directory, candidate)
+        if os.path.exists(p):
+            return p
+    return None
+
+
+def read(p, columns=None):
+    """The result stored at p, in either format. `columns` narrows a columnar read."""
+    if p.endswith('.col'):
+        return colstore.read(p, columns)
+    with open(p) as fh:
+        return json.load(fh)
+
+
+def load(name, columns=None):
+    """The result saved under name, from memory if this process saved it.
+
+    `columns` names the keys the caller uses. A columnar file then decompresses only those;
+    from JSON or from memory the records come whole.
+    """
+    p = path(name)
+    if p in _LIVE:
+        return _LIVE[p]
+    return read(p, columns)
+
+
+def save(name, data):
+    """Write data under name and keep it for the stages after this one."""
+    p = path(name)
+    if p.endswith('.col'):
+        colstore.write(p, data)
+    else:
+        with open(p, 'w') as fh:
+            json.dump(data, fh, indent=1)
+    _LIVE[p] = data
+
+
+def forget(name):
+    """Drop the kept copy of name; the next load reads the file."""
+    _LIVE.pop(path(name), None)